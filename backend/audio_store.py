@@ -0,0 +1,197 @@
+"""Local audio files: streaming upload and byte-range serving.
+
+Uploads are written to AUDIO_DIR chunk by chunk as the request body
+arrives (``write_stream``), so memory use does not depend on file size.
+Each upload goes to a fresh file name and only replaces the track's audio
+once it is complete, so readers never see a partial file.
+
+``AudioResponse`` serves a file, or one byte range of it (206 Partial
+Content), which is what ``<audio>`` elements request when seeking.  When
+the server supports the ASGI zero-copy extension the bytes go out with
+sendfile; otherwise they are sent as slices of a read-only mmap, so
+nothing is read into Python buffers first.
+
+Configuration (environment):
+
+    AUDIO_DIR         where audio files are stored (default: ./audio)
+    AUDIO_MAX_BYTES   largest accepted upload (default: 200 MiB)
+    AUDIO_CHUNK_SIZE  bytes per write / per body message (default: 256 KiB)
+"""
+import asyncio
+import mmap
+import os
+import struct
+import uuid
+import wave
+
+from starlette.responses import Response
+
+AUDIO_DIR = os.environ.get('AUDIO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio'))
+AUDIO_MAX_BYTES = int(os.environ.get('AUDIO_MAX_BYTES', 200 * 1024 * 1024))
+AUDIO_CHUNK_SIZE = int(os.environ.get('AUDIO_CHUNK_SIZE', 256 * 1024))
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded AUDIO_MAX_BYTES."""
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the file."""
+
+
+def audio_path(name):
+    return os.path.join(AUDIO_DIR, name)
+
+
+def remove(name):
+    try:
+        os.remove(audio_path(name))
+    except FileNotFoundError:
+        pass
+
+
+async def write_stream(chunks, max_bytes=AUDIO_MAX_BYTES):
+    """Write an async iterable of byte chunks to a new file; return ``(name, size)``."""
+    os.makedirs(AUDIO_DIR, exist_ok=True)
+    name = uuid.uuid4().hex
+    path = audio_path(name)
+    size = 0
+    pending = []
+    pending_size = 0
+    with open(path, 'wb') as f:
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                pending.append(chunk)
+                pending_size += len(chunk)
+                # Network chunks are small; hand the disk writes to a thread in larger pieces
+                if pending_size >= AUDIO_CHUNK_SIZE:
+                    await asyncio.to_thread(f.write, b"".join(pending))
+                    pending, pending_size = [], 0
+            if pending:
+                await asyncio.to_thread(f.write, b"".join(pending))
+        except BaseException:
+            f.close()
+            remove(name)
+            raise
+    return name, size
+
+
+_MP3_BITRATES = {
+    # (MPEG version 1, layer III) and (MPEG 2/2.5, layer III), kbit/s
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+
+def _mp3_duration(path, size):
+    # Estimate from the first frame's bitrate; exact for constant-bitrate files
+    with open(path, 'rb') as f:
+        head = f.read(64 * 1024)
+    offset = 0
+    if head[:3] == b"ID3" and len(head) >= 10:
+        b = head[6:10]
+        offset = 10 + ((b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3])
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            head = f.read(64 * 1024)
+        size -= offset
+    for i in range(len(head) - 4):
+        if head[i] != 0xFF or head[i + 1] & 0xE0 != 0xE0:
+            continue
+        (header,) = struct.unpack(">I", head[i:i + 4])
+        version = (header >> 19) & 3   # 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5
+        layer = (header >> 17) & 3     # 1 = layer III
+        bitrate_index = (header >> 12) & 0xF
+        if layer != 1 or version == 1 or bitrate_index in (0, 15):
+            continue
+        kbps = _MP3_BITRATES[1 if version == 3 else 2][bitrate_index]
+        return (size - i) * 8 / (kbps * 1000)
+    return None
+
+
+def probe_duration(path, content_type):
+    """Best-effort duration in seconds for WAV and MP3 files, else None."""
+    try:
+        if content_type in ("audio/wav", "audio/x-wav", "audio/wave", "audio/vnd.wave"):
+            with wave.open(path, 'rb') as w:
+                return w.getnframes() / float(w.getframerate())
+        if content_type in ("audio/mpeg", "audio/mp3"):
+            return _mp3_duration(path, os.path.getsize(path))
+    except (wave.Error, EOFError, OSError, struct.error, ZeroDivisionError):
+        pass
+    return None
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` (inclusive) for a single-range header, or None to send the whole file."""
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        # Multipart ranges aren't worth the complexity; send everything
+        return None
+    first, _, last = spec.partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def file_etag(path):
+    stat = os.stat(path)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+class AudioResponse(Response):
+    """Sends ``path[start:end + 1]`` without reading it into Python buffers."""
+
+    def __init__(self, path, content_type, byte_range=None, headers=None, chunk_size=AUDIO_CHUNK_SIZE):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.start, self.end = byte_range if byte_range else (0, self.size - 1)
+        self.chunk_size = chunk_size
+        self.status_code = 206 if byte_range else 200
+        self.media_type = content_type
+        self.background = None
+        headers = dict(headers or {}, **{
+            "content-type": content_type,
+            "content-length": str(self.end - self.start + 1),
+            "accept-ranges": "bytes",
+        })
+        if byte_range:
+            headers["content-range"] = f"bytes {self.start}-{self.end}/{self.size}"
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        length = self.end - self.start + 1
+        if scope["method"] == "HEAD" or length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            await self._send_file(scope, send, length)
+        if self.background is not None:
+            await self.background()
+
+    async def _send_file(self, scope, send, length):
+        with open(self.path, 'rb') as f:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopy", "file": f, "offset": self.start, "count": length})
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for offset in range(self.start, self.end + 1, self.chunk_size):
+                    stop = min(offset + self.chunk_size, self.end + 1)
+                    with view[offset:stop] as chunk:
+                        await send({"type": "http.response.body", "body": chunk, "more_body": stop <= self.end})
@@ -0,0 +1,110 @@
+"""Caches for verified access tokens and user principals.
+
+Verifying a JWT costs an HMAC and JSON parsing on every authenticated
+request, and ``/api/auth/me`` adds a users lookup on top.  Polling clients
+send the same token over and over, so verified tokens are remembered until
+their own ``exp`` and principals (username/email) for a short TTL.  Both
+are dropped as soon as the user changes through ``invalidate_user``.
+
+Configuration (environment):
+
+    TOKEN_CACHE_SIZE      verified tokens kept (default: 10000)
+    PRINCIPAL_CACHE_SIZE  user principals kept (default: 10000)
+    PRINCIPAL_CACHE_TTL   seconds a principal is trusted (default: 60)
+"""
+import os
+import time
+from collections import OrderedDict
+
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 60))
+
+
+class ExpiringCache:
+    """Bounded LRU whose entries carry their own expiry (epoch seconds)."""
+
+    def __init__(self, maxsize, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, now=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= (now if now is not None else time.time()):
+            del self._data[key]
+            if self.on_evict:
+                self.on_evict(key, value)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, expires_at):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted_key, (evicted, _) = self._data.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(evicted_key, evicted)
+
+    def pop(self, key):
+        entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class AuthCache:
+    def __init__(self, max_tokens=TOKEN_CACHE_SIZE, max_principals=PRINCIPAL_CACHE_SIZE,
+                 principal_ttl=PRINCIPAL_CACHE_TTL):
+        self.tokens = ExpiringCache(max_tokens, on_evict=self._forget_token)
+        self.principals = ExpiringCache(max_principals)
+        self.principal_ttl = principal_ttl
+        self._tokens_by_user = {}
+
+    def get_token(self, token):
+        """Return the username for an already verified, unexpired token."""
+        return self.tokens.get(token)
+
+    def put_token(self, token, username, exp):
+        self.tokens.put(token, username, exp)
+        self._tokens_by_user.setdefault(username, set()).add(token)
+
+    def get_principal(self, username):
+        return self.principals.get(username)
+
+    def put_principal(self, username, principal):
+        self.principals.put(username, principal, time.time() + self.principal_ttl)
+
+    def invalidate_user(self, username):
+        """Forget the principal and every cached token of ``username``."""
+        self.principals.pop(username)
+        for token in self._tokens_by_user.pop(username, ()):
+            self.tokens.pop(token)
+
+    def _forget_token(self, token, username):
+        tokens = self._tokens_by_user.get(username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[username]
+
+    def stats(self):
+        return {"tokens": self.tokens.stats(), "principals": self.principals.stats()}
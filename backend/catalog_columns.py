@@ -0,0 +1,315 @@
+"""Columnar in-memory snapshot of the catalog for filtered, sorted browsing.
+
+Browse queries (genre in a set, duration between bounds, artist prefix,
+ordered by title, artist or duration) are answered without Mongo from a
+compact column store rather than a list of dicts:
+
+* ``duration`` is a float64 array (NaN when unknown);
+* ``title``, ``artist``, ``album`` and ``genre`` are int32 codes into
+  per-column dictionaries of distinct values (-1 when missing);
+* a boolean ``live`` array marks rows of removed tracks until compaction.
+
+A query is a conjunction of boolean masks over those arrays, then an
+argsort (after an ``argpartition`` when only the first page is wanted) by
+the dictionaries' precomputed collation ranks.  Tracks are upserted and
+removed one at a time as the catalog changes; arrays grow by doubling and
+are compacted once half their rows are dead.
+
+Facet counts (tracks per genre, artist and album) are materialized per
+dictionary code and adjusted on every upsert and removal, so catalog-wide
+facets never scan rows.  Facets of a subset - a filter, a search result,
+or both - intersect the subset's row bitsets and ``bincount`` the codes of
+the rows left.
+"""
+import bisect
+import sys
+import threading
+
+import numpy as np
+
+from search_index import normalize
+
+STRING_COLUMNS = ("title", "artist", "album", "genre")
+FACET_COLUMNS = ("genre", "artist", "album")
+SORT_COLUMNS = ("title", "artist", "duration")
+INITIAL_CAPACITY = 1024
+FOOTPRINT_SAMPLE = 1000
+
+
+class Dictionary:
+    """Dictionary encoding of a string column: each distinct value gets an int32 code."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+        self._normalized = []
+        self._ranks = None   # code -> position in collation order
+        self._sorted = None  # (normalized value, code) in collation order
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        if value is None or value == "":
+            return -1
+        value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+            self._normalized.append(normalize(value))
+            self._ranks = self._sorted = None
+        return code
+
+    def _collate(self):
+        if self._ranks is None:
+            order = sorted(range(len(self.values)), key=lambda code: (self._normalized[code], self.values[code]))
+            ranks = np.empty(len(order) + 1, dtype=np.int32)
+            ranks[order] = np.arange(len(order), dtype=np.int32)
+            ranks[-1] = len(order)  # code -1 (missing) collates last
+            self._ranks = ranks
+            self._sorted = [(self._normalized[code], code) for code in order]
+
+    def ranks(self):
+        """Collation rank per code, indexable by a code array (missing, -1, ranks last)."""
+        self._collate()
+        return self._ranks
+
+    def matching(self, values):
+        """Codes of the values equal to any of ``values``, ignoring case and accents."""
+        wanted = {normalize(value) for value in values}
+        return np.array([code for code, value in enumerate(self._normalized) if value in wanted], dtype=np.int32)
+
+    def with_prefix(self, prefix):
+        """Codes of the values starting with ``prefix``, ignoring case and accents."""
+        self._collate()
+        prefix = normalize(prefix)
+        lo = bisect.bisect_left(self._sorted, (prefix,))
+        hi = bisect.bisect_left(self._sorted, (prefix + "\U0010ffff",), lo)
+        return np.array([code for _, code in self._sorted[lo:hi]], dtype=np.int32)
+
+    def nbytes(self):
+        return sum(sys.getsizeof(value) for value in self.values) + sys.getsizeof(self.values)
+
+
+class ColumnarCatalog:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.generation = 0
+        self._reset(INITIAL_CAPACITY)
+
+    def _reset(self, capacity):
+        self._ids = []
+        self._rows = {}  # track id -> row
+        self._size = 0
+        self._dead = 0
+        self.live = np.zeros(capacity, dtype=bool)
+        self.duration = np.full(capacity, np.nan)
+        self.dictionaries = {column: Dictionary() for column in STRING_COLUMNS}
+        self.codes = {column: np.full(capacity, -1, dtype=np.int32) for column in STRING_COLUMNS}
+        self.counts = {column: np.zeros(0, dtype=np.int64) for column in FACET_COLUMNS}  # code -> live rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def build(self, tracks):
+        """Replace the snapshot with ``tracks``."""
+        with self._lock:
+            tracks = [track for track in tracks if track.get("id") is not None]
+            self._reset(max(INITIAL_CAPACITY, len(tracks)))
+            for track in tracks:
+                self._upsert(track, count=False)
+            size = self._size
+            for column in FACET_COLUMNS:
+                codes = self.codes[column][:size]
+                self.counts[column] = np.bincount(
+                    codes[codes >= 0], minlength=len(self.dictionaries[column])
+                ).astype(np.int64)
+            self.generation += 1
+
+    def replace(self, other):
+        """Take over the contents of ``other``, a snapshot built separately (e.g. off the event loop)."""
+        with self._lock, other._lock:
+            self._ids, self._rows = other._ids, other._rows
+            self._size, self._dead = other._size, other._dead
+            self.live, self.duration = other.live, other.duration
+            self.dictionaries, self.codes, self.counts = other.dictionaries, other.codes, other.counts
+            self.generation += 1
+
+    def upsert(self, track):
+        with self._lock:
+            self._upsert(track)
+            self.generation += 1
+
+    def remove(self, track_id):
+        with self._lock:
+            row = self._rows.pop(track_id, None)
+            if row is None:
+                return
+            self._count(row, -1)
+            self.live[row] = False
+            self._ids[row] = None
+            self._dead += 1
+            if self._dead > INITIAL_CAPACITY and self._dead * 2 > self._size:
+                self._compact()
+            self.generation += 1
+
+    def _count(self, row, delta):
+        for column in FACET_COLUMNS:
+            code = self.codes[column][row]
+            if code >= 0:
+                counts = self.counts[column]
+                if code >= len(counts):
+                    counts = self.counts[column] = np.concatenate(
+                        [counts, np.zeros(max(code + 1 - len(counts), len(counts)), dtype=np.int64)]
+                    )
+                counts[code] += delta
+
+    def _upsert(self, track, count=True):
+        track_id = track.get("id")
+        if track_id is None:
+            return
+        row = self._rows.get(track_id)
+        if row is not None and count:
+            self._count(row, -1)
+        if row is None:
+            if self._size == len(self.live):
+                self._grow(2 * len(self.live))
+            row = self._rows[track_id] = self._size
+            self._ids.append(track_id)
+            self._size += 1
+        duration = track.get("duration")
+        self.duration[row] = duration if isinstance(duration, (int, float)) else np.nan
+        for column in STRING_COLUMNS:
+            self.codes[column][row] = self.dictionaries[column].encode(track.get(column))
+        self.live[row] = True
+        if count:
+            self._count(row, +1)
+
+    def _grow(self, capacity):
+        def grown(array, fill):
+            bigger = np.full(capacity, fill, dtype=array.dtype)
+            bigger[:len(array)] = array
+            return bigger
+
+        self.live = grown(self.live, False)
+        self.duration = grown(self.duration, np.nan)
+        self.codes = {column: grown(codes, -1) for column, codes in self.codes.items()}
+
+    def _compact(self):
+        keep = np.flatnonzero(self.live[:self._size])
+        ids = [self._ids[row] for row in keep]
+        capacity = max(INITIAL_CAPACITY, len(keep))
+        self.live = np.zeros(capacity, dtype=bool)
+        self.live[:len(keep)] = True
+        duration = np.full(capacity, np.nan)
+        duration[:len(keep)] = self.duration[keep]
+        self.duration = duration
+        for column, codes in self.codes.items():
+            compacted = np.full(capacity, -1, dtype=np.int32)
+            compacted[:len(keep)] = codes[keep]
+            self.codes[column] = compacted
+        self._ids = ids
+        self._rows = {track_id: row for row, track_id in enumerate(ids)}
+        self._size = len(ids)
+        self._dead = 0
+
+    def mask(self, genres=None, min_duration=None, max_duration=None, artist_prefix=None):
+        """Boolean mask over rows for the given filters (all must hold)."""
+        size = self._size
+        mask = self.live[:size].copy()
+        if genres:
+            mask &= np.isin(self.codes["genre"][:size], self.dictionaries["genre"].matching(genres))
+        if min_duration is not None:
+            mask &= self.duration[:size] >= min_duration
+        if max_duration is not None:
+            mask &= self.duration[:size] <= max_duration
+        if artist_prefix:
+            mask &= np.isin(self.codes["artist"][:size], self.dictionaries["artist"].with_prefix(artist_prefix))
+        return mask
+
+    def _sort_key(self, column, rows):
+        if column == "duration":
+            return self.duration[rows]
+        return self.dictionaries[column].ranks()[self.codes[column][rows]].astype(np.float64)
+
+    def query(self, genres=None, min_duration=None, max_duration=None, artist_prefix=None, sort="title",
+              limit=100, offset=0):
+        """Return ``(total matches, track ids of the requested page)``."""
+        descending = sort.startswith("-")
+        column = sort.lstrip("-")
+        if column not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {column}")
+        with self._lock:
+            rows = np.flatnonzero(self.mask(genres, min_duration, max_duration, artist_prefix))
+            total = len(rows)
+            primary = self._sort_key(column, rows)
+            if descending:
+                primary = -primary
+            primary[np.isnan(primary)] = np.inf  # unknown values last either way
+            wanted = offset + limit
+            if wanted < total // 4:
+                # Only rows that can reach the page, ties at the boundary included
+                boundary = np.partition(primary, wanted - 1)[wanted - 1]
+                candidates = primary <= boundary
+                rows, primary = rows[candidates], primary[candidates]
+            tiebreak = self._sort_key("title" if column != "title" else "artist", rows)
+            order = np.lexsort((rows, tiebreak, primary))[offset:wanted]
+            return total, [self._ids[row] for row in rows[order]]
+
+    def rows_mask(self, track_ids):
+        """Bitset of the rows holding ``track_ids`` (unknown ids are ignored)."""
+        mask = np.zeros(self._size, dtype=bool)
+        rows = [self._rows[track_id] for track_id in track_ids if track_id in self._rows]
+        mask[np.array(rows, dtype=np.int64)] = True
+        return mask
+
+    def facets(self, columns=FACET_COLUMNS, limit=20, track_ids=None, **filters):
+        """Top ``limit`` values per column with their track counts, over the tracks matching
+        ``filters`` and, if given, among ``track_ids``; return ``(total tracks, {column: [(value, count)]})``."""
+        with self._lock:
+            if track_ids is None and not any(value is not None for value in filters.values()):
+                total = len(self._rows)
+                counts = {column: self.counts[column] for column in columns}
+            else:
+                mask = self.mask(**filters)
+                if track_ids is not None:
+                    mask &= self.rows_mask(track_ids)
+                total = int(np.count_nonzero(mask))
+                counts = {}
+                for column in columns:
+                    codes = self.codes[column][:self._size][mask]
+                    counts[column] = np.bincount(codes[codes >= 0], minlength=len(self.dictionaries[column]))
+            return total, {column: self._top_values(column, counts[column], limit) for column in columns}
+
+    def _top_values(self, column, counts, limit):
+        dictionary = self.dictionaries[column]
+        codes = np.flatnonzero(counts)
+        if len(codes) > limit:
+            boundary = np.partition(counts[codes], len(codes) - limit)[len(codes) - limit]
+            codes = codes[counts[codes] >= boundary]
+        # Most tracks first, ties in collation order
+        order = np.lexsort((dictionary.ranks()[codes], -counts[codes]))[:limit]
+        return [(dictionary.values[code], int(counts[code])) for code in codes[order]]
+
+    def footprint(self):
+        """Bytes held by the columns, next to an estimate for the same fields as a list of dicts."""
+        with self._lock:
+            count = len(self._rows)
+            columnar = (
+                self.live.nbytes + self.duration.nbytes
+                + sum(codes.nbytes for codes in self.codes.values())
+                + sum(dictionary.nbytes() for dictionary in self.dictionaries.values())
+                + sys.getsizeof(self._ids) + sys.getsizeof(self._rows)
+                + sum(sys.getsizeof(track_id) for track_id in self._rows)
+            )
+            sample = list(self._rows.items())[:FOOTPRINT_SAMPLE]
+            per_row = 0
+            for track_id, row in sample:
+                doc = {"id": track_id, "duration": float(self.duration[row])}
+                for column in STRING_COLUMNS:
+                    code = self.codes[column][row]
+                    doc[column] = self.dictionaries[column].values[code] if code >= 0 else None
+                per_row += sys.getsizeof(doc) + sum(sys.getsizeof(value) for value in doc.values())
+            dicts = sys.getsizeof([None] * count) + (per_row * count // len(sample) if sample else 0)
+            return {"rows": count, "columnar_bytes": columnar, "dict_bytes": dicts}
@@ -0,0 +1,110 @@
+"""Response compression for JSON and text bodies.
+
+Bodies of at least COMPRESSION_MIN_BYTES with a compressible content type
+are sent brotli-encoded when the client accepts ``br`` and gzip-encoded
+otherwise.  Only complete (single-message) bodies are compressed:
+streamed responses such as NDJSON exports and audio pass through untouched,
+as do partial content and anything already encoded.  Quality levels favour
+speed, since this runs on every large response.
+
+Configuration (environment):
+
+    COMPRESSION_MIN_BYTES  smallest body worth compressing (default: 1024)
+    GZIP_LEVEL             zlib level 1-9 (default: 5)
+    BROTLI_QUALITY         brotli quality 0-11 (default: 4)
+"""
+import gzip
+import os
+
+import brotli
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 5))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def accepted_encodings(header):
+    """Encodings in an Accept-Encoding header that are not refused with ``q=0``."""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header or "")
+    if "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode('latin-1'))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # Held back until we know whether the body will be compressed
+                start = message
+                return
+            if start is None:
+                await send(message)
+                return
+            response_start, start = start, None
+            body = message.get("body", b"")
+            if message["type"] != "http.response.body" or message.get("more_body") or not self._compressible(
+                response_start, body
+            ):
+                await send(response_start)
+                await send(message)
+                return
+            compressed = compress(bytes(body), encoding)
+            response_headers = [
+                (key, value) for key, value in response_start["headers"] if key.lower() != b"content-length"
+            ]
+            response_headers += [
+                (b"content-encoding", encoding.encode('ascii')),
+                (b"content-length", str(len(compressed)).encode('ascii')),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send(dict(response_start, headers=response_headers))
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compressible(self, start, body):
+        if start["status"] != 200 or len(body) < self.minimum_size:
+            return False
+        headers = {key.lower(): value for key, value in start["headers"]}
+        if b"content-encoding" in headers:
+            return False
+        content_type = headers.get(b"content-type", b"").decode('latin-1')
+        return content_type.startswith(COMPRESSIBLE_TYPES)
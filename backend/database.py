@@ -0,0 +1,226 @@
+"""Non-blocking access to the Mongo collections.
+
+pymongo is synchronous, so every collection call made from an ``async``
+handler is dispatched to a bounded thread pool and awaited.  A slow query
+then only occupies one executor thread instead of stalling the event loop
+and every other in-flight request on the worker.
+
+The client and the thread pool belong to a process: they are created on
+first use, and created afresh in a process forked after that (a
+``MongoClient`` must not be shared across ``fork``).  Each worker of a
+multi-process deployment therefore has its own pool of MONGO_MAX_POOL_SIZE
+connections; see serve.py.
+
+Configuration (environment):
+
+    MONGO_URL                          connection string; ``memory://`` uses the
+                                       in-process stand-in (see memory_store.py)
+    MONGO_MAX_POOL_SIZE                max sockets per server (default: 100)
+    MONGO_MIN_POOL_SIZE                sockets kept warm (default: 0)
+    MONGO_CONNECT_TIMEOUT_MS           TCP connect timeout (default: 5000)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS  wait for a usable server (default: 5000)
+    MONGO_SOCKET_TIMEOUT_MS            per-operation socket timeout (default: 30000)
+    MONGO_MAX_IDLE_TIME_MS             close pooled sockets idle this long (default: 0, never)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS        wait for a free pooled socket (default: 0, forever)
+    DB_EXECUTOR_WORKERS                threads running blocking calls (default: 32)
+    DB_OPERATION_TIMEOUT               seconds a handler waits for a call (default: 30)
+"""
+import asyncio
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from pymongo import MongoClient
+
+import metrics
+import profiling
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
+MONGO_MAX_POOL_SIZE = _env_int('MONGO_MAX_POOL_SIZE', 100)
+MONGO_MIN_POOL_SIZE = _env_int('MONGO_MIN_POOL_SIZE', 0)
+MONGO_CONNECT_TIMEOUT_MS = _env_int('MONGO_CONNECT_TIMEOUT_MS', 5000)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)
+MONGO_SOCKET_TIMEOUT_MS = _env_int('MONGO_SOCKET_TIMEOUT_MS', 30000)
+MONGO_MAX_IDLE_TIME_MS = _env_int('MONGO_MAX_IDLE_TIME_MS', 0)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = _env_int('MONGO_WAIT_QUEUE_TIMEOUT_MS', 0)
+DB_EXECUTOR_WORKERS = _env_int('DB_EXECUTOR_WORKERS', 32)
+DB_OPERATION_TIMEOUT = float(os.environ.get('DB_OPERATION_TIMEOUT', 30))
+
+
+class DatabaseTimeout(Exception):
+    """A database call did not finish within DB_OPERATION_TIMEOUT."""
+
+
+def _take(cursor, count):
+    return list(itertools.islice(cursor, count))
+
+
+class AsyncCollection:
+    """Awaitable wrapper around a pymongo collection.
+
+    Methods mirror the pymongo ones of the same name; ``find`` and
+    ``aggregate`` return lists rather than cursors, and ``iter_batches``
+    streams a cursor without materializing it.
+    """
+
+    def __init__(self, name, timeout=DB_OPERATION_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+
+    @property
+    def collection(self):
+        return _connection().db[self.name]
+
+    @property
+    def executor(self):
+        return _connection().executor
+
+    async def run(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on the executor and await the result."""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, profiling.attach(partial(fn, *args, **kwargs), "db"))
+        operation = getattr(fn, '__name__', 'call').lstrip('_')
+        start = time.perf_counter()
+        try:
+            # Not wait_for: before Python 3.12 it drops a cancellation that arrives as the call finishes
+            done, _ = await asyncio.wait((future,), timeout=self.timeout)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        finally:
+            metrics.DB_CALL_SECONDS.observe(time.perf_counter() - start, self.name, operation)
+        if not done:
+            future.cancel()
+            raise DatabaseTimeout(f"{self.name}.{operation} timed out")
+        return future.result()
+
+    def _find(self, *args, **kwargs):
+        return list(self.collection.find(*args, **kwargs))
+
+    def _aggregate(self, pipeline, **kwargs):
+        return list(self.collection.aggregate(pipeline, **kwargs))
+
+    async def iter_batches(self, *args, batch_size=500, **kwargs):
+        """Yield lists of up to ``batch_size`` documents as the cursor produces them."""
+        cursor = self.collection.find(*args, batch_size=batch_size, **kwargs)
+        try:
+            while True:
+                batch = await self.run(_take, cursor, batch_size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            await self.run(cursor.close)
+
+    async def find(self, *args, **kwargs):
+        return await self.run(self._find, *args, **kwargs)
+
+    async def aggregate(self, pipeline, **kwargs):
+        return await self.run(self._aggregate, pipeline, **kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return await self.run(self.collection.find_one, *args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs):
+        return await self.run(self.collection.count_documents, *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await self.run(self.collection.insert_one, *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await self.run(self.collection.insert_many, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self.run(self.collection.update_one, *args, **kwargs)
+
+    async def update_many(self, *args, **kwargs):
+        return await self.run(self.collection.update_many, *args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return await self.run(self.collection.find_one_and_update, *args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return await self.run(self.collection.delete_one, *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await self.run(self.collection.delete_many, *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self.run(self.collection.bulk_write, *args, **kwargs)
+
+
+def _create_client():
+    if MONGO_URL.startswith('memory://'):
+        from memory_store import MemoryClient
+        return MemoryClient()
+    return MongoClient(
+        MONGO_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS or None,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS or None,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        event_listeners=[metrics.CommandTimer()] if metrics.METRICS_ENABLED else [],
+    )
+
+
+class _Connection:
+    """The client, database and executor of one process."""
+
+    def __init__(self):
+        self.client = _create_client()
+        self.db = self.client['music_app']
+        self.executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="mongo")
+
+
+_current = None
+_connect_lock = threading.Lock()
+
+
+def _connection():
+    global _current
+    if _current is None:
+        with _connect_lock:
+            if _current is None:
+                _current = _Connection()
+    return _current
+
+
+def _forget_after_fork():
+    # The parent's client and threads are unusable in the child; leave them and connect anew
+    global _current, _connect_lock
+    _current = None
+    _connect_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_after_fork)
+
+
+def __getattr__(name):
+    # ``database.db`` and ``database.client`` resolve to this process's connection
+    if name in ('db', 'client'):
+        return getattr(_connection(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_collection(name):
+    return AsyncCollection(name)
+
+
+def shutdown():
+    global _current
+    if _current is None:
+        return
+    _current.executor.shutdown(wait=True)
+    _current.client.close()
+    _current = None
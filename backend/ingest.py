@@ -0,0 +1,290 @@
+"""Streaming catalog import from NDJSON or CSV.
+
+Input is consumed one line at a time and validated against the ``Track``
+model; accepted rows are written in bulk-upsert batches keyed on ``id``,
+so memory stays flat regardless of file size and re-running an import is
+idempotent.  Rows without an ``id`` get a fresh one.  Rejected rows are
+counted and the first few are kept with their line number and reason.
+
+CSV input must have a header row; quoted fields may not span lines.
+
+``POST /api/tracks/import`` runs in the background by default: the request
+body is spooled into the ``import_spool`` collection in numbered chunks of
+IMPORT_CHUNK_SIZE bytes (the layout of GridFS) and a job (see jobs.py)
+reads them back batch by batch, checkpointing the byte offset and the
+importer's counters after every batch.  The payload lives in the database
+rather than on the disk of the host that took the upload, so whichever
+worker process or host claims the job, first or after a restart, can
+resume it where it stopped.  ``background=false`` imports inline instead.
+
+Configuration (environment):
+
+    INGEST_BATCH_SIZE  accepted rows per bulk write (default: 1000)
+    IMPORT_CHUNK_SIZE  bytes per spooled chunk of a background import (default: 261120)
+
+Run as a script:
+
+    python ingest.py catalog.ndjson [--format csv] [--batch-size 1000]
+"""
+import codecs
+import csv
+import json
+import os
+import time
+import uuid
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 255 * 1024))
+MAX_REPORTED_REJECTS = 100
+SPOOL_READ_CHUNKS = 4
+
+FORMATS = ("ndjson", "csv")
+
+
+def detect_format(filename):
+    return "csv" if filename.lower().endswith(".csv") else "ndjson"
+
+
+def _model_dict(instance):
+    dump = getattr(instance, "model_dump", None)
+    return dump() if dump else instance.dict()
+
+
+def upsert_requests(docs):
+    # $set rather than a replacement: fields the import does not carry (audio and waveform from an upload,
+    # an audio_url the row leaves empty) keep their stored values
+    return [
+        UpdateOne({"id": doc["id"]}, {"$set": {key: value for key, value in doc.items() if value is not None}},
+                  upsert=True)
+        for doc in docs
+    ]
+
+
+class TrackImporter:
+    """Turns input lines into validated track batches.
+
+    Feed lines with ``feed``; it returns a batch of documents whenever
+    ``batch_size`` rows have been accepted.  ``finish`` returns the rest.
+    """
+
+    def __init__(self, model, fmt="ndjson", batch_size=INGEST_BATCH_SIZE):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        self.model = model
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.line_no = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.rejects = []
+        self.started = time.perf_counter()
+        self._header = None
+        self._batch = []
+
+    def _parse(self, line):
+        if self.fmt == "ndjson":
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("expected a JSON object")
+            return row
+        values = next(csv.reader([line]))
+        if self._header is None:
+            self._header = [name.strip() for name in values]
+            return None
+        if len(values) != len(self._header):
+            raise ValueError(f"expected {len(self._header)} columns, got {len(values)}")
+        # Empty CSV cells mean "not set"
+        return {name: value for name, value in zip(self._header, values) if value != ""}
+
+    def _reject(self, reason):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"line": self.line_no, "error": reason})
+
+    def feed(self, line):
+        self.line_no += 1
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            row = self._parse(line)
+        except ValueError as exc:
+            self._reject(f"unparseable: {exc}")
+            return None
+        if row is None:
+            return None
+
+        try:
+            doc = _model_dict(self.model(**row))
+        except ValidationError as exc:
+            self._reject(str(exc).replace("\n", " "))
+            return None
+        track_id = row.get("id")
+        doc["id"] = str(track_id) if track_id not in (None, "") else str(uuid.uuid4())
+
+        self.accepted += 1
+        self._batch.append(doc)
+        if len(self._batch) >= self.batch_size:
+            return self._take_batch()
+        return None
+
+    def finish(self):
+        return self._take_batch() if self._batch else None
+
+    def _take_batch(self):
+        batch, self._batch = self._batch, []
+        self.batches += 1
+        return batch
+
+    def state(self):
+        """Counters and CSV header to ``resume`` from; only meaningful between batches."""
+        return {
+            "line_no": self.line_no,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "rejects": self.rejects,
+            "header": self._header,
+        }
+
+    def resume(self, state):
+        self.line_no = state["line_no"]
+        self.accepted = state["accepted"]
+        self.rejected = state["rejected"]
+        self.batches = state["batches"]
+        self.rejects = state["rejects"]
+        self._header = state["header"]
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "format": self.fmt,
+            "lines": self.line_no,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.accepted / elapsed, 1) if elapsed else None,
+            "rejects": self.rejects,
+        }
+
+
+async def aiter_lines(chunks):
+    """Split an async iterator of byte chunks into text lines."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def spool_stream(chunks, collection):
+    """Store an async iterable of byte chunks as a new spooled upload; return ``(name, size)``.
+
+    Every stored chunk but the last holds exactly IMPORT_CHUNK_SIZE bytes, so
+    a byte offset maps to chunk ``offset // IMPORT_CHUNK_SIZE``."""
+    name = uuid.uuid4().hex
+    size = 0
+    n = 0
+    pending = b""
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            pending += chunk
+            while len(pending) >= IMPORT_CHUNK_SIZE:
+                await collection.insert_one({"upload": name, "n": n, "data": pending[:IMPORT_CHUNK_SIZE]})
+                pending = pending[IMPORT_CHUNK_SIZE:]
+                n += 1
+        if pending:
+            await collection.insert_one({"upload": name, "n": n, "data": pending})
+    except BaseException:
+        await remove_spool(collection, name)
+        raise
+    return name, size
+
+
+async def iter_spool(collection, name, offset=0):
+    """Yield the bytes of a spooled upload from ``offset`` on, a chunk at a time."""
+    first = offset // IMPORT_CHUNK_SIZE
+    async for docs in collection.iter_batches(
+        {"upload": name, "n": {"$gte": first}}, {"_id": 0, "n": 1, "data": 1},
+        sort=[("n", 1)], batch_size=SPOOL_READ_CHUNKS,
+    ):
+        for doc in docs:
+            data = bytes(doc["data"])
+            yield data[offset - first * IMPORT_CHUNK_SIZE:] if doc["n"] == first else data
+
+
+async def remove_spool(collection, name):
+    await collection.delete_many({"upload": name})
+
+
+def read_batch(importer, data, final=False):
+    """Feed the complete lines of ``data`` (all of it if ``final``) until a batch
+    fills; return ``(batch or None, bytes consumed)``."""
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", start)
+        if end < 0:
+            if not final:
+                break
+            end = len(data) - 1
+        batch = importer.feed(data[start:end + 1].decode("utf-8", errors="replace"))
+        start = end + 1
+        if batch:
+            return batch, start
+    return (importer.finish() if final else None), start
+
+
+def import_file(path, collection, model, fmt=None, batch_size=INGEST_BATCH_SIZE, progress=None):
+    """Import ``path`` into ``collection`` (a pymongo collection); return the report."""
+    importer = TrackImporter(model, fmt or detect_format(path), batch_size)
+    with open(path, encoding="utf-8", newline="") as f:
+        for line in f:
+            batch = importer.feed(line)
+            if batch:
+                collection.bulk_write(upsert_requests(batch), ordered=False)
+                if progress:
+                    progress(importer)
+    batch = importer.finish()
+    if batch:
+        collection.bulk_write(upsert_requests(batch), ordered=False)
+    return importer.report()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from pymongo import ReturnDocument
+
+    from database import db
+    from server import Track
+    from track_cache import CATALOG_VERSION_ID
+
+    parser = argparse.ArgumentParser(description="Stream a track catalog into Mongo")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    args = parser.parse_args()
+
+    def print_progress(importer):
+        print(f"  {importer.accepted} accepted, {importer.rejected} rejected", file=sys.stderr)
+
+    report = import_file(args.path, db["tracks"], Track, args.format, args.batch_size, print_progress)
+    if report["accepted"]:
+        # Running servers pick this up and refresh their caches and search index
+        db["meta"].find_one_and_update(
+            {"_id": CATALOG_VERSION_ID}, {"$inc": {"version": 1}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+    print(json.dumps(report, indent=2))
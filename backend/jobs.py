@@ -0,0 +1,301 @@
+"""Persistent background jobs for work too slow for a request.
+
+A heavy operation (bulk import, waveform analysis, seeding the catalog) is
+submitted as a job: a document in the ``jobs`` collection
+
+    {id, kind, params, owner, priority, worker, status, progress, result,
+     error, checkpoint, cancel_requested, attempts, created_at, started_at,
+     finished_at, heartbeat_at}
+
+and the request answers 202 with the job, which the client then follows at
+``/api/jobs/{id}``.  ``status`` moves queued -> running -> succeeded,
+failed or cancelled.
+
+* Each process runs up to JOB_WORKERS jobs at once, highest priority first
+  and oldest first within a priority.  Handlers are coroutines; blocking or
+  CPU-bound steps go through ``JobContext.run_in_thread``, a pool of
+  JOB_THREADS threads of its own, so jobs never take threads from the
+  database or password hashing pools that requests wait on.
+* A job is claimed with a conditional queued -> running update, so with
+  several worker processes exactly one runs it.  Processes also look for
+  jobs queued by the others every JOB_POLL_SECONDS.
+* Running jobs are heartbeated.  A job whose heartbeat is older than
+  JOB_STALE_SECONDS (its process died) is queued again, and a graceful
+  shutdown re-queues its running jobs at once; handlers save a checkpoint
+  with their progress and resume from it.
+* Cancelling a queued job is immediate.  A running job is asked to stop and
+  does so at its next ``progress`` or ``check`` call.
+* A job submitted with ``local=True`` works on state held in this process's
+  memory (its search index, its recommendation model), so only this process
+  picks it up.  It is heartbeated while queued as well; if the process dies
+  the job is marked failed rather than handed on, and a graceful shutdown
+  cancels it.
+
+Configuration (environment):
+
+    JOB_WORKERS        jobs run at once per process (default: 2)
+    JOB_THREADS        threads for blocking job steps per process (default: 2)
+    JOB_POLL_SECONDS   how often to heartbeat and pick up other workers' jobs (default: 5)
+    JOB_STALE_SECONDS  heartbeat age after which a running job is retried (default: 60)
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_THREADS = int(os.environ.get('JOB_THREADS', 2))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 5))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 60))
+
+HOSTNAME = socket.gethostname()
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job has been cancelled."""
+
+
+class JobContext:
+    """What a handler sees of its job."""
+
+    def __init__(self, queue, job):
+        self._queue = queue
+        self.id = job["id"]
+        self.kind = job["kind"]
+        self.params = job.get("params") or {}
+        self.checkpoint = job.get("checkpoint")
+        self.cancel_requested = bool(job.get("cancel_requested"))
+
+    def check(self):
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    async def progress(self, done, total=None, checkpoint=None):
+        """Record progress and, if given, the state to resume from after a restart."""
+        self.check()
+        fields = {"progress": {"done": done, "total": total}, "heartbeat_at": datetime.utcnow()}
+        if checkpoint is not None:
+            self.checkpoint = fields["checkpoint"] = checkpoint
+        doc = await self._queue.jobs.find_one_and_update(
+            {"id": self.id}, {"$set": fields}, projection={"_id": 0, "cancel_requested": 1}
+        )
+        if doc and doc.get("cancel_requested"):
+            self.cancel_requested = True
+        self.check()
+
+    async def run_in_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._queue.executor, fn, *args)
+
+
+class JobQueue:
+    def __init__(self, collection, workers=JOB_WORKERS, threads=JOB_THREADS):
+        self.jobs = collection
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="job")
+        self.finished = Counter()  # status -> jobs finished by this process
+        self._handlers = {}
+        self._queue = asyncio.PriorityQueue()
+        self._queued = set()   # ids waiting in the local queue
+        self._running = {}     # id -> JobContext
+        self._tasks = []
+
+    @property
+    def running(self):
+        return len(self._running)
+
+    @property
+    def queued(self):
+        return len(self._queued)
+
+    @property
+    def worker_id(self):
+        # Not cached: worker processes may be forked after the queue is created
+        return f"{HOSTNAME}:{os.getpid()}"
+
+    def handler(self, kind):
+        """Register ``fn(job: JobContext)`` as the coroutine that runs jobs of ``kind``;
+        its return value becomes the job's ``result``."""
+        def register(fn):
+            self._handlers[kind] = fn
+            return fn
+        return register
+
+    def _enqueue(self, job):
+        if job["id"] not in self._queued and job["id"] not in self._running:
+            self._queued.add(job["id"])
+            self._queue.put_nowait((-job["priority"], job["created_at"], job["id"]))
+
+    async def submit(self, kind, params=None, owner=None, priority=PRIORITY_NORMAL, local=False):
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = datetime.utcnow()
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "params": params or {},
+            "owner": owner,
+            "priority": priority,
+            "worker": self.worker_id if local else None,
+            "status": "queued",
+            "progress": {"done": 0, "total": None},
+            "result": None,
+            "error": None,
+            "checkpoint": None,
+            "cancel_requested": False,
+            "attempts": 0,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "heartbeat_at": now if local else None,
+        }
+        await self.jobs.insert_one(dict(job))
+        self._enqueue(job)
+        return job
+
+    async def get(self, job_id, owner=None):
+        """The job, or None if there is none visible to ``owner`` (system jobs are visible to all)."""
+        job = await self.jobs.find_one({"id": job_id}, {"_id": 0, "checkpoint": 0})
+        if job is None or job["owner"] not in (None, owner):
+            return None
+        return job
+
+    async def list(self, owner, limit=50):
+        return await self.jobs.find(
+            {"owner": owner}, {"_id": 0, "checkpoint": 0}, sort=[("created_at", -1)], limit=limit
+        )
+
+    async def cancel(self, job_id, owner):
+        """Cancel a queued job now, or ask a running one to stop; return the job or None."""
+        now = datetime.utcnow()
+        await self.jobs.update_one(
+            {"id": job_id, "owner": owner, "status": "queued"},
+            {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": now}},
+        )
+        await self.jobs.update_one(
+            {"id": job_id, "owner": owner, "status": "running"}, {"$set": {"cancel_requested": True}}
+        )
+        context = self._running.get(job_id)
+        if context is not None:
+            context.cancel_requested = True
+        return await self.get(job_id, owner)
+
+    async def _claim(self, job_id):
+        now = datetime.utcnow()
+        return await self.jobs.find_one_and_update(
+            {"id": job_id, "status": "queued"},
+            {"$set": {"status": "running", "started_at": now, "heartbeat_at": now}, "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _work(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                job = await self._claim(job_id)
+            except Exception:
+                logger.exception("Claiming job %s failed", job_id)
+                continue
+            if job is not None:  # else another process took it, or it was cancelled
+                await self._execute(job)
+
+    async def _execute(self, job):
+        context = self._running[job["id"]] = JobContext(self, job)
+        fields = {}
+        try:
+            handler = self._handlers.get(job["kind"])
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            context.check()
+            fields["result"] = await handler(context)
+            status = "succeeded"
+        except JobCancelled:
+            status = "cancelled"
+        except asyncio.CancelledError:
+            # Shutting down: hand the job to the next process to start, unless it belongs to this one
+            if job.get("worker") is None:
+                fields = {"status": "queued", "heartbeat_at": None}
+            else:
+                fields = {"status": "cancelled", "finished_at": datetime.utcnow()}
+            await asyncio.shield(self.jobs.update_one({"id": job["id"], "status": "running"}, {"$set": fields}))
+            raise
+        except Exception as exc:
+            logger.exception("Job %s (%s) failed", job["id"], job["kind"])
+            status = "failed"
+            fields["error"] = str(exc) or type(exc).__name__
+        finally:
+            self._running.pop(job["id"], None)
+        self.finished[status] += 1
+        fields.update(status=status, finished_at=datetime.utcnow())
+        try:
+            await self.jobs.update_one({"id": job["id"], "status": "running"}, {"$set": fields})
+        except Exception:
+            logger.exception("Recording the outcome of job %s failed", job["id"])
+
+    async def _maintain(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Job queue maintenance failed")
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    async def poll(self):
+        """Heartbeat local jobs, re-queue abandoned ones and pick up queued ones."""
+        now = datetime.utcnow()
+        for job_id, context in list(self._running.items()):
+            doc = await self.jobs.find_one_and_update(
+                {"id": job_id, "status": "running"}, {"$set": {"heartbeat_at": now}},
+                projection={"_id": 0, "cancel_requested": 1},
+            )
+            if doc and doc.get("cancel_requested"):
+                context.cancel_requested = True
+        await self.jobs.update_many({"status": "queued", "worker": self.worker_id}, {"$set": {"heartbeat_at": now}})
+        stale = now - timedelta(seconds=JOB_STALE_SECONDS)
+        await self.jobs.update_many(
+            {"status": "running", "worker": None, "heartbeat_at": {"$lt": stale}},
+            {"$set": {"status": "queued", "heartbeat_at": None}},
+        )
+        await self.jobs.update_many(
+            {"status": {"$in": ["queued", "running"]}, "worker": {"$ne": None}, "heartbeat_at": {"$lt": stale}},
+            {"$set": {"status": "failed", "error": "worker process exited", "finished_at": now}},
+        )
+        for job in await self.jobs.find(
+            {"status": "queued", "worker": {"$in": [None, self.worker_id]}},
+            {"_id": 0, "id": 1, "priority": 1, "created_at": 1},
+            sort=[("priority", -1), ("created_at", 1)], limit=self.workers * 4,
+        ):
+            self._enqueue(job)
+
+    def start(self):
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._maintain()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self.jobs.update_many(
+                {"status": "queued", "worker": self.worker_id},
+                {"$set": {"status": "cancelled", "finished_at": datetime.utcnow()}},
+            )
+        except Exception:
+            logger.exception("Cancelling this process's queued jobs failed")
+        self.executor.shutdown(wait=False, cancel_futures=True)
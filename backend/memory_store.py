@@ -0,0 +1,411 @@
+"""In-process stand-in for the Mongo collections.
+
+Selected with ``MONGO_URL=memory://`` so the API can run with no database
+server: benchmarks, offline demos, local experiments.  Only the subset of
+pymongo the handlers use is implemented - equality and comparison filters
+(dotted paths included), ``$set``/``$inc``/``$push``/``$pull`` updates,
+projections, sort/limit cursors, unique indexes, ``bulk_write`` of
+ReplaceOne/UpdateOne and ``aggregate`` pipelines of ``$match``, ``$group``
+(``$sum`` only), ``$sort`` and ``$limit`` - and every collection is guarded by a single lock.
+Data lives for the life of the process.
+"""
+import copy
+import threading
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+
+
+def _compare(op, value, operand):
+    if op == "$in":
+        return value in operand
+    if op == "$nin":
+        return value not in operand
+    if op == "$ne":
+        return value != operand
+    if op == "$exists":
+        return (value is not _MISSING) == bool(operand)
+    if value is _MISSING or value is None:
+        return False
+    if op == "$gt":
+        return value > operand
+    if op == "$gte":
+        return value >= operand
+    if op == "$lt":
+        return value < operand
+    if op == "$lte":
+        return value <= operand
+    raise NotImplementedError(f"memory store does not support {op}")
+
+
+def _lookup(doc, field):
+    value = doc
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def matches(doc, query):
+    for field, condition in query.items():
+        value = _lookup(doc, field)
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            if value is _MISSING and not any(op in condition for op in ("$exists", "$nin", "$ne")):
+                value = None
+            if not all(_compare(op, value, operand) for op, operand in condition.items()):
+                return False
+        elif value is _MISSING:
+            if condition is not None:
+                return False
+        elif value != condition and not (isinstance(value, list) and condition in value):
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    if included:
+        result = {field: copy.deepcopy(doc[field]) for field in included if field in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    if list(projection) == ["_id"] and projection["_id"]:
+        return {"_id": doc["_id"]}
+    return {field: copy.deepcopy(value) for field, value in doc.items() if projection.get(field, 1)}
+
+
+def apply_update(doc, update):
+    for op, fields in update.items():
+        for field, value in fields.items():
+            if op == "$set":
+                doc[field] = copy.deepcopy(value)
+            elif op == "$inc":
+                doc[field] = (doc.get(field) or 0) + value
+            elif op == "$push":
+                items = doc.setdefault(field, [])
+                if isinstance(value, dict) and "$each" in value:
+                    position = value.get("$position", len(items))
+                    items[position:position] = copy.deepcopy(value["$each"])
+                    if "$slice" in value:
+                        items[:] = items[value["$slice"]:] if value["$slice"] < 0 else items[:value["$slice"]]
+                else:
+                    items.append(copy.deepcopy(value))
+            elif op == "$pull":
+                if isinstance(value, dict):
+                    # A document condition matches the elements it describes
+                    doc[field] = [
+                        item for item in doc.get(field, []) if not (isinstance(item, dict) and matches(item, value))
+                    ]
+                else:
+                    doc[field] = [item for item in doc.get(field, []) if item != value]
+            else:
+                raise NotImplementedError(f"memory store does not support {op}")
+
+
+def _group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = spec["_id"]
+        key = _lookup(doc, key[1:]) if isinstance(key, str) and key.startswith("$") else key
+        key = None if key is _MISSING else key
+        group = groups.setdefault(key, {"_id": key, **{field: 0 for field in spec if field != "_id"}})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, operand), = accumulator.items()
+            if op != "$sum":
+                raise NotImplementedError(f"memory store does not support {op}")
+            if isinstance(operand, str) and operand.startswith("$"):
+                operand = _lookup(doc, operand[1:])
+            if isinstance(operand, (int, float)):
+                group[field] += operand
+    return list(groups.values())
+
+
+def _sort_key(value):
+    # None/missing sort first, like Mongo
+    return (value is not None, value)
+
+
+class MemoryCursor:
+    def __init__(self, collection, query, projection):
+        self.collection = collection
+        self.query = query or {}
+        self.projection = projection
+        self._sort = None
+        self._limit = 0
+        self._results = None
+
+    def sort(self, keys, direction=None):
+        self._sort = [(keys, direction or 1)] if isinstance(keys, str) else list(keys)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _evaluate(self):
+        docs = self.collection._select(self.query)
+        for field, direction in reversed(self._sort or []):
+            docs.sort(key=lambda doc: _sort_key(doc.get(field)), reverse=direction < 0)
+        if self._limit:
+            docs = docs[:self._limit]
+        return iter([project(doc, self.projection) for doc in docs])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._results is None:
+            with self.collection.lock:
+                self._results = self._evaluate()
+        return next(self._results)
+
+    def close(self):
+        self._results = iter(())
+
+    def explain(self):
+        indexed = {fields[0] for fields in self.collection.indexes.values()}
+        keys = list(self.query) or [field for field, _ in self._sort or []]
+        stage = "IXSCAN" if keys and keys[0] in indexed else "COLLSCAN"
+        return {"queryPlanner": {"winningPlan": {"stage": stage}}}
+
+
+class MemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.RLock()
+        self.docs = {}     # _id -> document, in insertion order
+        self.indexes = {}  # name -> tuple of fields
+        self.unique = {}   # tuple of fields -> {key: _id}
+
+    def _candidates(self, query):
+        # _id and unique single-field indexes answer equality and $in lookups directly
+        if "_id" in query and not isinstance(query["_id"], dict):
+            return [self.docs[query["_id"]]] if query["_id"] in self.docs else []
+        for fields, keys in self.unique.items():
+            if len(fields) != 1 or fields[0] not in query:
+                continue
+            condition = query[fields[0]]
+            if not isinstance(condition, dict):
+                values = [condition]
+            elif list(condition) == ["$in"]:
+                values = condition["$in"]
+            else:
+                continue
+            ids = [keys[(value,)] for value in values if (value,) in keys]
+            return [self.docs[_id] for _id in dict.fromkeys(ids)]
+        return self.docs.values()
+
+    def _select(self, query):
+        return [doc for doc in self._candidates(query) if matches(doc, query)]
+
+    def _key(self, doc, fields):
+        return tuple(doc.get(field) for field in fields)
+
+    def _check_unique(self, doc):
+        for fields, keys in self.unique.items():
+            owner = keys.get(self._key(doc, fields))
+            if owner is not None and owner != doc["_id"]:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name}",
+                    11000,
+                    {"keyPattern": {field: 1 for field in fields}},
+                )
+
+    def _store(self, doc, previous=None):
+        self._check_unique(doc)
+        for fields, keys in self.unique.items():
+            if previous is not None:
+                keys.pop(self._key(previous, fields), None)
+            keys[self._key(doc, fields)] = doc["_id"]
+        self.docs[doc["_id"]] = doc
+
+    def _insert(self, doc):
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name}", 11000, {"keyPattern": {"_id": 1}})
+        self._store(copy.deepcopy(doc))
+        return doc["_id"]
+
+    def _remove(self, doc):
+        for fields, keys in self.unique.items():
+            keys.pop(self._key(doc, fields), None)
+        del self.docs[doc["_id"]]
+
+    def _upsert_base(self, query):
+        return {field: value for field, value in query.items() if not isinstance(value, dict)}
+
+    def _update(self, query, update, upsert, replace=False):
+        existing = next(iter(self._select(query)), None)
+        if existing is None:
+            if not upsert:
+                return None, None
+            doc = self._upsert_base(query)
+            if replace:
+                doc.update(copy.deepcopy(update))
+            else:
+                apply_update(doc, update)
+            _id = self._insert(doc)
+            return self.docs[_id], _id
+        if replace:
+            updated = dict(copy.deepcopy(update), _id=existing["_id"])
+        else:
+            updated = copy.deepcopy(existing)
+            apply_update(updated, update)
+        self._store(updated, previous=existing)
+        return updated, None
+
+    def create_indexes(self, models):
+        with self.lock:
+            for model in models:
+                document = model.document
+                fields = tuple(document["key"])
+                if document.get("unique") and fields not in self.unique:
+                    keys = {}
+                    for doc in self.docs.values():
+                        key = self._key(doc, fields)
+                        if key in keys:
+                            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name}", 11000)
+                        keys[key] = doc["_id"]
+                    self.unique[fields] = keys
+                self.indexes[document["name"]] = fields
+            return [model.document["name"] for model in models]
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, batch_size=0):
+        cursor = MemoryCursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.limit(limit)
+
+    def find_one(self, filter=None, projection=None):
+        return next(self.find(filter, projection, limit=1), None)
+
+    def aggregate(self, pipeline, **kwargs):
+        with self.lock:
+            docs = [copy.deepcopy(doc) for doc in self.docs.values()]
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$match":
+                docs = [doc for doc in docs if matches(doc, spec)]
+            elif op == "$group":
+                docs = _group(docs, spec)
+            elif op == "$sort":
+                for field, direction in reversed(list(spec.items())):
+                    docs.sort(key=lambda doc: _sort_key(doc.get(field)), reverse=direction < 0)
+            elif op == "$limit":
+                docs = docs[:spec]
+            else:
+                raise NotImplementedError(f"memory store does not support {op}")
+        return iter(docs)
+
+    def count_documents(self, filter):
+        with self.lock:
+            return len(self._select(filter))
+
+    def insert_one(self, document):
+        with self.lock:
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents, ordered=True):
+        with self.lock:
+            return InsertManyResult([self._insert(doc) for doc in documents], True)
+
+    def update_one(self, filter, update, upsert=False):
+        with self.lock:
+            doc, upserted_id = self._update(filter, update, upsert)
+        raw = {"n": int(doc is not None), "nModified": int(doc is not None and upserted_id is None)}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    def update_many(self, filter, update, upsert=False):
+        with self.lock:
+            docs = self._select(filter)
+            for doc in docs:
+                updated = copy.deepcopy(doc)
+                apply_update(updated, update)
+                self._store(updated, previous=doc)
+            if not docs and upsert:
+                return self.update_one(filter, update, upsert=True)
+        return UpdateResult({"n": len(docs), "nModified": len(docs)}, True)
+
+    def find_one_and_update(self, filter, update, projection=None, upsert=False, return_document=False):
+        with self.lock:
+            before = next(iter(self._select(filter)), None)
+            before = copy.deepcopy(before) if before is not None else None
+            doc, _ = self._update(filter, update, upsert)
+            doc = copy.deepcopy(doc) if doc is not None else None
+        if doc is None:
+            return None
+        # ReturnDocument.AFTER is True
+        if return_document:
+            return project(doc, projection)
+        return project(before, projection) if before is not None else None
+
+    def delete_one(self, filter):
+        with self.lock:
+            doc = next(iter(self._select(filter)), None)
+            if doc is not None:
+                self._remove(doc)
+        return DeleteResult({"n": int(doc is not None)}, True)
+
+    def delete_many(self, filter):
+        with self.lock:
+            docs = self._select(filter)
+            for doc in docs:
+                self._remove(doc)
+        return DeleteResult({"n": len(docs)}, True)
+
+    def bulk_write(self, requests, ordered=True):
+        counts = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        with self.lock:
+            for index, request in enumerate(requests):
+                if not isinstance(request, (ReplaceOne, UpdateOne)):
+                    raise NotImplementedError(f"memory store does not support {type(request).__name__}")
+                replace = isinstance(request, ReplaceOne)
+                doc, upserted_id = self._update(request._filter, request._doc, request._upsert, replace=replace)
+                if upserted_id is not None:
+                    counts["nUpserted"] += 1
+                    counts["upserted"].append({"index": index, "_id": upserted_id})
+                elif doc is not None:
+                    counts["nMatched"] += 1
+                    counts["nModified"] += 1
+        counts["writeErrors"] = []
+        counts["writeConcernErrors"] = []
+        return BulkWriteResult(counts, True)
+
+
+class MemoryDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(name)
+            return self._collections[name]
+
+
+class MemoryClient:
+    """Drop-in for the MongoClient calls database.py makes."""
+
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+    def close(self):
+        pass
@@ -0,0 +1,263 @@
+"""Request, database and cache metrics in Prometheus text format.
+
+``MetricsMiddleware`` records per-route latency histograms, status codes
+and in-flight requests; routes are labelled with their template
+(``/api/tracks/{track_id}``), never the raw path, so label cardinality
+stays bounded.  ``CommandTimer`` is a pymongo command listener that times
+every database command by collection and command name.  Counters kept
+elsewhere (cache hits, bcrypt pool rejections) are read at scrape time by
+collectors, so they add nothing to the request path.
+
+Recording a sample is a dict lookup and a bisect under a per-metric lock,
+cheap enough to leave on under full load.
+
+Configuration (environment):
+
+    METRICS_ENABLED  record and expose metrics (default: 1)
+"""
+import bisect
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') not in ('0', 'false', 'no')
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # per-bucket counts (last one is +Inf), sum
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = self.header()
+        bounds = self.buckets + (float("inf"),)
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def collector(self, fn):
+        """Register ``fn()`` returning metrics to render at scrape time."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for metric in collect():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to send the full response", ("method", "route"))
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "Responses sent", ("method", "route", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "Requests being handled", ("method",))
+DB_CALL_SECONDS = REGISTRY.histogram(
+    "db_call_duration_seconds", "Awaited database calls, including executor queueing", ("collection", "operation"))
+MONGO_COMMAND_SECONDS = REGISTRY.histogram(
+    "mongo_command_duration_seconds", "Mongo command round trips", ("collection", "command"))
+MONGO_COMMAND_FAILURES = REGISTRY.counter(
+    "mongo_command_failures_total", "Mongo commands that returned an error", ("collection", "command"))
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and in-flight counts per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec(method)
+            # The router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(elapsed, method, route)
+            HTTP_REQUESTS.inc(method, route, str(status_code))
+
+
+class CommandTimer(monitoring.CommandListener):
+    """pymongo command listener feeding MONGO_COMMAND_SECONDS."""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        command = event.command
+        target = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def _finished(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, collection, event.command_name)
+        return collection
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.inc(self._finished(event), event.command_name)
+
+
+def cache_metrics(caches):
+    """Hit/miss/size metrics for ``{name: cache}``, where each cache has ``stats()``."""
+    hits = Counter("cache_hits_total", "Cache lookups that hit", ("cache",))
+    misses = Counter("cache_misses_total", "Cache lookups that missed", ("cache",))
+    size = Gauge("cache_entries", "Entries currently cached", ("cache",))
+    for name, cache in caches.items():
+        stats = cache.stats()
+        hits.inc(name, amount=stats["hits"])
+        misses.inc(name, amount=stats["misses"])
+        size.set(name, value=stats["size"])
+    return [hits, misses, size]
+
+
+def hashing_metrics(hasher):
+    """Queue depth and outcomes of a PasswordHasher."""
+    pending = Gauge("bcrypt_pending", "bcrypt calls queued or running")
+    completed = Counter("bcrypt_completed_total", "bcrypt calls finished")
+    failed = Counter("bcrypt_failed_total", "bcrypt calls that raised")
+    cancelled = Counter("bcrypt_cancelled_total", "bcrypt calls abandoned before a thread ran them")
+    rejected = Counter("bcrypt_rejected_total", "bcrypt calls rejected because the pool was saturated")
+    pending.set(value=hasher.pending)
+    completed.inc(amount=hasher.completed)
+    failed.inc(amount=hasher.failed)
+    cancelled.inc(amount=hasher.cancelled)
+    rejected.inc(amount=hasher.rejected)
+    return [pending, completed, failed, cancelled, rejected]
+
+
+def limiter_metrics(limiters):
+    """Admission counts for ``{name: TokenBucketLimiter}``."""
+    allowed = Counter("rate_limit_allowed_total", "Requests admitted by a rate limiter", ("limiter",))
+    rejected = Counter("rate_limit_rejected_total", "Requests shed by a rate limiter", ("limiter",))
+    for name, limiter in limiters.items():
+        allowed.inc(name, amount=limiter.allowed)
+        rejected.inc(name, amount=limiter.rejected)
+    return [allowed, rejected]
@@ -0,0 +1,90 @@
+"""bcrypt hashing and verification on a dedicated worker pool.
+
+A bcrypt call costs hundreds of milliseconds of CPU.  Running it inline in
+an async handler freezes every other request on the worker, so calls go to
+a bounded thread pool instead (bcrypt releases the GIL while hashing).
+When more than BCRYPT_MAX_PENDING calls are queued or running, new ones
+fail fast with HashingPoolSaturated rather than piling up behind a burst.
+A call stays pending until its thread is done with it: a caller that gives
+up (a cancelled request) does not free the slot of a hash still running.
+
+Configuration (environment):
+
+    BCRYPT_ROUNDS       work factor for new hashes (default: 12)
+    BCRYPT_WORKERS      threads dedicated to bcrypt (default: CPU count)
+    BCRYPT_MAX_PENDING  queued + running calls before rejecting (default: 4 x workers)
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import bcrypt
+
+import profiling
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 1))
+BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', BCRYPT_WORKERS * 4))
+
+
+class HashingPoolSaturated(Exception):
+    """Too many bcrypt calls are already queued."""
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Awaitable bcrypt with bounded concurrency and queue depth."""
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=BCRYPT_WORKERS, max_pending=BCRYPT_MAX_PENDING):
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0  # dropped from the queue before a thread took them
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    async def _submit(self, fn, *args):
+        # The counters are only touched from the event loop thread, so no lock is needed
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashingPoolSaturated()
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(profiling.attach(fn, "bcrypt"), *args)
+        self.pending += 1
+        future.add_done_callback(partial(self._done, loop))
+        return await asyncio.wrap_future(future)
+
+    def _done(self, loop, future):
+        # Runs on the bcrypt thread as the call ends, or at once if it is cancelled before starting
+        try:
+            loop.call_soon_threadsafe(self._settle, future)
+        except RuntimeError:
+            pass  # the loop is closed
+
+    def _settle(self, future):
+        self.pending -= 1
+        if future.cancelled():
+            self.cancelled += 1
+        elif future.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._submit(verify_password, password, hashed)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,180 @@
+"""Write-behind play counting and materialized charts.
+
+A write per playback event would swamp the database, so PlayCounter folds
+each event into an in-memory tally keyed by (track, genre, UTC day) and
+flushes the tally as ``$inc`` upserts in one unordered bulk write per
+collection once PLAY_FLUSH_EVENTS events have accumulated or
+PLAY_FLUSH_SECONDS have passed, whichever comes first.  The counters are
+materialized per day:
+
+    track_plays   {track_id, day, plays}
+    genre_plays   {genre, day, plays}
+
+Charts sum the day documents of a window (never raw events, which are not
+stored) in a ``$group``/``$sort``/``$limit`` aggregation, so the database
+returns only the chart rows, and are cached for CHART_CACHE_SECONDS.
+
+Delivery is at-least-once.  A failed flush puts its tally back to be
+retried with the next one, so plays from a write that failed halfway may be
+counted twice.  On graceful shutdown the tally is flushed, or, if that
+fails, appended to PLAY_SPOOL_PATH and replayed by the next startup.
+
+Configuration (environment):
+
+    PLAY_FLUSH_EVENTS    buffered plays that trigger a flush (default: 1000)
+    PLAY_FLUSH_SECONDS   longest a play stays buffered (default: 5)
+    PLAY_SPOOL_PATH      tally kept across a restart if the final flush fails
+                         (default: ./plays.spool)
+    CHART_CACHE_SECONDS  how long a computed chart is served (default: 60)
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+from pymongo import UpdateOne
+
+from auth_cache import ExpiringCache
+
+logger = logging.getLogger(__name__)
+
+PLAY_FLUSH_EVENTS = int(os.environ.get('PLAY_FLUSH_EVENTS', 1000))
+PLAY_FLUSH_SECONDS = float(os.environ.get('PLAY_FLUSH_SECONDS', 5))
+PLAY_SPOOL_PATH = os.environ.get(
+    'PLAY_SPOOL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plays.spool')
+)
+CHART_CACHE_SECONDS = float(os.environ.get('CHART_CACHE_SECONDS', 60))
+
+DAY_SECONDS = 86400
+
+
+def day_bucket(timestamp):
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+def _increments(counts, field):
+    return [
+        UpdateOne({field: key, "day": day}, {"$inc": {"plays": plays}}, upsert=True)
+        for (key, day), plays in counts.items()
+    ]
+
+
+class PlayCounter:
+    def __init__(self, track_plays, genre_plays, flush_events=PLAY_FLUSH_EVENTS, flush_seconds=PLAY_FLUSH_SECONDS,
+                 spool_path=PLAY_SPOOL_PATH):
+        self.track_plays = track_plays
+        self.genre_plays = genre_plays
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self.spool_path = spool_path
+        self.charts = ExpiringCache(256)
+        self.recorded = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+        self._pending = Counter()  # (track id, genre, day) -> plays
+        self._pending_events = 0
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def pending(self):
+        return self._pending_events
+
+    def record(self, track_id, genre, timestamp=None):
+        """Count one play; it reaches the database with the next flush."""
+        self._pending[(track_id, genre or "", day_bucket(time.time() if timestamp is None else timestamp))] += 1
+        self._pending_events += 1
+        self.recorded += 1
+        if self._pending_events >= self.flush_events:
+            self._wake.set()
+
+    async def flush(self):
+        """Write the buffered tally; on failure it is kept for the next attempt."""
+        async with self._flush_lock:
+            tally, events = self._pending, self._pending_events
+            if not tally:
+                return 0
+            self._pending, self._pending_events = Counter(), 0
+            tracks, genres = Counter(), Counter()
+            for (track_id, genre, day), plays in tally.items():
+                tracks[(track_id, day)] += plays
+                if genre:
+                    genres[(genre, day)] += plays
+            try:
+                await self.track_plays.bulk_write(_increments(tracks, "track_id"), ordered=False)
+                if genres:
+                    await self.genre_plays.bulk_write(_increments(genres, "genre"), ordered=False)
+            except BaseException:
+                # Cancelled mid-write too: the tally goes back to be retried, or spooled on shutdown
+                self._pending.update(tally)
+                self._pending_events += events
+                self.failed_flushes += 1
+                raise
+            self.flushed += events
+            return events
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Flushing %d buffered plays failed; will retry", self._pending_events)
+                await asyncio.sleep(self.flush_seconds)
+
+    async def start(self):
+        """Pick up plays spooled by a previous shutdown and start the flush loop."""
+        claimed = f"{self.spool_path}.{os.getpid()}"
+        try:
+            # Renamed first so that of several starting workers exactly one replays it
+            os.rename(self.spool_path, claimed)
+        except FileNotFoundError:
+            pass
+        else:
+            with open(claimed) as f:
+                for line in f:
+                    track_id, genre, day, plays = json.loads(line)
+                    self._pending[(track_id, genre, day)] += plays
+                    self._pending_events += plays
+            os.remove(claimed)
+            logger.info("Replaying %d spooled plays", self._pending_events)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            # Let a flush it is in the middle of put its tally back first
+            await asyncio.gather(self._task, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Final flush failed; spooling %d plays to %s", self._pending_events, self.spool_path)
+            lines = "".join(json.dumps([*key, plays]) + "\n" for key, plays in self._pending.items())
+            with open(self.spool_path, 'a') as f:
+                f.write(lines)
+            self._pending, self._pending_events = Counter(), 0
+
+    async def top(self, dimension, days, limit):
+        """``[(track id or genre, plays)]`` over the last ``days`` UTC days, most played first."""
+        key = (dimension, days, limit)
+        chart = self.charts.get(key)
+        if chart is not None:
+            return chart
+        collection, field = (self.track_plays, "track_id") if dimension == "tracks" else (self.genre_plays, "genre")
+        since = day_bucket(time.time() - (days - 1) * DAY_SECONDS)
+        docs = await collection.aggregate([
+            {"$match": {"day": {"$gte": since}}},
+            {"$group": {"_id": f"${field}", "plays": {"$sum": "$plays"}}},
+            {"$sort": {"plays": -1, "_id": 1}},
+            {"$limit": limit},
+        ], allowDiskUse=True)
+        chart = [(doc["_id"], doc["plays"]) for doc in docs]
+        self.charts.put(key, chart, time.time() + CHART_CACHE_SECONDS)
+        return chart
@@ -0,0 +1,135 @@
+"""Playlist change sequence for delta sync and the live change feed.
+
+Every playlist write takes the next number of its owner's change sequence
+(``meta`` collection, ``_id: "playlists:<username>"``) and stores it on
+the playlist as ``seq``; a deletion leaves a tombstone with its sequence
+number in ``playlist_tombstones``.  A client holding sequence version V
+asks for playlists and tombstones with ``seq > V`` instead of re-reading
+every playlist.
+
+Numbers are allocated before the write lands, so a reader must not hand out
+a version past a write still in flight: allocation records the number as
+pending until ``change`` completes, and ``stable_version`` is one below the
+oldest pending number.  An allocation abandoned by a crashed worker stops
+counting after PENDING_TIMEOUT seconds and is then removed.
+
+Tombstones expire after PLAYLIST_TOMBSTONE_DAYS.  About once a day a write
+also records its number and time as a mark, so ``expired`` can tell that a
+client's version is older than that and its delta could miss deletions; such
+a client is told to reload the full list instead.
+
+Open change feeds wake as soon as a write is made on the same worker, and
+check the sequence every PLAYLIST_FEED_POLL_SECONDS for writes made by other
+workers.
+
+Configuration (environment):
+
+    PLAYLIST_FEED_POLL_SECONDS       how often feeds check for other workers' writes (default: 2)
+    PLAYLIST_FEED_HEARTBEAT_SECONDS  keep-alive interval of an idle feed (default: 15)
+    PLAYLIST_TOMBSTONE_DAYS          how long deletions are kept for delta sync (default: 30)
+"""
+import asyncio
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+from pymongo.errors import DuplicateKeyError
+
+PLAYLIST_FEED_POLL_SECONDS = float(os.environ.get('PLAYLIST_FEED_POLL_SECONDS', 2))
+PLAYLIST_FEED_HEARTBEAT_SECONDS = float(os.environ.get('PLAYLIST_FEED_HEARTBEAT_SECONDS', 15))
+PLAYLIST_TOMBSTONE_DAYS = int(os.environ.get('PLAYLIST_TOMBSTONE_DAYS', 30))
+PENDING_TIMEOUT = 60
+DAY_SECONDS = 86400
+
+
+class PlaylistChanges:
+    def __init__(self, meta_collection, tombstones_collection):
+        self.meta = meta_collection
+        self.tombstones = tombstones_collection
+        self._wakeups = weakref.WeakValueDictionary()  # username -> asyncio.Event of open feeds
+
+    @staticmethod
+    def _key(username):
+        return f"playlists:{username}"
+
+    async def _allocate(self, username):
+        key = self._key(username)
+        while True:
+            doc = await self.meta.find_one({"_id": key}, {"seq": 1, "marks": 1})
+            if doc is None:
+                try:
+                    await self.meta.insert_one({"_id": key, "seq": 0, "pending": [], "marks": []})
+                except DuplicateKeyError:
+                    pass
+                continue
+            seq = doc["seq"] + 1
+            pending = {"seq": seq, "at": time.time()}
+            push = {"pending": pending}
+            marks = doc.get("marks") or []
+            if not marks or marks[-1]["at"] <= pending["at"] - DAY_SECONDS:
+                # At most one a day, and enough to reach back past the tombstone lifetime
+                push["marks"] = {"$each": [pending], "$slice": -(PLAYLIST_TOMBSTONE_DAYS + 2)}
+            # Compare-and-set on the current number; another writer won if nothing matched
+            result = await self.meta.update_one({"_id": key, "seq": doc["seq"]}, {"$set": {"seq": seq}, "$push": push})
+            if result.modified_count:
+                return pending
+
+    @asynccontextmanager
+    async def change(self, username):
+        """Allocate the next sequence number for a write made inside the block."""
+        pending = await self._allocate(username)
+        try:
+            yield pending["seq"]
+        finally:
+            await self.meta.update_one({"_id": self._key(username)}, {"$pull": {"pending": pending}})
+            self.notify(username)
+
+    async def stable_version(self, username):
+        """The highest sequence number below which every write has completed."""
+        doc = await self.meta.find_one({"_id": self._key(username)}, {"seq": 1, "pending": 1})
+        if doc is None:
+            return 0
+        cutoff = time.time() - PENDING_TIMEOUT
+        pending = doc.get("pending", [])
+        in_flight = [entry["seq"] for entry in pending if entry["at"] > cutoff]
+        if len(in_flight) < len(pending):
+            # Abandoned by a worker that died before its ``$pull``
+            await self.meta.update_one({"_id": self._key(username)}, {"$pull": {"pending": {"at": {"$lte": cutoff}}}})
+        return min(in_flight) - 1 if in_flight else doc["seq"]
+
+    async def expired(self, username, since):
+        """Whether deletions after version ``since`` may have outlived their tombstones."""
+        doc = await self.meta.find_one({"_id": self._key(username)}, {"seq": 1, "marks": 1})
+        if doc is None:
+            return False
+        cutoff = time.time() - PLAYLIST_TOMBSTONE_DAYS * DAY_SECONDS
+        # Numbers below the first mark made after the cutoff may all have been allocated before it
+        horizon = next((mark["seq"] for mark in doc.get("marks", []) if mark["at"] > cutoff), doc["seq"] + 1) - 1
+        return since < horizon
+
+    async def tombstone(self, username, playlist_id, seq, deleted_at):
+        await self.tombstones.insert_one(
+            {"username": username, "playlist_id": playlist_id, "seq": seq, "deleted_at": deleted_at}
+        )
+
+    async def deleted_since(self, username, since):
+        docs = await self.tombstones.find(
+            {"username": username, "seq": {"$gt": since}}, {"_id": 0, "playlist_id": 1}
+        )
+        return [doc["playlist_id"] for doc in docs]
+
+    def notify(self, username):
+        event = self._wakeups.pop(username, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, username, timeout=PLAYLIST_FEED_POLL_SECONDS):
+        """Return after a local write for ``username`` or ``timeout`` seconds, whichever is first."""
+        event = self._wakeups.get(username)
+        if event is None:
+            event = self._wakeups[username] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,301 @@
+"""Opt-in statistical profiling of sampled requests.
+
+A request is profiled when it wins the PROFILE_SAMPLE_RATE draw, or when
+it carries ``X-Profile: <PROFILE_TOKEN>``.  While any profile is open a
+sampler thread wakes every PROFILE_INTERVAL_MS and, for each open profile,
+records one stack tagged with where the request was at that moment:
+
+    cpu     its task was running on the event loop (handler code, JWT,
+            validation, JSON encoding): the event loop thread's stack
+    db      a database call of the request was running on the database
+            executor (see database.py): that thread's stack
+    bcrypt  a password hash of the request was running (see passwords.py)
+    wait    none of those: the chain of coroutines the request is awaiting,
+            e.g. a queued database call or a thread running ``to_thread`` work
+
+Each sample is weighted by the time since the previous one, so the time per
+tag adds up to about the request's wall time even when a busy GIL delays
+the sampler (fewer samples are taken then).  Finished profiles
+go to a ring buffer of the last PROFILE_BUFFER_SIZE, readable as collapsed
+stacks (``tag;outer;...;inner count`` per line), which flamegraph.pl,
+speedscope and inferno read as is.  The response of a profiled request
+names its profile in ``X-Profile-Id``.
+
+An unprofiled request costs one ContextVar lookup per database call, plus a
+random draw when PROFILE_SAMPLE_RATE is set and a scan of its headers when
+PROFILE_TOKEN is.  The sampler runs only while a profile is open, and at
+most PROFILE_MAX_ACTIVE requests are profiled at once.
+
+Configuration (environment):
+
+    PROFILE_SAMPLE_RATE  fraction of requests profiled (default: 0)
+    PROFILE_TOKEN        secret for X-Profile and the profile endpoints (default: unset, both disabled)
+    PROFILE_INTERVAL_MS  sampling interval (default: 5)
+    PROFILE_BUFFER_SIZE  finished profiles kept (default: 50)
+    PROFILE_MAX_ACTIVE   requests profiled at the same time (default: 4)
+"""
+import asyncio
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from functools import wraps
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', 50))
+PROFILE_MAX_ACTIVE = int(os.environ.get('PROFILE_MAX_ACTIVE', 4))
+
+HEADER = b"x-profile"
+EXCLUDED_PREFIX = "/api/debug/"
+MAX_DEPTH = 128
+
+# The profile of the request being handled, if it is profiled
+ACTIVE = contextvars.ContextVar("profile", default=None)
+
+_labels = {}  # code object -> frame label
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def _frame_stack(frame):
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_chain(task):
+    """Labels of the coroutines ``task`` is suspended in, outermost first."""
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(stack) < MAX_DEPTH:
+        code = getattr(awaitable, "cr_code", None) or getattr(awaitable, "gi_code", None)
+        if code is None:
+            stack.append(type(awaitable).__name__)
+            break
+        stack.append(_label(code))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return stack
+
+
+def authorized(token):
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def attach(fn, tag):
+    """Wrap ``fn``, about to be run on a pool thread, so that the thread is sampled
+    under ``tag`` for the current request's profile; ``fn`` itself if there is none."""
+    profile = ACTIVE.get()
+    if profile is None:
+        return fn
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        ident = threading.get_ident()
+        profile.threads[ident] = tag
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.threads.pop(ident, None)
+    return run
+
+
+class Profile:
+    def __init__(self, scope, interval):
+        self.id = uuid.uuid4().hex
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.route = None
+        self.status = None
+        self.interval = interval
+        self.started_at = datetime.utcnow()
+        self.wall = None
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.task = asyncio.current_task()
+        self.threads = {}  # pool thread ident -> tag, while running work of this request
+        self.stacks = Counter()
+        self.samples = Counter()
+        self.seconds = Counter()  # tag -> time attributed to it
+        self._start = self._last = time.perf_counter()
+
+    def _owns(self, task):
+        if task is self.task:
+            return True
+        # Python 3.12+: also tasks the request spawned, e.g. streaming a response body
+        get_context = getattr(task, "get_context", None)
+        return get_context is not None and get_context().get(ACTIVE) is self
+
+    def _add(self, tag, stack, elapsed):
+        self.samples[tag] += 1
+        self.seconds[tag] += elapsed
+        self.stacks[";".join([tag, *stack])] += 1
+
+    def sample(self, frames, now):
+        elapsed, self._last = now - self._last, now
+        sampled = False
+        task = asyncio.current_task(self.loop)
+        if task is not None and self._owns(task) and self.loop_thread in frames:
+            self._add("cpu", _frame_stack(frames[self.loop_thread]), elapsed)
+            sampled = True
+        for ident, tag in list(self.threads.items()):
+            frame = frames.get(ident)
+            if frame is not None:
+                self._add(tag, _frame_stack(frame), elapsed)
+                sampled = True
+        if not sampled and self.task is not None:
+            self._add("wait", _await_chain(self.task), elapsed)
+
+    def finish(self, route, status):
+        self.wall = time.perf_counter() - self._start
+        self.route = route
+        self.status = status
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": self.started_at,
+            "wall_ms": round(self.wall * 1000, 3) if self.wall is not None else None,
+            "interval_ms": self.interval * 1000,
+            "samples": dict(self.samples),
+            "sampled_ms": {tag: round(seconds * 1000, 3) for tag, seconds in self.seconds.items()},
+        }
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS, buffer_size=PROFILE_BUFFER_SIZE, max_active=PROFILE_MAX_ACTIVE):
+        self.interval = interval_ms / 1000
+        self.max_active = max_active
+        self.finished = deque(maxlen=buffer_size)
+        self.captured = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def begin(self, scope):
+        """Open a profile for the current request, or return None if enough are open."""
+        with self._lock:
+            if len(self._active) >= self.max_active:
+                return None
+            profile = Profile(scope, self.interval)
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return profile
+
+    def end(self, profile, route, status):
+        with self._lock:
+            self._active.discard(profile)
+        profile.finish(route, status)
+        self.finished.append(profile)
+        self.captured += 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._active
+                if idle:
+                    self._wake.clear()
+            if idle:
+                self._wake.wait()
+                continue
+            time.sleep(self.interval)
+            # Under the lock, so that a profile is never sampled after ``end``
+            with self._lock:
+                if self._active:
+                    frames = sys._current_frames()
+                    now = time.perf_counter()
+                    for profile in self._active:
+                        profile.sample(frames, now)
+                    del frames
+
+    def get(self, profile_id):
+        return next((profile for profile in self.finished if profile.id == profile_id), None)
+
+    def profiles(self, route=None):
+        """Finished profiles, newest first."""
+        return [profile for profile in reversed(self.finished) if route is None or profile.route == route]
+
+    def collapsed(self, route=None, tag=None):
+        """Collapsed stacks of every buffered profile (of ``route``), merged."""
+        stacks = Counter()
+        for profile in self.profiles(route):
+            stacks.update(profile.stacks)
+        prefix = f"{tag};" if tag else ""
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common() if stack.startswith(prefix))
+
+
+PROFILER = Profiler()
+
+
+def _wanted(scope):
+    if not (PROFILE_SAMPLE_RATE or PROFILE_TOKEN):
+        return False
+    if scope["path"].startswith(EXCLUDED_PREFIX):
+        return False
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    if PROFILE_TOKEN:
+        for name, value in scope["headers"]:
+            if name == HEADER:
+                return authorized(value.decode("latin-1"))
+    return False
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling sampled requests into PROFILER."""
+
+    def __init__(self, app, profiler=PROFILER):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _wanted(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = self.profiler.begin(scope)
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = dict(message, headers=[*message.get("headers", []), (b"x-profile-id", profile.id.encode())])
+            await send(message)
+
+        token = ACTIVE.set(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            ACTIVE.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.profiler.end(profile, route, status_code)
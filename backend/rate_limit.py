@@ -0,0 +1,56 @@
+"""Per-client token-bucket admission control.
+
+Each client key (a username, or the remote address for anonymous calls;
+see serve.py for clients behind a proxy) gets a bucket of ``burst`` tokens
+refilled at ``rate`` per second; a request spends one token or is rejected
+at once with the number of seconds until the next token.  Rejecting is the
+point: for keystroke traffic a late answer is worthless, so excess
+requests are shed rather than queued.  Buckets are kept in a bounded LRU;
+an evicted client simply starts again with a full bucket.
+
+Configuration (environment):
+
+    SEARCH_RATE         sustained searches per second per client (default: 10)
+    SEARCH_BURST        searches a client may make back to back (default: 20)
+    RATE_LIMIT_CLIENTS  buckets kept (default: 100000)
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+
+SEARCH_RATE = float(os.environ.get('SEARCH_RATE', 10))
+SEARCH_BURST = float(os.environ.get('SEARCH_BURST', 20))
+RATE_LIMIT_CLIENTS = int(os.environ.get('RATE_LIMIT_CLIENTS', 100000))
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate, burst, max_clients=RATE_LIMIT_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = OrderedDict()  # key -> (tokens, last refill, monotonic)
+
+    def acquire(self, key, now=None):
+        """Spend a token for ``key``; return 0 if allowed, else seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+            self.allowed += 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.rejected += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+def retry_after(wait):
+    """``wait`` as a Retry-After header value (whole seconds, at least 1)."""
+    return str(max(1, math.ceil(wait)))
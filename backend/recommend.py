@@ -0,0 +1,267 @@
+"""Related tracks and playlist radio from playlist co-occurrence.
+
+Two tracks are related when they appear in the same playlists.  The model
+keeps a symmetric sparse track x track matrix of co-occurrence counts as
+dict-of-rows (cheap to update one playlist at a time) plus, per track, the
+number of playlists containing it.  Relatedness is the cosine-normalized
+count ``c(a, b) / sqrt(n(a) * n(b))`` so that merely popular tracks do not
+dominate every list.
+
+* ``set_playlist``/``remove_playlist`` apply the delta between a
+  playlist's old and new set of tracks, touching only the affected pairs.
+* ``related`` returns a track's top-k, memoized per row until the row
+  changes; ``radio`` sums the top-k lists of a playlist's tracks.
+* ``save``/``load`` snapshot the model to disk as NumPy CSR arrays: the
+  pair counts and per-track totals, mapped straight back in on load, and
+  the playlist memberships that later incremental updates diff against.
+  ``sync`` catches up with the database by playlist version, so a restart
+  re-reads only playlists that changed since the snapshot.
+
+Only the first RECOMMEND_MAX_PLAYLIST_TRACKS distinct tracks of a playlist
+count: pairs grow quadratically and huge playlists say little about any
+one pair.
+
+Configuration (environment):
+
+    RECOMMEND_SNAPSHOT_PATH        snapshot file (default: ./recommend.npz)
+    RECOMMEND_MAX_PLAYLIST_TRACKS  tracks per playlist considered (default: 500)
+    RECOMMEND_TOP_K                related tracks memoized per track (default: 100)
+    RECOMMEND_SYNC_SECONDS         how often to catch up and snapshot (default: 60)
+"""
+import asyncio
+import heapq
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+
+from track_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+RECOMMEND_SNAPSHOT_PATH = os.environ.get(
+    'RECOMMEND_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recommend.npz')
+)
+RECOMMEND_MAX_PLAYLIST_TRACKS = int(os.environ.get('RECOMMEND_MAX_PLAYLIST_TRACKS', 500))
+RECOMMEND_TOP_K = int(os.environ.get('RECOMMEND_TOP_K', 100))
+RECOMMEND_SYNC_SECONDS = float(os.environ.get('RECOMMEND_SYNC_SECONDS', 60))
+RECOMMEND_TOP_K_CACHE = 10000
+SYNC_BATCH_SIZE = 500
+
+
+class CooccurrenceModel:
+    def __init__(self, max_playlist_tracks=RECOMMEND_MAX_PLAYLIST_TRACKS, top_k=RECOMMEND_TOP_K):
+        self.max_playlist_tracks = max_playlist_tracks
+        self.top_k = top_k
+        self._lock = threading.RLock()
+        self._rows = {}       # track id -> {track id: co-occurrence count}
+        self._counts = {}     # track id -> playlists containing it
+        self._playlists = {}  # playlist id -> (version, frozenset of track ids)
+        self._entries = 0     # non-zero entries of the matrix, each pair counted from both ends
+        self._top = LRUCache(RECOMMEND_TOP_K_CACHE)
+
+    def __len__(self):
+        return len(self._playlists)
+
+    def _distinct(self, track_ids):
+        return frozenset(list(dict.fromkeys(track_ids))[:self.max_playlist_tracks])
+
+    def _bump(self, a, b, delta):
+        row = self._rows.setdefault(a, {})
+        previous = row.get(b, 0)
+        count = previous + delta
+        if count > 0:
+            row[b] = count
+            if not previous:
+                self._entries += 1
+        else:
+            if previous:
+                del row[b]
+                self._entries -= 1
+            if not row:
+                del self._rows[a]
+        self._top.pop(a)
+
+    def _apply_pairs(self, changed, members, delta):
+        # Each unordered pair with at least one endpoint in ``changed`` exactly once
+        for a in changed:
+            self._counts[a] = self._counts.get(a, 0) + delta
+            if self._counts[a] <= 0:
+                del self._counts[a]
+            self._top.pop(a)
+            for b in members:
+                if b != a and (b not in changed or a < b):
+                    self._bump(a, b, delta)
+                    self._bump(b, a, delta)
+
+    def _replace(self, playlist_id, new):
+        _, old = self._playlists.get(playlist_id, (None, frozenset()))
+        self._apply_pairs(old - new, old, -1)
+        self._apply_pairs(new - old, new, +1)
+        # Normalization changed for every neighbour of a changed track
+        for track_id in old ^ new:
+            for neighbour in self._rows.get(track_id, ()):
+                self._top.pop(neighbour)
+
+    def set_playlist(self, playlist_id, track_ids, version=0):
+        """Record a playlist's current tracks; older versions than the one held are ignored."""
+        with self._lock:
+            held = self._playlists.get(playlist_id)
+            if held is not None and version < held[0]:
+                return
+            new = self._distinct(track_ids)
+            self._replace(playlist_id, new)
+            self._playlists[playlist_id] = (version, new)
+
+    def remove_playlist(self, playlist_id):
+        with self._lock:
+            if playlist_id in self._playlists:
+                self._replace(playlist_id, frozenset())
+                del self._playlists[playlist_id]
+
+    def related(self, track_id, limit=None):
+        """``[(track id, score)]`` by descending relatedness."""
+        with self._lock:
+            top = self._top.get(track_id)
+            if top is None:
+                row = self._rows.get(track_id, {})
+                norm = self._counts.get(track_id, 1)
+                counts = self._counts
+                top = heapq.nlargest(
+                    self.top_k,
+                    ((other, count / math.sqrt(norm * counts.get(other, 1))) for other, count in row.items()),
+                    key=lambda item: (item[1], item[0]),
+                )
+                self._top.put(track_id, top)
+        return top[:limit] if limit else top
+
+    def radio(self, seed_ids, limit=50):
+        """Tracks most related to ``seed_ids`` as a whole, excluding the seeds."""
+        seeds = set(seed_ids)
+        scores = {}
+        for seed in seeds:
+            for other, score in self.related(seed):
+                if other not in seeds:
+                    scores[other] = scores.get(other, 0.0) + score
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+
+    def versions(self):
+        with self._lock:
+            return {playlist_id: version for playlist_id, (version, _) in self._playlists.items()}
+
+    async def sync(self, playlists_collection):
+        """Catch up with the database: re-read playlists whose version differs, drop deleted ones."""
+        current = {
+            doc["id"]: doc.get("version", 0)
+            for doc in await playlists_collection.find({}, {"_id": 0, "id": 1, "version": 1})
+        }
+        held = self.versions()
+        stale = [playlist_id for playlist_id, version in current.items() if held.get(playlist_id) != version]
+        for playlist_id in set(held) - set(current):
+            self.remove_playlist(playlist_id)
+        for start in range(0, len(stale), SYNC_BATCH_SIZE):
+            docs = await playlists_collection.find(
+                {"id": {"$in": stale[start:start + SYNC_BATCH_SIZE]}}, {"_id": 0, "id": 1, "version": 1, "track_ids": 1}
+            )
+            await asyncio.to_thread(self._set_many, docs)
+        return len(stale)
+
+    async def keep_synced(self, playlists_collection, path=RECOMMEND_SNAPSHOT_PATH, interval=RECOMMEND_SYNC_SECONDS):
+        """Periodically pick up other workers' playlist edits and refresh the snapshot."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await self.sync(playlists_collection):
+                    await asyncio.to_thread(self.save, path)
+            except Exception:
+                logger.exception("Recommendation sync failed")
+
+    def _set_many(self, docs):
+        for doc in docs:
+            self.set_playlist(doc["id"], doc.get("track_ids", []), doc.get("version", 0))
+
+    def save(self, path=RECOMMEND_SNAPSHOT_PATH):
+        """Write the matrix, per-track totals and playlists as CSR arrays over one sorted track list."""
+        with self._lock:
+            playlists = list(self._playlists.items())
+            track_ids = sorted(set(self._rows) | set(self._counts))
+            position = {track_id: i for i, track_id in enumerate(track_ids)}
+            pair_indptr = np.zeros(len(track_ids) + 1, dtype=np.int64)
+            pair_indices = np.empty(self._entries, dtype=np.int32)
+            pair_counts = np.empty(self._entries, dtype=np.int32)
+            filled = 0
+            for i, track_id in enumerate(track_ids):
+                row = self._rows.get(track_id, {})
+                pair_indices[filled:filled + len(row)] = [position[other] for other in row]
+                pair_counts[filled:filled + len(row)] = list(row.values())
+                filled += len(row)
+                pair_indptr[i + 1] = filled
+            track_counts = np.array([self._counts.get(track_id, 0) for track_id in track_ids], dtype=np.int64)
+        indptr = np.zeros(len(playlists) + 1, dtype=np.int64)
+        indices = []
+        for i, (_, (_, members)) in enumerate(playlists):
+            indices.extend(position[track_id] for track_id in members)
+            indptr[i + 1] = len(indices)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp,
+            track_ids=np.array(track_ids, dtype=str),
+            track_counts=track_counts,
+            pair_indptr=pair_indptr,
+            pair_indices=pair_indices,
+            pair_counts=pair_counts,
+            playlist_ids=np.array([playlist_id for playlist_id, _ in playlists], dtype=str),
+            versions=np.array([version for _, (version, _) in playlists], dtype=np.int64),
+            indptr=indptr,
+            indices=np.array(indices, dtype=np.int32),
+        )
+        os.replace(tmp, path)
+
+    def load(self, path=RECOMMEND_SNAPSHOT_PATH):
+        """Replace the model with a snapshot written by ``save``; return False if there is none."""
+        try:
+            snapshot = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return False
+        with snapshot:
+            track_ids = snapshot["track_ids"].tolist()
+            playlist_ids = snapshot["playlist_ids"].tolist()
+            versions = snapshot["versions"].tolist()
+            indptr = snapshot["indptr"]
+            indices = snapshot["indices"]
+            if "pair_counts" not in snapshot.files:
+                # Written before the matrix was stored: rebuild it from the playlists
+                for i, playlist_id in enumerate(playlist_ids):
+                    members = [track_ids[j] for j in indices[indptr[i]:indptr[i + 1]]]
+                    self.set_playlist(playlist_id, members, versions[i])
+                return True
+            track_counts = snapshot["track_counts"].tolist()
+            pair_indptr = snapshot["pair_indptr"].tolist()
+            pair_indices = snapshot["pair_indices"].tolist()
+            pair_counts = snapshot["pair_counts"].tolist()
+        rows = {}
+        for i, track_id in enumerate(track_ids):
+            start, end = pair_indptr[i], pair_indptr[i + 1]
+            if start < end:
+                rows[track_id] = dict(zip([track_ids[j] for j in pair_indices[start:end]], pair_counts[start:end]))
+        counts = {track_id: count for track_id, count in zip(track_ids, track_counts) if count}
+        playlists = {
+            playlist_id: (versions[i], frozenset(track_ids[j] for j in indices[indptr[i]:indptr[i + 1]]))
+            for i, playlist_id in enumerate(playlist_ids)
+        }
+        with self._lock:
+            self._rows, self._counts, self._playlists = rows, counts, playlists
+            self._entries = len(pair_indices)
+            self._top = LRUCache(RECOMMEND_TOP_K_CACHE)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "playlists": len(self._playlists),
+                "tracks": len(self._rows),
+                "pairs": self._entries // 2,
+            }
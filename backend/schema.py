@@ -0,0 +1,152 @@
+"""Index declarations and query-plan audit.
+
+``ensure_indexes`` creates every index the handlers rely on and is safe to
+run on every startup (creating an index that already exists is a no-op).
+``audit_query_plans`` runs ``explain()`` on each hot query shape and flags
+any that would fall back to a collection scan.
+
+Run as a script to apply the indexes and print the audit:
+
+    python schema.py          # exit status 1 if any hot query is a COLLSCAN
+"""
+import logging
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from playlist_sync import PLAYLIST_TOMBSTONE_DAYS
+from track_cache import CATALOG_CHANGE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "tracks": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "playlists": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("username", ASCENDING), ("id", ASCENDING)], name="username_id"),
+        IndexModel([("username", ASCENDING), ("seq", ASCENDING)], name="username_seq"),
+    ],
+    "playlist_tombstones": [
+        IndexModel([("username", ASCENDING), ("seq", ASCENDING)], name="username_seq"),
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_at_ttl",
+                   expireAfterSeconds=PLAYLIST_TOMBSTONE_DAYS * 86400),
+    ],
+    "track_plays": [
+        IndexModel([("track_id", ASCENDING), ("day", ASCENDING)], name="track_day_unique", unique=True),
+        IndexModel([("day", ASCENDING)], name="day"),
+    ],
+    "genre_plays": [
+        IndexModel([("genre", ASCENDING), ("day", ASCENDING)], name="genre_day_unique", unique=True),
+        IndexModel([("day", ASCENDING)], name="day"),
+    ],
+    "catalog_changes": [
+        IndexModel([("version", ASCENDING)], name="version_unique", unique=True),
+        IndexModel([("at", ASCENDING)], name="at_ttl", expireAfterSeconds=CATALOG_CHANGE_TTL_SECONDS),
+    ],
+    "jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("priority", ASCENDING), ("created_at", ASCENDING)],
+                   name="status_priority_created"),
+        IndexModel([("status", ASCENDING), ("heartbeat_at", ASCENDING)], name="status_heartbeat"),
+        IndexModel([("owner", ASCENDING), ("created_at", ASCENDING)], name="owner_created"),
+    ],
+    "import_spool": [
+        IndexModel([("upload", ASCENDING), ("n", ASCENDING)], name="upload_n_unique", unique=True),
+    ],
+}
+
+# (name, collection, filter, find options) for every query on a request path
+HOT_QUERIES = [
+    ("register/login: user by username", "users", {"username": "audit"}, {}),
+    ("register: user by email", "users", {"email": "audit@example.com"}, {}),
+    ("get_track: track by id", "tracks", {"id": "audit"}, {}),
+    ("get_all_tracks: first page", "tracks", {}, {"sort": [("id", ASCENDING)], "limit": 101}),
+    ("get_all_tracks: next page", "tracks", {"id": {"$gt": "audit"}}, {"sort": [("id", ASCENDING)], "limit": 101}),
+    ("hydrate_tracks: tracks by ids", "tracks", {"id": {"$in": ["audit-1", "audit-2"]}}, {}),
+    ("get_user_playlists: playlists by user", "playlists", {"username": "audit"}, {}),
+    ("get_playlist: playlist by id and user", "playlists", {"id": "audit", "username": "audit"}, {}),
+    ("get_user_playlists: playlists changed since", "playlists", {"username": "audit", "seq": {"$gt": 0}}, {}),
+    ("get_user_playlists: tombstones since", "playlist_tombstones", {"username": "audit", "seq": {"$gt": 0}}, {}),
+    ("record_play: flush a track counter", "track_plays", {"track_id": "audit", "day": "2000-01-01"}, {}),
+    ("get_track_chart: track counters since day", "track_plays", {"day": {"$gte": "2000-01-01"}}, {}),
+    ("get_genre_chart: genre counters since day", "genre_plays", {"day": {"$gte": "2000-01-01"}}, {}),
+    ("refresh_catalog_indexes: changes since version", "catalog_changes", {"version": {"$gt": 0, "$lte": 5}}, {}),
+    ("get_job: job by id", "jobs", {"id": "audit"}, {}),
+    ("list_jobs: jobs by owner", "jobs", {"owner": "audit"}, {"sort": [("created_at", -1)], "limit": 50}),
+    ("job queue: queued jobs by priority", "jobs", {"status": "queued", "worker": {"$in": [None, "audit"]}},
+     {"sort": [("priority", -1), ("created_at", 1)], "limit": 8}),
+    ("job queue: stale running jobs", "jobs", {"status": "running", "worker": None, "heartbeat_at": {"$lt": "audit"}},
+     {}),
+    ("job queue: stale process-local jobs", "jobs",
+     {"status": {"$in": ["queued", "running"]}, "worker": {"$ne": None}, "heartbeat_at": {"$lt": "audit"}}, {}),
+    ("run_track_import: spooled chunks from offset", "import_spool", {"upload": "audit", "n": {"$gte": 0}},
+     {"sort": [("n", ASCENDING)]}),
+]
+
+
+def ensure_indexes(db):
+    """Create the declared indexes; return the names of those that failed."""
+    failed = []
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        for index in indexes:
+            try:
+                collection.create_indexes([index])
+            except OperationFailure as exc:
+                # Typically duplicate data blocking a unique index
+                name = index.document["name"]
+                logger.error("Could not create index %s.%s: %s", collection_name, name, exc)
+                failed.append(f"{collection_name}.{name}")
+    return failed
+
+
+def _plan_stages(plan):
+    stages = []
+    while plan:
+        stage = plan.get("stage")
+        if stage:
+            stages.append(stage)
+        for child in plan.get("inputStages", []):
+            stages.extend(_plan_stages(child))
+        plan = plan.get("inputStage") or plan.get("queryPlan")
+    return stages
+
+
+def audit_query_plans(db):
+    """Explain every hot query shape and report the winning plan's stages."""
+    report = []
+    for name, collection_name, query, options in HOT_QUERIES:
+        cursor = db[collection_name].find(query, {"_id": 0})
+        if "sort" in options:
+            cursor = cursor.sort(options["sort"])
+        if "limit" in options:
+            cursor = cursor.limit(options["limit"])
+        explain = cursor.explain()
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(winning_plan)
+        report.append({
+            "query": name,
+            "collection": collection_name,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    from database import db
+
+    logging.basicConfig(level=logging.INFO)
+    failed = ensure_indexes(db)
+    report = audit_query_plans(db)
+    print(json.dumps({"failed_indexes": failed, "query_plans": report}, indent=2))
+    sys.exit(1 if failed or any(entry["collscan"] for entry in report) else 0)
@@ -0,0 +1,73 @@
+"""Result cache and request coalescing for search-as-you-type.
+
+Every keystroke is a search, and many users type the same popular
+prefixes at once.  Queries are reduced to a canonical key (their sorted
+set of normalized terms, see ``search_index.query_key``), and:
+
+* results are kept in a short-TTL LRU keyed by that canonical query, the
+  page requested and the index generation, so any catalog change makes
+  older entries unreachable at once;
+* concurrent misses for the same key share one in-flight execution
+  (single flight) instead of each ranking the catalog.
+
+The search itself runs on a worker thread so a slow query over a large
+catalog does not stall the event loop.
+
+Configuration (environment):
+
+    SEARCH_CACHE_SIZE  cached result pages (default: 4096)
+    SEARCH_CACHE_TTL   seconds a result page is reused (default: 5)
+"""
+import asyncio
+import os
+import time
+
+from auth_cache import ExpiringCache
+from search_index import query_key
+
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 4096))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 5))
+
+
+class SingleFlight:
+    """Run one coroutine per key at a time; concurrent callers await the same result."""
+
+    def __init__(self):
+        self._inflight = {}
+        self.shared = 0
+
+    async def do(self, key, fn):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        # A caller that goes away must not cancel the work for the others
+        return await asyncio.shield(future)
+
+
+class SearchCache:
+    def __init__(self, index, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL):
+        self.index = index
+        self.ttl = ttl
+        self.results = ExpiringCache(maxsize)
+        self.flight = SingleFlight()
+
+    async def search(self, query, limit, offset):
+        """Ranked tracks for ``query``, shared with identical concurrent and recent searches."""
+        key = (query_key(query), limit, offset, self.index.generation)
+        tracks = self.results.get(key)
+        if tracks is not None:
+            return tracks
+
+        async def run():
+            tracks = await asyncio.to_thread(self.index.search, key[0], limit=limit, offset=offset)
+            self.results.put(key, tracks, time.time() + self.ttl)
+            return tracks
+
+        return await self.flight.do(key, run)
+
+    def stats(self):
+        return dict(self.results.stats(), shared=self.flight.shared)
@@ -0,0 +1,210 @@
+"""In-memory inverted index over the track catalog.
+
+Tracks are tokenized on title/artist/album/genre and kept in memory so that
+search-as-you-type never has to touch Mongo.  Every query term matches whole
+tokens exactly or as a prefix (typeahead), all terms must match, and results
+are ranked by which fields matched and how closely.
+"""
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+
+# Per-field weights used for relevance ranking
+FIELD_WEIGHTS = {
+    "title": 4.0,
+    "artist": 3.0,
+    "album": 2.0,
+    "genre": 1.0,
+}
+
+# A prefix hit scores this fraction of an exact hit (scaled by how much of
+# the token the prefix covers)
+PREFIX_PENALTY = 0.5
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def normalize(text):
+    """Lowercase and strip accents so that 'Beyoncé' matches 'beyonce'."""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return stripped.casefold()
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def query_key(query):
+    """Canonical form of a query: results depend only on its set of terms."""
+    return " ".join(sorted(set(tokenize(query))))
+
+
+class SearchIndex:
+    def __init__(self, field_weights=None):
+        self.field_weights = dict(field_weights or FIELD_WEIGHTS)
+        self._lock = threading.RLock()
+        self._docs = {}        # track id -> track document
+        self._sort_keys = {}   # track id -> tie-break key
+        self._postings = {}    # token -> {track id: weight}
+        self._doc_tokens = {}  # track id -> tokens (for removal)
+        self._vocab = []       # sorted tokens for prefix lookups
+        self.generation = 0    # bumped on every change, for result caches
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, track_id):
+        return track_id in self._docs
+
+    def build(self, tracks):
+        """Replace the index contents with ``tracks``."""
+        with self._lock:
+            self._docs.clear()
+            self._sort_keys.clear()
+            self._postings.clear()
+            self._doc_tokens.clear()
+            self._vocab = []
+            for track in tracks:
+                self._add(track, rebuild=True)
+            self._vocab = sorted(self._postings)
+            self.generation += 1
+
+    def replace(self, other):
+        """Take over the contents of ``other``, an index built separately (e.g. off the event loop)."""
+        with self._lock, other._lock:
+            self._docs = other._docs
+            self._sort_keys = other._sort_keys
+            self._postings = other._postings
+            self._doc_tokens = other._doc_tokens
+            self._vocab = other._vocab
+            self.generation += 1
+
+    def add(self, track):
+        """Index a new track, or re-index one whose fields changed."""
+        with self._lock:
+            self._add(track)
+            self.generation += 1
+
+    def remove(self, track_id):
+        with self._lock:
+            self._remove(track_id)
+            self.generation += 1
+
+    def get(self, track_id):
+        return self._docs.get(track_id)
+
+    def _add(self, track, rebuild=False):
+        track_id = track.get("id")
+        if track_id is None:
+            return
+        if track_id in self._docs:
+            self._remove(track_id)
+
+        weights = {}
+        for field, weight in self.field_weights.items():
+            for token in tokenize(track.get(field)):
+                if weight > weights.get(token, 0):
+                    weights[token] = weight
+
+        for token, weight in weights.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                if not rebuild:
+                    bisect.insort(self._vocab, token)
+            posting[track_id] = weight
+
+        self._docs[track_id] = {k: v for k, v in track.items() if k != "_id"}
+        self._sort_keys[track_id] = (normalize(track.get("title", "")), str(track_id))
+        self._doc_tokens[track_id] = tuple(weights)
+
+    def _remove(self, track_id):
+        if self._docs.pop(track_id, None) is None:
+            return
+        self._sort_keys.pop(track_id, None)
+        for token in self._doc_tokens.pop(track_id, ()):
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(track_id, None)
+            if not posting:
+                del self._postings[token]
+                i = bisect.bisect_left(self._vocab, token)
+                if i < len(self._vocab) and self._vocab[i] == token:
+                    del self._vocab[i]
+
+    def _expand(self, term):
+        """Yield (token, score multiplier) for tokens matching ``term``."""
+        lo = bisect.bisect_left(self._vocab, term)
+        hi = bisect.bisect_left(self._vocab, term + "\U0010ffff", lo)
+        for token in self._vocab[lo:hi]:
+            if token == term:
+                yield token, 1.0
+            else:
+                yield token, PREFIX_PENALTY * len(term) / len(token)
+
+    def _score_term(self, term):
+        scores = {}
+        for token, multiplier in self._expand(term):
+            for track_id, weight in self._postings[token].items():
+                score = weight * multiplier
+                if score > scores.get(track_id, 0):
+                    scores[track_id] = score
+        return scores
+
+    def _match(self, query):
+        """Scores of the track ids matching every term of ``query``."""
+        per_term = []
+        for term in dict.fromkeys(tokenize(query)):
+            scores = self._score_term(term)
+            if not scores:
+                return {}
+            per_term.append(scores)
+        if not per_term:
+            return {}
+
+        per_term.sort(key=len)
+        totals = dict(per_term[0])
+        for scores in per_term[1:]:
+            totals = {
+                track_id: total + scores[track_id]
+                for track_id, total in totals.items()
+                if track_id in scores
+            }
+            if not totals:
+                return {}
+        return totals
+
+    def match_ids(self, query):
+        """Unranked ids of the tracks matching ``query``, for counting rather than display."""
+        with self._lock:
+            return list(self._match(query))
+
+    def search_ids(self, query, limit=None, offset=0):
+        """Return ranked track ids matching every term of ``query``."""
+        with self._lock:
+            totals = self._match(query)
+            if not totals:
+                return []
+
+            sort_keys = self._sort_keys
+
+            def rank(track_id):
+                return (-totals[track_id], sort_keys[track_id])
+
+            if limit is None:
+                ranked = sorted(totals, key=rank)
+                return ranked[offset:]
+            ranked = heapq.nsmallest(offset + limit, totals, key=rank)
+            return ranked[offset:offset + limit]
+
+    def search(self, query, limit=None, offset=0):
+        """Return ranked track documents matching ``query``."""
+        with self._lock:
+            ids = self.search_ids(query, limit=limit, offset=offset)
+            return [self._docs[track_id] for track_id in ids]
@@ -0,0 +1,65 @@
+"""Production launcher: several uvicorn worker processes on one socket.
+
+    python serve.py                        # WEB_CONCURRENCY workers on HOST:PORT
+    WEB_CONCURRENCY=4 PORT=8001 python serve.py
+
+The supervisor binds the listening socket and starts the workers; each
+worker imports server.py itself, so the Mongo client and every thread pool
+are created inside the worker (database.py also reconnects in a process
+forked after first use).  A worker starts accepting connections only once
+its startup has finished (indexes, search index, recommender and cache
+warm-up), and the supervisor restarts workers that die.
+
+Pools are per worker: a deployment opens up to WEB_CONCURRENCY x
+MONGO_MAX_POOL_SIZE connections and runs WEB_CONCURRENCY x
+DB_EXECUTOR_WORKERS database threads, so lower those per worker when
+adding workers (see database.py).  The ``memory://`` store lives inside
+one process and cannot be shared, so it is limited to a single worker.
+
+Behind an ingress or load balancer every connection comes from the proxy,
+so anonymous clients would share one rate-limit bucket (see rate_limit.py).
+Set FORWARDED_ALLOW_IPS to the proxy's address(es): uvicorn then takes the
+client address from X-Forwarded-For on connections from those peers only,
+so clients cannot spoof it by sending the header directly.
+
+Configuration (environment):
+
+    HOST                 interface to listen on (default: 0.0.0.0)
+    PORT                 port to listen on (default: 8001)
+    WEB_CONCURRENCY      worker processes (default: number of CPUs)
+    LISTEN_BACKLOG       pending connections queued by the kernel (default: 2048)
+    LOG_LEVEL            uvicorn log level (default: info)
+    FORWARDED_ALLOW_IPS  proxies trusted to set X-Forwarded-For, comma-separated or *
+                         (default: 127.0.0.1)
+"""
+import os
+import sys
+
+import uvicorn
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 8001))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+LISTEN_BACKLOG = int(os.environ.get('LISTEN_BACKLOG', 2048))
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'info')
+FORWARDED_ALLOW_IPS = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+def main(workers=WEB_CONCURRENCY, host=HOST, port=PORT):
+    if workers > 1 and os.environ.get('MONGO_URL', '').startswith('memory://'):
+        sys.exit("memory:// is per process; run a single worker or point MONGO_URL at a shared Mongo")
+    uvicorn.run(
+        "server:app",
+        host=host,
+        port=port,
+        workers=workers,
+        backlog=LISTEN_BACKLOG,
+        log_level=LOG_LEVEL,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+if __name__ == "__main__":
+    main()
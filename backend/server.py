@@ -1,15 +1,45 @@
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from typing import Optional, List
-import os
+import base64
 import jwt
-import bcrypt
 import uuid
 from datetime import datetime, timedelta
 import json
+import time
+import asyncio
+import logging
+import orjson
+
+import audio_store
+import database
+import metrics
+import profiling
+from auth_cache import AuthCache
+from catalog_columns import FACET_COLUMNS, SORT_COLUMNS, ColumnarCatalog
+from compression import CompressionMiddleware
+from database import DatabaseTimeout, get_collection
+from ingest import (
+    INGEST_BATCH_SIZE, TrackImporter, aiter_lines, iter_spool, read_batch, remove_spool, spool_stream, upsert_requests,
+)
+from jobs import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, JobQueue
+from passwords import HashingPoolSaturated, PasswordHasher
+from rate_limit import SEARCH_BURST, SEARCH_RATE, TokenBucketLimiter, retry_after
+from play_events import PlayCounter
+from playlist_sync import PLAYLIST_FEED_HEARTBEAT_SECONDS, PlaylistChanges
+from recommend import CooccurrenceModel
+from schema import audit_query_plans, ensure_indexes
+from search_cache import SearchCache
+from search_index import SearchIndex
+from track_cache import CatalogCache
+from waveform import UnsupportedAudio, WaveformBuilder, load_levels, pick_resolution
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -20,20 +50,125 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Next-Cursor", "X-Total-Count", "X-Playlists-Version", "X-Profile-Id", "X-Waveform-Buckets",
+        "X-Waveform-Duration",
+    ],
 )
+app.add_middleware(CompressionMiddleware)
+# Sampled requests get a stack profile (see profiling.py)
+app.add_middleware(profiling.ProfilingMiddleware)
+# Outermost, so it times everything including CORS handling and compression
+app.add_middleware(metrics.MetricsMiddleware)
 
-# MongoDB connection
-MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URL)
-db = client['music_app']
-users_collection = db['users']
-playlists_collection = db['playlists']
-tracks_collection = db['tracks']
+# MongoDB collections (awaitable, see database.py)
+users_collection = get_collection('users')
+playlists_collection = get_collection('playlists')
+tracks_collection = get_collection('tracks')
+meta_collection = get_collection('meta')
+track_plays_collection = get_collection('track_plays')
+genre_plays_collection = get_collection('genre_plays')
+playlist_tombstones_collection = get_collection('playlist_tombstones')
+jobs_collection = get_collection('jobs')
+catalog_changes_collection = get_collection('catalog_changes')
+import_spool_collection = get_collection('import_spool')
 
 # JWT configuration
 JWT_SECRET = "your-secret-key-change-in-production"
 JWT_ALGORITHM = "HS256"
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Verified tokens and user principals (see auth_cache.py)
+auth_cache = AuthCache()
+
+# Fields a client may select with ?fields= (id is always returned)
+TRACK_FIELDS = {"id", "title", "artist", "album", "duration", "genre", "image", "audio_url", "audio", "waveform"}
+
+# Pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_BATCH_SIZE = 500
+
+# bcrypt runs on its own bounded pool (see passwords.py)
+password_hasher = PasswordHasher()
+
+# In-memory catalog search index and columnar snapshot for browse filters, built on startup
+search_index = SearchIndex()
+catalog_columns = ColumnarCatalog()
+BROWSE_SORTS = "|".join(SORT_COLUMNS)
+catalog_rebuild_lock = asyncio.Lock()
+catalog_refresh_since = None  # oldest catalog version the indexes still have to catch up from
+catalog_reindex_queued = False  # a reindex_catalog job of this process has yet to start
+tracks_indexed_during_build = None  # tracks indexed while a rebuild runs, replayed after the swap
+
+# Coalesced, briefly cached searches and per-client keystroke admission (see search_cache.py)
+search_cache = SearchCache(search_index)
+search_limiter = TokenBucketLimiter(SEARCH_RATE, SEARCH_BURST)
+
+# Track and listing caches, invalidated by the catalog version (see track_cache.py)
+catalog_cache = CatalogCache(meta_collection, catalog_changes_collection)
+
+# Imports, waveforms, seeding and index rebuilds run as persistent background jobs (see jobs.py)
+job_queue = JobQueue(jobs_collection)
+
+# Waveforms are computed off the request path (see waveform.py)
+waveform_builder = WaveformBuilder()
+DEFAULT_WAVEFORM_BUCKETS = 1024
+WAVEFORM_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+# Related tracks and playlist radio from playlist co-occurrence (see recommend.py)
+recommender = CooccurrenceModel()
+recommender_task = None
+recommender_synced = False  # whether the model has caught up with the database since startup
+
+# Per-user playlist change sequence for delta sync and the change feed (see playlist_sync.py)
+playlist_changes = PlaylistChanges(meta_collection, playlist_tombstones_collection)
+
+# Play events are buffered and flushed as batched counter increments (see play_events.py)
+play_counter = PlayCounter(track_plays_collection, genre_plays_collection)
+MAX_CHART_DAYS = 90
+
+@metrics.REGISTRY.collector
+def collect_component_metrics():
+    caches = {
+        "tracks": catalog_cache.tracks,
+        "listings": catalog_cache.listings,
+        "tokens": auth_cache.tokens,
+        "principals": auth_cache.principals,
+        "search": search_cache.results,
+    }
+    coalesced = metrics.Counter("search_coalesced_total", "Searches that joined an identical in-flight search")
+    coalesced.inc(amount=search_cache.flight.shared)
+    snapshot = metrics.Gauge(
+        "catalog_snapshot_bytes", "Memory of the columnar catalog snapshot and of the same rows as dicts",
+        ("representation",),
+    )
+    footprint = catalog_columns.footprint()
+    snapshot.set("columnar", value=footprint["columnar_bytes"])
+    snapshot.set("dicts", value=footprint["dict_bytes"])
+    model = metrics.Gauge("recommend_model_size", "Size of the co-occurrence model", ("dimension",))
+    for dimension, value in recommender.stats().items():
+        model.set(dimension, value=value)
+    plays = metrics.Counter("play_events_total", "Play events by stage", ("stage",))
+    plays.inc("recorded", amount=play_counter.recorded)
+    plays.inc("flushed", amount=play_counter.flushed)
+    plays_pending = metrics.Gauge("play_events_pending", "Play events buffered but not yet written")
+    plays_pending.set(value=play_counter.pending)
+    jobs_active = metrics.Gauge("jobs_active", "Background jobs of this process by state", ("state",))
+    jobs_active.set("running", value=job_queue.running)
+    jobs_active.set("queued", value=job_queue.queued)
+    jobs_finished = metrics.Counter("jobs_finished_total", "Background jobs finished by this process", ("status",))
+    for job_status, count in job_queue.finished.items():
+        jobs_finished.inc(job_status, amount=count)
+    profiles = metrics.Counter("request_profiles_total", "Requests profiled by this process")
+    profiles.inc(amount=profiling.PROFILER.captured)
+    return (
+        metrics.cache_metrics(caches)
+        + metrics.hashing_metrics(password_hasher)
+        + metrics.limiter_metrics({"search": search_limiter})
+        + [coalesced, snapshot, model, plays, plays_pending, jobs_active, jobs_finished, profiles]
+    )
 
 # Sample music tracks data
 SAMPLE_TRACKS = [
@@ -90,10 +225,97 @@ SAMPLE_TRACKS = [
 ]
 
 # Initialize sample tracks in database
-def init_sample_tracks():
-    if tracks_collection.count_documents({}) == 0:
-        for track in SAMPLE_TRACKS:
-            tracks_collection.insert_one(track)
+async def init_sample_tracks():
+    # Seeded by a job so that startup does not wait on it
+    if await tracks_collection.count_documents({}) == 0:
+        await job_queue.submit("seed_sample_tracks", priority=PRIORITY_HIGH)
+
+@job_queue.handler("seed_sample_tracks")
+async def seed_sample_tracks(job):
+    if await tracks_collection.count_documents({}):
+        return {"seeded": 0}
+    # Upserts, so workers seeding at the same time write each track once
+    await tracks_collection.bulk_write(upsert_requests([dict(track) for track in SAMPLE_TRACKS]), ordered=False)
+    for track in SAMPLE_TRACKS:
+        index_track(track)
+    await catalog_cache.bump([track["id"] for track in SAMPLE_TRACKS])
+    return {"seeded": len(SAMPLE_TRACKS)}
+
+def index_track(track: dict):
+    search_index.add(track)
+    catalog_columns.upsert(track)
+    if tracks_indexed_during_build is not None:
+        tracks_indexed_during_build.append(track)
+
+def build_fresh_indexes(tracks: list) -> tuple:
+    fresh_index, fresh_columns = SearchIndex(), ColumnarCatalog()
+    fresh_index.build(tracks)
+    fresh_columns.build(tracks)
+    return fresh_index, fresh_columns
+
+async def build_catalog_indexes():
+    """Rebuild the search index and columnar snapshot in a thread and swap them in; return the track count."""
+    global tracks_indexed_during_build
+    tracks_indexed_during_build = []
+    try:
+        tracks = await tracks_collection.find({}, {"_id": 0})
+        fresh_index, fresh_columns = await asyncio.to_thread(build_fresh_indexes, tracks)
+        search_index.replace(fresh_index)
+        catalog_columns.replace(fresh_columns)
+        # Writes this worker indexed while the rebuild ran may be missing from its snapshot
+        for track in tracks_indexed_during_build:
+            search_index.add(track)
+            catalog_columns.upsert(track)
+    finally:
+        tracks_indexed_during_build = None
+    return len(tracks)
+
+@job_queue.handler("reindex_catalog")
+async def run_catalog_reindex(job):
+    global catalog_reindex_queued
+    async with catalog_rebuild_lock:
+        # A change from here on needs another rebuild
+        catalog_reindex_queued = False
+        tracks = await build_catalog_indexes()
+    await catch_up_catalog_indexes()
+    return {"tracks": tracks}
+
+async def schedule_catalog_reindex():
+    global catalog_reindex_queued
+    if not catalog_reindex_queued:
+        catalog_reindex_queued = True
+        await job_queue.submit("reindex_catalog", priority=PRIORITY_HIGH, local=True)
+
+async def reindex_tracks(track_ids: set):
+    found = set()
+    for track in await tracks_collection.find({"id": {"$in": list(track_ids)}}, {"_id": 0}):
+        index_track(track)
+        found.add(track["id"])
+    for track_id in track_ids - found:
+        search_index.remove(track_id)
+        catalog_columns.remove(track_id)
+
+@catalog_cache.on_change
+async def refresh_catalog_indexes(previous: int, version: int):
+    # Another worker changed the catalog; our incremental updates missed it.
+    global catalog_refresh_since
+    if catalog_refresh_since is None or previous < catalog_refresh_since:
+        catalog_refresh_since = previous
+    await catch_up_catalog_indexes()
+
+async def catch_up_catalog_indexes():
+    # One refresh at a time: changes arriving meanwhile are caught up by whoever holds the lock
+    global catalog_refresh_since
+    if catalog_rebuild_lock.locked():
+        return
+    async with catalog_rebuild_lock:
+        while catalog_refresh_since is not None:
+            since, catalog_refresh_since = catalog_refresh_since, None
+            changed = await catalog_cache.changed_tracks(since, catalog_cache.version)
+            if changed is None:
+                await schedule_catalog_reindex()
+            else:
+                await reindex_tracks(changed)
 
 # Pydantic models
 class User(BaseModel):
@@ -123,13 +345,68 @@ class PlaylistUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     track_ids: Optional[List[str]] = None
+    version: Optional[int] = None  # expected current version, if given
+
+class PlaylistTracksAdd(BaseModel):
+    track_ids: List[str]
+    position: Optional[int] = Field(None, ge=0)  # append when omitted
+    version: Optional[int] = None
+
+class PlaylistTrackMove(BaseModel):
+    from_position: int = Field(..., ge=0)
+    to_position: int = Field(..., ge=0)
+    version: Optional[int] = None
 
 # Helper functions
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def encode_cursor(position: dict) -> str:
+    raw = json.dumps(position, separators=(",", ":")).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(position, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+def parse_fields(fields: Optional[str]) -> Optional[tuple]:
+    if not fields:
+        return None
+    selected = set(filter(None, (field.strip() for field in fields.split(","))))
+    unknown = selected - TRACK_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(sorted(selected | {"id"}))
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+def track_projection(fields: Optional[tuple]) -> dict:
+    projection = {"_id": 0}
+    if fields:
+        projection.update({field: 1 for field in fields})
+    return projection
+
+def select_fields(track: dict, fields: Optional[tuple]) -> dict:
+    if not fields:
+        return track
+    return {field: track[field] for field in fields if field in track}
+
+def browse_filters(genre: Optional[str], min_duration: Optional[float], max_duration: Optional[float],
+                   artist_prefix: Optional[str]) -> dict:
+    """Browse query parameters as ColumnarCatalog filters; ``genre`` is comma-separated."""
+    return {
+        "genres": [value.strip() for value in genre.split(",") if value.strip()] if genre else None,
+        "min_duration": min_duration,
+        "max_duration": max_duration,
+        "artist_prefix": artist_prefix,
+    }
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -138,27 +415,167 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return verify_token(credentials.credentials)
+
+async def get_feed_user(
+    token: Optional[str] = None, credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    # EventSource cannot send headers, so a feed may pass its token as ?token=
+    if credentials is not None:
+        return verify_token(credentials.credentials)
+    if token:
+        return verify_token(token)
+    raise HTTPException(status_code=401, detail="Not authenticated")
+
+def verify_token(token: str) -> str:
+    username = auth_cache.get_token(token)
+    if username is not None:
+        return username
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Could not validate credentials")
-        return username
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
+    if payload.get("exp") is not None:
+        auth_cache.put_token(token, username, payload["exp"])
+    return username
+
+async def client_identity(request: Request, credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Rate-limit key: the user when a valid token is sent, else the remote address (see serve.py for proxies)."""
+    if credentials is not None:
+        try:
+            return "user:" + await get_current_user(credentials)
+        except HTTPException:
+            pass
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+async def hydrate_tracks(track_ids):
+    """Fetch tracks for ``track_ids`` in one query, preserving order and duplicates."""
+    if not track_ids:
+        return []
+    version = await catalog_cache.current_version()
+    by_id = {}
+    missing = []
+    for track_id in set(track_ids):
+        track = catalog_cache.get_track(track_id)
+        if track is None:
+            missing.append(track_id)
+        else:
+            by_id[track_id] = track
+    if missing:
+        for track in await tracks_collection.find({"id": {"$in": missing}}, {"_id": 0}):
+            catalog_cache.put_track(track, version)
+            by_id[track["id"]] = track
+    return [by_id[track_id] for track_id in track_ids if track_id in by_id]
+
+def render_listing(tracks: list, limit: int) -> tuple:
+    """``(JSON body, next cursor)`` for a listing page fetched with ``limit + 1``."""
+    next_cursor = None
+    if len(tracks) > limit:
+        tracks = tracks[:limit]
+        next_cursor = encode_cursor({"after": tracks[-1]["id"]})
+    return orjson.dumps(tracks, default=str), next_cursor
+
+async def warm_caches():
+    """Prime the first catalog page and its tracks before this worker takes traffic."""
+    version = await catalog_cache.current_version()
+    tracks = await tracks_collection.find({}, {"_id": 0}, sort=[("id", 1)], limit=DEFAULT_PAGE_SIZE + 1)
+    catalog_cache.put_listing((None, DEFAULT_PAGE_SIZE, None), render_listing(tracks, DEFAULT_PAGE_SIZE), version)
+    for track in tracks[:DEFAULT_PAGE_SIZE]:
+        catalog_cache.put_track(track, version)
+
+async def find_track(track_id: str) -> dict:
+    version = await catalog_cache.current_version()
+    track = catalog_cache.get_track(track_id)
+    if track is None:
+        track = await tracks_collection.find_one({"id": track_id}, {"_id": 0})
+        if not track:
+            raise HTTPException(status_code=404, detail="Track not found")
+        catalog_cache.put_track(track, version)
+    return track
+
+async def generate_waveform(track_id: str, audio: dict):
+    try:
+        meta = await waveform_builder.build(audio_store.audio_path(audio["file"]), audio["content_type"])
+        waveform = dict(meta, status="ready", url=f"/api/tracks/{track_id}/waveform?v={meta['hash']}")
+    except UnsupportedAudio as exc:
+        waveform = {"status": "unavailable", "reason": str(exc)}
+    except Exception:
+        logger.exception("Waveform for track %s failed", track_id)
+        waveform = {"status": "failed"}
+    # Only if the track still has the audio this waveform was computed from
+    track = await tracks_collection.find_one_and_update(
+        {"id": track_id, "audio.file": audio["file"]}, {"$set": {"waveform": waveform}},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+    )
+    if track is not None:
+        index_track(track)
+        await catalog_cache.bump([track_id])
+
+@job_queue.handler("waveform")
+async def run_waveform_job(job):
+    await generate_waveform(job.params["track_id"], job.params["audio"])
+
+async def schedule_waveform(track_id: str, audio: dict, owner: Optional[str] = None):
+    return await job_queue.submit("waveform", {"track_id": track_id, "audio": audio}, owner, PRIORITY_LOW)
+
+def job_accepted(job: dict):
+    job = {key: value for key, value in job.items() if key != "checkpoint"}
+    return ORJSONResponse(job, status_code=202, headers={"Location": f"/api/jobs/{job['id']}"})
+
+def version_filter(version: int):
+    # Playlists created before versioning have no version field
+    return version if version else {"$in": [0, None]}
+
+async def mutate_playlist(playlist_id: str, username: str, expected_version: Optional[int], update: dict) -> int:
+    """Apply ``update`` atomically, bumping the playlist version and change sequence; return the new version."""
+    query = {"id": playlist_id, "username": username}
+    if expected_version is not None:
+        query["version"] = version_filter(expected_version)
+    async with playlist_changes.change(username) as seq:
+        changes = dict(update.get("$set", {}), seq=seq, updated_at=datetime.utcnow())
+        update = dict(update, **{"$inc": {"version": 1}, "$set": changes})
+        result = await playlists_collection.find_one_and_update(
+            query, update, projection={"_id": 0, "version": 1, "track_ids": 1}, return_document=ReturnDocument.AFTER
+        )
+    if result is None:
+        if expected_version is not None and await playlists_collection.find_one(
+            {"id": playlist_id, "username": username}, {"_id": 1}
+        ):
+            raise HTTPException(status_code=409, detail="Playlist was modified concurrently")
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    # Pair updates are quadratic in playlist size; the model has its own lock
+    await asyncio.to_thread(recommender.set_playlist, playlist_id, result.get("track_ids", []), result["version"])
+    return result["version"]
+
+async def rewrite_track_ids(playlist_id: str, username: str, expected_version: Optional[int], edit) -> int:
+    """Read-modify-write of ``track_ids`` for edits $push/$pull can't express."""
+    playlist = await playlists_collection.find_one(
+        {"id": playlist_id, "username": username}, {"_id": 0, "track_ids": 1, "version": 1}
+    )
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    version = playlist.get("version", 0)
+    if expected_version is not None and expected_version != version:
+        raise HTTPException(status_code=409, detail="Playlist was modified concurrently")
+    track_ids = edit(list(playlist.get("track_ids", [])))
+    # Guarded by the version we read, so a concurrent edit turns into a 409
+    return await mutate_playlist(playlist_id, username, version, {"$set": {"track_ids": track_ids}})
 
 # Authentication endpoints
 @app.post("/api/auth/register")
 async def register(user: User):
     # Check if user already exists
-    if users_collection.find_one({"username": user.username}):
+    if await users_collection.find_one({"username": user.username}):
         raise HTTPException(status_code=400, detail="Username already registered")
-    if users_collection.find_one({"email": user.email}):
+    if await users_collection.find_one({"email": user.email}):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = hash_password(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     user_data = {
         "id": str(uuid.uuid4()),
         "username": user.username,
@@ -166,7 +583,14 @@ async def register(user: User):
         "password": hashed_password,
         "created_at": datetime.utcnow()
     }
-    users_collection.insert_one(user_data)
+    try:
+        await users_collection.insert_one(user_data)
+    except DuplicateKeyError as exc:
+        # Lost a race with a concurrent registration; the unique indexes decide
+        key_pattern = (exc.details or {}).get("keyPattern", {})
+        field = "Email" if "email" in key_pattern else "Username"
+        raise HTTPException(status_code=400, detail=f"{field} already registered")
+    auth_cache.invalidate_user(user.username)
     
     # Create access token
     access_token = create_access_token(data={"sub": user.username})
@@ -176,8 +600,8 @@ async def register(user: User):
 @app.post("/api/auth/login")
 async def login(user: UserLogin):
     # Find user
-    db_user = users_collection.find_one({"username": user.username})
-    if not db_user or not verify_password(user.password, db_user["password"]):
+    db_user = await users_collection.find_one({"username": user.username})
+    if not db_user or not await password_hasher.verify(user.password, db_user["password"]):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     
     # Create access token
@@ -187,41 +611,482 @@ async def login(user: UserLogin):
 
 @app.get("/api/auth/me")
 async def get_current_user_info(current_user: str = Depends(get_current_user)):
-    user = users_collection.find_one({"username": current_user})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return {"username": user["username"], "email": user["email"]}
+    principal = auth_cache.get_principal(current_user)
+    if principal is None:
+        user = await users_collection.find_one({"username": current_user}, {"_id": 0, "username": 1, "email": 1})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        principal = {"username": user["username"], "email": user["email"]}
+        auth_cache.put_principal(current_user, principal)
+    return principal
 
 # Music endpoints
 @app.get("/api/tracks")
-async def get_all_tracks():
-    tracks = list(tracks_collection.find({}, {"_id": 0}))
-    return tracks
+async def get_all_tracks(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", regex="^(json|ndjson)$"),
+    fields: Optional[str] = None,
+    genre: Optional[str] = None,
+    min_duration: Optional[float] = Query(None, ge=0),
+    max_duration: Optional[float] = Query(None, ge=0),
+    artist_prefix: Optional[str] = None,
+    sort: Optional[str] = Query(None, regex=f"^-?({BROWSE_SORTS})$"),
+):
+    fields = parse_fields(fields)
+    browse = browse_filters(genre, min_duration, max_duration, artist_prefix)
+    if sort or any(value is not None for value in browse.values()):
+        return await browse_tracks(request, limit or DEFAULT_PAGE_SIZE, cursor, format, fields, browse, sort or "title")
+
+    projection = track_projection(fields)
+    # Keyset pagination on the unique track id; the cursor carries the last id seen
+    query = {}
+    if cursor:
+        after = decode_cursor(cursor).get("after")
+        if not isinstance(after, str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["id"] = {"$gt": after}
+    sort = [("id", 1)]
+
+    version = await catalog_cache.current_version()
+    headers = {"ETag": catalog_cache.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, catalog_cache.etag):
+        return Response(status_code=304, headers=headers)
+
+    if format == "ndjson":
+        async def stream():
+            async for batch in tracks_collection.iter_batches(
+                query, projection, sort=sort, limit=limit or 0, batch_size=NDJSON_BATCH_SIZE
+            ):
+                yield b"".join(orjson.dumps(track, default=str) + b"\n" for track in batch)
+        return StreamingResponse(stream(), media_type="application/x-ndjson", headers=headers)
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    listing_key = (cursor, limit, fields)
+    listing = catalog_cache.get_listing(listing_key)
+    if listing is None:
+        tracks = await tracks_collection.find(query, projection, sort=sort, limit=limit + 1)
+        listing = render_listing(tracks, limit)
+        catalog_cache.put_listing(listing_key, listing, version)
+
+    body, next_cursor = listing
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def browse_tracks(
+    request: Request, limit: int, cursor: Optional[str], format: str, fields: Optional[tuple], browse: dict, sort: str
+):
+    """Filtered and sorted listing, evaluated on the columnar snapshot (see catalog_columns.py)."""
+    if format != "json":
+        raise HTTPException(status_code=400, detail="Filters and sort need format=json")
+    # Like search, the order is computed rather than keyed, so the cursor carries an offset
+    offset = 0
+    if cursor:
+        offset = decode_cursor(cursor).get("offset")
+        if not isinstance(offset, int) or offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    await catalog_cache.current_version()
+    headers = {"ETag": catalog_cache.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, catalog_cache.etag):
+        return Response(status_code=304, headers=headers)
+
+    total, track_ids = catalog_columns.query(sort=sort, limit=limit, offset=offset, **browse)
+    tracks = await hydrate_tracks(track_ids)
+    headers["X-Total-Count"] = str(total)
+    if offset + limit < total:
+        headers["X-Next-Cursor"] = encode_cursor({"offset": offset + limit})
+    return ORJSONResponse([select_fields(track, fields) for track in tracks], headers=headers)
+
+async def write_track_batch(batch: list):
+    await tracks_collection.bulk_write(upsert_requests(batch), ordered=False)
+    for track in batch:
+        index_track(track)
+
+@app.post("/api/tracks/import")
+async def import_tracks(
+    request: Request,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    batch_size: int = Query(INGEST_BATCH_SIZE, ge=1, le=10000),
+    background: bool = True,
+    current_user: str = Depends(get_current_user),
+):
+    if background:
+        # Spooled into the database and imported by a job; progress at /api/jobs/{id}
+        upload, size = await spool_stream(request.stream(), import_spool_collection)
+        try:
+            job = await job_queue.submit(
+                "import_tracks", {"upload": upload, "size": size, "format": format, "batch_size": batch_size},
+                current_user, PRIORITY_NORMAL,
+            )
+        except BaseException:
+            await remove_spool(import_spool_collection, upload)
+            raise
+        return job_accepted(job)
+
+    # The body is parsed line by line as it arrives; only one batch is held at a time
+    importer = TrackImporter(Track, format, batch_size)
+    async for line in aiter_lines(request.stream()):
+        batch = importer.feed(line)
+        if batch:
+            await write_track_batch(batch)
+    batch = importer.finish()
+    if batch:
+        await write_track_batch(batch)
+    if importer.accepted:
+        await catalog_cache.bump()
+    return importer.report()
+
+@job_queue.handler("import_tracks")
+async def run_track_import(job):
+    params = job.params
+    importer = TrackImporter(Track, params["format"], params["batch_size"])
+    position = 0
+    if job.checkpoint:
+        importer.resume(job.checkpoint["importer"])
+        position = job.checkpoint["offset"]
+    pending = b""
+    written = False
+
+    async def import_pending(final):
+        nonlocal pending, position, written
+        while True:
+            batch, used = await job.run_in_thread(read_batch, importer, pending, final)
+            pending, position = pending[used:], position + used
+            if batch:
+                await write_track_batch(batch)
+                written = True
+            # Between batches, so the checkpoint never splits one
+            if batch or final:
+                await job.progress(position, params["size"], {"offset": position, "importer": importer.state()})
+            if not batch:
+                return
+
+    try:
+        async for data in iter_spool(import_spool_collection, params["upload"], position):
+            pending += data
+            await import_pending(final=False)
+        await import_pending(final=True)
+    except asyncio.CancelledError:
+        raise  # shutting down: the next start resumes from the checkpoint
+    except Exception:
+        await remove_spool(import_spool_collection, params["upload"])
+        raise
+    finally:
+        if written:
+            await catalog_cache.bump()
+    await remove_spool(import_spool_collection, params["upload"])
+    return importer.report()
+
+@app.get("/api/tracks/facets")
+async def get_track_facets(
+    request: Request,
+    facets: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    q: Optional[str] = None,
+    genre: Optional[str] = None,
+    min_duration: Optional[float] = Query(None, ge=0),
+    max_duration: Optional[float] = Query(None, ge=0),
+    artist_prefix: Optional[str] = None,
+):
+    """Track counts per genre/artist/album, over the catalog or a search and/or filter result."""
+    columns = tuple(filter(None, (facet.strip() for facet in (facets or "").split(",")))) or FACET_COLUMNS
+    unknown = set(columns) - set(FACET_COLUMNS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown facets: {', '.join(sorted(unknown))}")
+
+    await catalog_cache.current_version()
+    headers = {"ETag": catalog_cache.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, catalog_cache.etag):
+        return Response(status_code=304, headers=headers)
+
+    track_ids = await asyncio.to_thread(search_index.match_ids, q) if q else None
+    total, counts = catalog_columns.facets(
+        columns, limit, track_ids, **browse_filters(genre, min_duration, max_duration, artist_prefix)
+    )
+    return ORJSONResponse({
+        "total": total,
+        "facets": {
+            column: [{"value": value, "count": count} for value, count in values] for column, values in counts.items()
+        },
+    }, headers=headers)
 
 @app.get("/api/tracks/{track_id}")
-async def get_track(track_id: str):
-    track = tracks_collection.find_one({"id": track_id}, {"_id": 0})
-    if not track:
-        raise HTTPException(status_code=404, detail="Track not found")
+async def get_track(track_id: str, request: Request, response: Response):
+    await catalog_cache.current_version()
+    headers = {"ETag": catalog_cache.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, catalog_cache.etag):
+        return Response(status_code=304, headers=headers)
+
+    track = await find_track(track_id)
+    response.headers.update(headers)
     return track
 
+@app.put("/api/tracks/{track_id}/audio")
+async def upload_track_audio(track_id: str, request: Request, current_user: str = Depends(get_current_user)):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if not content_type.startswith("audio/"):
+        raise HTTPException(status_code=415, detail="Expected an audio/* request body")
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > audio_store.AUDIO_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Audio file too large")
+    if not await tracks_collection.find_one({"id": track_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Track not found")
+
+    # The body goes straight to disk as it arrives (see audio_store.py)
+    try:
+        name, size = await audio_store.write_stream(request.stream())
+    except audio_store.UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Audio file too large")
+    if size == 0:
+        audio_store.remove(name)
+        raise HTTPException(status_code=400, detail="Empty audio file")
+
+    audio = {"file": name, "size": size, "content_type": content_type}
+    update = {"audio": audio, "audio_url": f"/api/tracks/{track_id}/audio", "waveform": {"status": "pending"}}
+    duration = await asyncio.to_thread(audio_store.probe_duration, audio_store.audio_path(name), content_type)
+    if duration:
+        audio["duration"] = round(duration, 3)
+        update["duration"] = int(round(duration))
+    previous = await tracks_collection.find_one_and_update(
+        {"id": track_id}, {"$set": update}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        audio_store.remove(name)
+        raise HTTPException(status_code=404, detail="Track not found")
+    replaced = (previous.get("audio") or {}).get("file")
+    if replaced:
+        audio_store.remove(replaced)
+    index_track(dict(previous, **update))
+    await catalog_cache.bump([track_id])
+    job = await schedule_waveform(track_id, audio, current_user)
+    return {"message": "Audio uploaded", "audio_url": update["audio_url"], "audio": audio, "waveform_job": job["id"]}
+
+@app.api_route("/api/tracks/{track_id}/audio", methods=["GET", "HEAD"])
+async def get_track_audio(track_id: str, request: Request):
+    track = await find_track(track_id)
+    audio = track.get("audio")
+    if not audio:
+        raise HTTPException(status_code=404, detail="Track has no uploaded audio")
+    path = audio_store.audio_path(audio["file"])
+    try:
+        etag = audio_store.file_etag(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio file missing")
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range == etag:
+        try:
+            byte_range = audio_store.parse_range(request.headers.get("range"), audio["size"])
+        except audio_store.RangeNotSatisfiable:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{audio['size']}"})
+    return audio_store.AudioResponse(path, audio["content_type"], byte_range, headers)
+
+@app.get("/api/tracks/{track_id}/waveform")
+async def get_track_waveform(
+    track_id: str,
+    request: Request,
+    buckets: int = Query(DEFAULT_WAVEFORM_BUCKETS, ge=1, le=65536),
+    format: str = Query("binary", regex="^(binary|base64)$"),
+    v: Optional[str] = None,
+):
+    track = await find_track(track_id)
+    waveform = track.get("waveform")
+    if not waveform:
+        raise HTTPException(status_code=404, detail="Track has no uploaded audio")
+    if waveform["status"] == "pending":
+        return JSONResponse(status_code=202, content={"status": "pending"}, headers={"Retry-After": "2"})
+    if waveform["status"] != "ready":
+        raise HTTPException(status_code=404, detail=waveform.get("reason", "Waveform unavailable"))
+
+    buckets = pick_resolution(waveform["resolutions"], buckets)
+    etag = f'"{waveform["hash"]}-{buckets}"'
+    headers = {
+        "ETag": etag,
+        # Stored waveforms never change, so a URL naming the content hash can be cached forever
+        "Cache-Control": WAVEFORM_IMMUTABLE_CACHE if v == waveform["hash"] else "no-cache",
+        "X-Waveform-Buckets": str(buckets),
+        "X-Waveform-Duration": str(waveform["duration"]),
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    levels = await asyncio.to_thread(load_levels, waveform["hash"], buckets)
+    if levels is None:
+        raise HTTPException(status_code=404, detail="Waveform missing")
+    peaks, rms = levels
+    if format == "base64":
+        content = {
+            "buckets": buckets,
+            "duration": waveform["duration"],
+            "peaks": base64.b64encode(peaks).decode('ascii'),
+            "rms": base64.b64encode(rms).decode('ascii'),
+        }
+        return JSONResponse(content=content, headers=headers)
+    # buckets x uint8 peak followed by buckets x uint8 RMS
+    return Response(content=peaks + rms, media_type="application/octet-stream", headers=headers)
+
 @app.get("/api/tracks/search/{query}")
-async def search_tracks(query: str):
-    tracks = list(tracks_collection.find({
-        "$or": [
-            {"title": {"$regex": query, "$options": "i"}},
-            {"artist": {"$regex": query, "$options": "i"}},
-            {"album": {"$regex": query, "$options": "i"}},
-            {"genre": {"$regex": query, "$options": "i"}}
-        ]
-    }, {"_id": 0}))
-    return tracks
+async def search_tracks(
+    query: str,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    client: str = Depends(client_identity),
+):
+    # Shed keystrokes beyond the client's budget instead of queueing them
+    wait = search_limiter.acquire(client)
+    if wait:
+        return JSONResponse(
+            status_code=429, content={"detail": "Too many searches, slow down"}, headers={"Retry-After": retry_after(wait)}
+        )
+    fields = parse_fields(fields)
+    # Results are ranked rather than keyed, so the search cursor carries an offset
+    if cursor:
+        offset = decode_cursor(cursor).get("offset")
+        if not isinstance(offset, int) or offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    tracks = await search_cache.search(query, limit + 1, offset)
+    headers = {}
+    if len(tracks) > limit:
+        tracks = tracks[:limit]
+        headers["X-Next-Cursor"] = encode_cursor({"offset": offset + limit})
+    # Served from the in-memory index, so the field selection happens here
+    return ORJSONResponse([select_fields(track, fields) for track in tracks], headers=headers)
+
+async def scored_tracks(scored, fields: Optional[tuple]) -> list:
+    by_id = {track["id"]: track for track in await hydrate_tracks([track_id for track_id, _ in scored])}
+    return [
+        dict(select_fields(by_id[track_id], fields), score=round(score, 4))
+        for track_id, score in scored
+        if track_id in by_id
+    ]
+
+@job_queue.handler("sync_recommendations")
+async def run_recommendation_sync(job):
+    global recommender_synced
+    # Start from the last snapshot and re-read only playlists changed since
+    if job.params.get("load"):
+        await job.run_in_thread(recommender.load)
+    synced = await recommender.sync(playlists_collection)
+    recommender_synced = True
+    if synced:
+        await job.run_in_thread(recommender.save)
+    return {"playlists": synced}
+
+@app.get("/api/tracks/{track_id}/related")
+async def get_related_tracks(
+    track_id: str, limit: int = Query(20, ge=1, le=100), fields: Optional[str] = None
+):
+    fields = parse_fields(fields)
+    await find_track(track_id)
+    return ORJSONResponse(await scored_tracks(recommender.related(track_id, limit), fields))
+
+@app.post("/api/tracks/{track_id}/plays", status_code=202)
+async def record_play(track_id: str, current_user: str = Depends(get_current_user)):
+    track = await find_track(track_id)
+    play_counter.record(track_id, track.get("genre"))
+    return {"message": "Play recorded"}
+
+@app.get("/api/charts/tracks")
+async def get_track_chart(
+    days: int = Query(7, ge=1, le=MAX_CHART_DAYS),
+    limit: int = Query(50, ge=1, le=100),
+    fields: Optional[str] = None,
+):
+    fields = parse_fields(fields)
+    chart = await play_counter.top("tracks", days, limit)
+    by_id = {track["id"]: track for track in await hydrate_tracks([track_id for track_id, _ in chart])}
+    return ORJSONResponse([
+        dict(select_fields(by_id[track_id], fields), plays=plays) for track_id, plays in chart if track_id in by_id
+    ])
+
+@app.get("/api/charts/genres")
+async def get_genre_chart(days: int = Query(7, ge=1, le=MAX_CHART_DAYS), limit: int = Query(20, ge=1, le=100)):
+    return [{"genre": genre, "plays": plays} for genre, plays in await play_counter.top("genres", days, limit)]
+
+async def playlist_delta(username: str, since: int, include_tracks: bool = False, fields: Optional[tuple] = None):
+    """Playlists changed and ids deleted after change version ``since``, and the version to ask from next;
+    ``reset`` instead if ``since`` is too old for the tombstones kept, and the client must reload the list."""
+    # Read first: every write numbered up to it has landed, so the queries below see it
+    version = await playlist_changes.stable_version(username)
+    if await playlist_changes.expired(username, since):
+        return {"version": version, "reset": True, "playlists": [], "deleted": []}
+    playlists = await playlists_collection.find({"username": username, "seq": {"$gt": since}}, {"_id": 0})
+    if include_tracks:
+        await include_playlist_tracks(playlists, fields)
+    deleted = await playlist_changes.deleted_since(username, since)
+    return {"version": version, "playlists": playlists, "deleted": deleted}
+
+async def include_playlist_tracks(playlists: list, fields: Optional[tuple]):
+    # Hydrate every playlist from a single query over the union of their ids
+    all_ids = [track_id for playlist in playlists for track_id in playlist.get("track_ids", [])]
+    tracks = await hydrate_tracks(list(dict.fromkeys(all_ids)))
+    by_id = {track["id"]: select_fields(track, fields) for track in tracks}
+    for playlist in playlists:
+        playlist["tracks"] = [by_id[track_id] for track_id in playlist.get("track_ids", []) if track_id in by_id]
 
 # Playlist endpoints
 @app.get("/api/playlists")
-async def get_user_playlists(current_user: str = Depends(get_current_user)):
-    playlists = list(playlists_collection.find({"username": current_user}, {"_id": 0}))
-    return playlists
+async def get_user_playlists(
+    include: Optional[str] = None,
+    fields: Optional[str] = None,
+    since: Optional[int] = Query(None, ge=0),
+    current_user: str = Depends(get_current_user),
+):
+    fields = parse_fields(fields)  # applies to the included tracks
+    includes = set(filter(None, (include or "").split(",")))
+    if includes - {"tracks"}:
+        raise HTTPException(status_code=400, detail="Unsupported include")
+
+    if since is not None:
+        # Only what changed since the client's version, deletions as tombstones
+        return ORJSONResponse(await playlist_delta(current_user, since, "tracks" in includes, fields))
+
+    version = await playlist_changes.stable_version(current_user)
+    playlists = await playlists_collection.find({"username": current_user}, {"_id": 0})
+    if "tracks" in includes:
+        await include_playlist_tracks(playlists, fields)
+    return ORJSONResponse(playlists, headers={"X-Playlists-Version": str(version)})
+
+@app.get("/api/playlists/events")
+async def playlist_events(
+    request: Request, since: Optional[int] = Query(None, ge=0), current_user: str = Depends(get_feed_user)
+):
+    """Server-sent events: one ``playlists`` event carrying a delta per batch of changes."""
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    if since is None:
+        since = await playlist_changes.stable_version(current_user)
+
+    async def stream():
+        version = since
+        idle_since = time.monotonic()
+        yield f"retry: 3000\nid: {version}\n\n".encode('ascii')
+        # A reconnect from a version too old to sync gets its reset at once
+        stale = await playlist_changes.expired(current_user, version)
+        while True:
+            if stale or await playlist_changes.stable_version(current_user) > version:
+                stale = False
+                delta = await playlist_delta(current_user, version)
+                version = delta["version"]
+                yield b"id: %d\nevent: playlists\ndata: %s\n\n" % (version, orjson.dumps(delta, default=str))
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= PLAYLIST_FEED_HEARTBEAT_SECONDS:
+                yield b": keep-alive\n\n"
+                idle_since = time.monotonic()
+            await playlist_changes.wait(current_user)
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/playlists")
 async def create_playlist(playlist: Playlist, current_user: str = Depends(get_current_user)):
@@ -231,33 +1096,44 @@ async def create_playlist(playlist: Playlist, current_user: str = Depends(get_cu
         "description": playlist.description,
         "track_ids": playlist.track_ids,
         "username": current_user,
+        "version": 1,
         "created_at": datetime.utcnow()
     }
-    playlists_collection.insert_one(playlist_data)
+    async with playlist_changes.change(current_user) as seq:
+        playlist_data.update(seq=seq, updated_at=playlist_data["created_at"])
+        await playlists_collection.insert_one(playlist_data)
+    await asyncio.to_thread(
+        recommender.set_playlist, playlist_data["id"], playlist_data["track_ids"], playlist_data["version"]
+    )
     return {"message": "Playlist created successfully", "playlist_id": playlist_data["id"]}
 
 @app.get("/api/playlists/{playlist_id}")
 async def get_playlist(playlist_id: str, current_user: str = Depends(get_current_user)):
-    playlist = playlists_collection.find_one({"id": playlist_id, "username": current_user}, {"_id": 0})
+    playlist = await playlists_collection.find_one({"id": playlist_id, "username": current_user}, {"_id": 0})
     if not playlist:
         raise HTTPException(status_code=404, detail="Playlist not found")
     
     # Get track details
-    tracks = []
-    for track_id in playlist["track_ids"]:
-        track = tracks_collection.find_one({"id": track_id}, {"_id": 0})
-        if track:
-            tracks.append(track)
-    
-    playlist["tracks"] = tracks
+    playlist["tracks"] = await hydrate_tracks(playlist["track_ids"])
     return playlist
 
+@app.get("/api/playlists/{playlist_id}/radio")
+async def get_playlist_radio(
+    playlist_id: str,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: str = Depends(get_current_user),
+):
+    fields = parse_fields(fields)
+    playlist = await playlists_collection.find_one(
+        {"id": playlist_id, "username": current_user}, {"_id": 0, "track_ids": 1}
+    )
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return ORJSONResponse(await scored_tracks(recommender.radio(playlist.get("track_ids", []), limit), fields))
+
 @app.put("/api/playlists/{playlist_id}")
 async def update_playlist(playlist_id: str, playlist: PlaylistUpdate, current_user: str = Depends(get_current_user)):
-    existing_playlist = playlists_collection.find_one({"id": playlist_id, "username": current_user})
-    if not existing_playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
-    
     update_data = {}
     if playlist.name is not None:
         update_data["name"] = playlist.name
@@ -267,27 +1143,175 @@ async def update_playlist(playlist_id: str, playlist: PlaylistUpdate, current_us
         update_data["track_ids"] = playlist.track_ids
     
     if update_data:
-        playlists_collection.update_one({"id": playlist_id}, {"$set": update_data})
+        version = await mutate_playlist(playlist_id, current_user, playlist.version, {"$set": update_data})
+    else:
+        existing_playlist = await playlists_collection.find_one(
+            {"id": playlist_id, "username": current_user}, {"_id": 0, "version": 1}
+        )
+        if not existing_playlist:
+            raise HTTPException(status_code=404, detail="Playlist not found")
+        version = existing_playlist.get("version", 0)
     
-    return {"message": "Playlist updated successfully"}
+    return {"message": "Playlist updated successfully", "version": version}
+
+@app.post("/api/playlists/{playlist_id}/tracks")
+async def add_playlist_tracks(playlist_id: str, body: PlaylistTracksAdd, current_user: str = Depends(get_current_user)):
+    push = {"$each": body.track_ids}
+    if body.position is not None:
+        push["$position"] = body.position
+    version = await mutate_playlist(playlist_id, current_user, body.version, {"$push": {"track_ids": push}})
+    return {"message": "Tracks added to playlist", "version": version}
+
+@app.delete("/api/playlists/{playlist_id}/tracks/{track_id}")
+async def remove_playlist_track(
+    playlist_id: str,
+    track_id: str,
+    position: Optional[int] = Query(None, ge=0),
+    version: Optional[int] = None,
+    current_user: str = Depends(get_current_user),
+):
+    if position is None:
+        # Removes every occurrence of the track
+        new_version = await mutate_playlist(playlist_id, current_user, version, {"$pull": {"track_ids": track_id}})
+    else:
+        def remove_at(track_ids):
+            if position >= len(track_ids) or track_ids[position] != track_id:
+                raise HTTPException(status_code=409, detail="Track is not at that position")
+            del track_ids[position]
+            return track_ids
+        new_version = await rewrite_track_ids(playlist_id, current_user, version, remove_at)
+    return {"message": "Track removed from playlist", "version": new_version}
+
+@app.post("/api/playlists/{playlist_id}/tracks/move")
+async def move_playlist_track(playlist_id: str, body: PlaylistTrackMove, current_user: str = Depends(get_current_user)):
+    def move(track_ids):
+        if body.from_position >= len(track_ids) or body.to_position >= len(track_ids):
+            raise HTTPException(status_code=400, detail="Position out of range")
+        track_ids.insert(body.to_position, track_ids.pop(body.from_position))
+        return track_ids
+    version = await rewrite_track_ids(playlist_id, current_user, body.version, move)
+    return {"message": "Track moved", "version": version}
 
 @app.delete("/api/playlists/{playlist_id}")
 async def delete_playlist(playlist_id: str, current_user: str = Depends(get_current_user)):
-    result = playlists_collection.delete_one({"id": playlist_id, "username": current_user})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Playlist not found")
+    async with playlist_changes.change(current_user) as seq:
+        result = await playlists_collection.delete_one({"id": playlist_id, "username": current_user})
+        if result.deleted_count == 0:
+            raise HTTPException(status_code=404, detail="Playlist not found")
+        await playlist_changes.tombstone(current_user, playlist_id, seq, datetime.utcnow())
+    await asyncio.to_thread(recommender.remove_playlist, playlist_id)
     return {"message": "Playlist deleted successfully"}
 
+@app.exception_handler(DatabaseTimeout)
+async def database_timeout_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Database unavailable, try again"})
+
+@app.exception_handler(HashingPoolSaturated)
+async def hashing_saturated_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many authentication requests, try again"},
+        headers={"Retry-After": "1"},
+    )
+
+# Background jobs
+@app.get("/api/jobs")
+async def list_jobs(limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), current_user: str = Depends(get_current_user)):
+    return ORJSONResponse(await job_queue.list(current_user, limit))
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, current_user: str = Depends(get_current_user)):
+    job = await job_queue.get(job_id, current_user)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ORJSONResponse(job, headers={"Cache-Control": "no-store"})
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, current_user: str = Depends(get_current_user)):
+    job = await job_queue.get(job_id, current_user)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["owner"] != current_user:
+        raise HTTPException(status_code=403, detail="Only the job's owner can cancel it")
+    job = await job_queue.cancel(job_id, current_user)
+    if job["kind"] == "import_tracks" and job["status"] == "cancelled":
+        # Cancelled while queued (a running import drops its payload itself)
+        await remove_spool(import_spool_collection, job["params"]["upload"])
+    return ORJSONResponse(job)
+
+# Request profiles; the X-Profile header carries PROFILE_TOKEN (see profiling.py)
+def require_profile_token(request: Request):
+    if not profiling.authorized(request.headers.get("x-profile")):
+        raise HTTPException(status_code=403, detail="Profiling token required")
+
+@app.get("/api/debug/profiles", dependencies=[Depends(require_profile_token)])
+async def list_profiles(route: Optional[str] = None):
+    return ORJSONResponse([profile.summary() for profile in profiling.PROFILER.profiles(route)])
+
+@app.get("/api/debug/profiles/collapsed", dependencies=[Depends(require_profile_token)])
+async def get_merged_profile(route: Optional[str] = None, tag: Optional[str] = Query(None, regex="^(cpu|db|bcrypt|wait)$")):
+    """Collapsed stacks of every buffered profile (of one route), for a flamegraph."""
+    return PlainTextResponse(profiling.PROFILER.collapsed(route, tag))
+
+@app.get("/api/debug/profiles/{profile_id}", dependencies=[Depends(require_profile_token)])
+async def get_profile(profile_id: str):
+    profile = profiling.PROFILER.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.collapsed())
+
 # Health check
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/api/metrics")
+async def get_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/diagnostics/query-plans")
+async def query_plans(current_user: str = Depends(get_current_user)):
+    report = await meta_collection.run(audit_query_plans, database.db)
+    return {"collscan": any(entry["collscan"] for entry in report), "query_plans": report}
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
-    init_sample_tracks()
+    await meta_collection.run(ensure_indexes, database.db)
+    await catalog_cache.current_version()
+    # Built before serving, as searches and browses would otherwise see an empty catalog;
+    # later full rebuilds run as reindex_catalog jobs
+    await build_catalog_indexes()
+    # Also resumes jobs interrupted by a restart, waveforms and imports included
+    job_queue.start()
+    await init_sample_tracks()
+    # Until this job has run, related tracks and radio come from whatever the model holds
+    await job_queue.submit("sync_recommendations", {"load": True}, priority=PRIORITY_HIGH, local=True)
+    global recommender_task
+    recommender_task = asyncio.ensure_future(recommender.keep_synced(playlists_collection))
+    await warm_caches()
+    await play_counter.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Before the database goes away: running jobs are re-queued, buffered plays flushed (or spooled)
+    await job_queue.stop()
+    await play_counter.stop()
+    password_hasher.shutdown()
+    waveform_builder.shutdown()
+    if recommender_task:
+        recommender_task.cancel()
+    # Not before the startup sync job ran: the model would be missing whatever the snapshot held
+    if recommender_synced:
+        try:
+            recommender.save()
+        except OSError:
+            logger.exception("Saving the recommendation snapshot failed")
+    database.shutdown()
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    # Multi-process serving; see serve.py
+    import serve
+    serve.main()
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""In-process cache of the track catalog.
+
+Individual tracks are kept in an LRU keyed by ``id`` and serialized catalog
+listings in a second LRU.  Both are valid for one catalog version: a counter
+stored in Mongo (``meta`` collection, ``_id: "catalog"``) that every catalog
+write bumps.  Each worker re-reads the counter at most once per
+CATALOG_VERSION_POLL_SECONDS, so with several uvicorn workers sharing a
+database a write made elsewhere is picked up within that interval, while
+writes made by this worker invalidate immediately.
+
+A bump that names the tracks it changed also records them in the
+``catalog_changes`` collection under the new version, so a worker catching
+up on other workers' writes can re-index just those tracks; when any
+version in between is unrecorded (a bulk import, or a gap of more than
+CATALOG_CHANGE_WINDOW versions) it rebuilds from the whole catalog.
+
+Configuration (environment):
+
+    TRACK_CACHE_SIZE              tracks kept in the LRU (default: 10000)
+    LISTING_CACHE_SIZE            serialized listing pages kept (default: 256)
+    CATALOG_VERSION_POLL_SECONDS  how often to re-read the version (default: 1.0)
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+TRACK_CACHE_SIZE = int(os.environ.get('TRACK_CACHE_SIZE', 10000))
+LISTING_CACHE_SIZE = int(os.environ.get('LISTING_CACHE_SIZE', 256))
+CATALOG_VERSION_POLL_SECONDS = float(os.environ.get('CATALOG_VERSION_POLL_SECONDS', 1.0))
+CATALOG_CHANGE_WINDOW = 100
+CATALOG_CHANGE_TTL_SECONDS = 86400
+
+CATALOG_VERSION_ID = "catalog"
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class CatalogCache:
+    """Version-checked caches for tracks and catalog listings."""
+
+    def __init__(self, meta_collection, changes_collection=None, max_tracks=TRACK_CACHE_SIZE,
+                 max_listings=LISTING_CACHE_SIZE, poll_interval=CATALOG_VERSION_POLL_SECONDS):
+        self.meta = meta_collection
+        self.changes = changes_collection
+        self.poll_interval = poll_interval
+        self.tracks = LRUCache(max_tracks)
+        self.listings = LRUCache(max_listings)
+        self.version = None
+        self._checked_at = 0.0
+        self._listeners = []
+
+    def on_change(self, callback):
+        """Register ``callback(previous, version)`` to run when another worker changes the catalog."""
+        self._listeners.append(callback)
+        return callback
+
+    @property
+    def etag(self):
+        return f'W/"catalog-{self.version}"'
+
+    async def _read_version(self):
+        doc = await self.meta.find_one({"_id": CATALOG_VERSION_ID})
+        return doc["version"] if doc else 0
+
+    def _apply(self, version, remote):
+        if version == self.version:
+            return
+        previous = self.version
+        self.version = version
+        self.tracks.clear()
+        self.listings.clear()
+        if remote and previous is not None:
+            for callback in self._listeners:
+                result = callback(previous, version)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+
+    async def current_version(self):
+        """Return the catalog version, re-reading it from Mongo when the poll interval has passed."""
+        now = time.monotonic()
+        if self.version is None or now - self._checked_at >= self.poll_interval:
+            self._checked_at = now
+            self._apply(await self._read_version(), remote=True)
+        return self.version
+
+    async def bump(self, track_ids=None):
+        """Record a catalog write made by this worker and invalidate the caches;
+        ``track_ids`` names the tracks it changed, if known."""
+        previous = self.version
+        doc = await self.meta.find_one_and_update(
+            {"_id": CATALOG_VERSION_ID},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if self.changes is not None and track_ids is not None:
+            await self.changes.insert_one(
+                {"version": doc["version"], "track_ids": list(track_ids), "at": datetime.utcnow()}
+            )
+        self._checked_at = time.monotonic()
+        # If another worker bumped in between, we also missed its changes
+        self._apply(doc["version"], remote=previous is not None and doc["version"] != previous + 1)
+        return self.version
+
+    async def changed_tracks(self, since, until):
+        """Ids of the tracks changed between versions ``since`` and ``until``, or None
+        if some version in between did not record them."""
+        if self.changes is None or not 0 < until - since <= CATALOG_CHANGE_WINDOW:
+            return None if until != since else set()
+        docs = await self.changes.find({"version": {"$gt": since, "$lte": until}}, {"_id": 0, "track_ids": 1})
+        if len(docs) != until - since:
+            return None
+        return {track_id for doc in docs for track_id in doc["track_ids"]}
+
+    def get_track(self, track_id):
+        return self.tracks.get(track_id)
+
+    def put_track(self, track, version):
+        # Drop results fetched under a version that has since been replaced
+        if version == self.version:
+            self.tracks.put(track["id"], track)
+
+    def get_listing(self, key):
+        return self.listings.get(key)
+
+    def put_listing(self, key, value, version):
+        if version == self.version:
+            self.listings.put(key, value)
+
+    def stats(self):
+        return {"version": self.version, "tracks": self.tracks.stats(), "listings": self.listings.stats()}
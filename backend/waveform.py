@@ -0,0 +1,240 @@
+"""Precomputed waveform peaks for locally hosted audio.
+
+An uploaded file is decoded once, mixed down to mono, and reduced with
+NumPy to per-bucket peak and RMS levels at a few resolutions.  Samples are
+decoded DECODE_BLOCK_FRAMES at a time and folded into running per-bucket
+peaks and sums of squares, so memory stays flat however long the file is.  The results
+are stored content-addressed, keyed by the SHA-256 of the audio bytes, so
+the same audio uploaded twice is decoded only once and a stored waveform
+never changes:
+
+    WAVEFORM_DIR/<sha256>-<buckets>.bin   buckets x uint8 peak, then buckets x uint8 RMS
+    WAVEFORM_DIR/<sha256>.json            duration and available resolutions
+
+Levels are quantized to 0-255 of full scale.  PCM WAV is decoded with the
+standard library; other formats need ``ffmpeg`` on PATH, which decodes to a
+temporary PCM file next to the waveforms.  Decoding runs on
+its own small thread pool so it never competes with request handling for
+the database or bcrypt executors.
+
+Configuration (environment):
+
+    WAVEFORM_DIR          where waveforms are stored (default: ./waveforms)
+    WAVEFORM_RESOLUTIONS  bucket counts computed per file (default: 256,1024,4096)
+    WAVEFORM_WORKERS      threads decoding audio (default: 1)
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+WAVEFORM_DIR = os.environ.get('WAVEFORM_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'waveforms'))
+WAVEFORM_RESOLUTIONS = tuple(
+    int(value) for value in os.environ.get('WAVEFORM_RESOLUTIONS', '256,1024,4096').split(',') if value.strip()
+)
+WAVEFORM_WORKERS = int(os.environ.get('WAVEFORM_WORKERS', 1))
+
+WAV_TYPES = ("audio/wav", "audio/x-wav", "audio/wave", "audio/vnd.wave")
+FFMPEG_SAMPLE_RATE = 11025
+DECODE_BLOCK_FRAMES = 1 << 18
+
+
+class UnsupportedAudio(Exception):
+    """The audio could not be decoded."""
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pcm_to_float(raw, width, channels):
+    """Mono float32 samples in [-1, 1] from interleaved little-endian PCM frames."""
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+    elif width == 3:
+        # Sign-extend packed 24-bit samples into int32
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        samples = (np.where(values & 0x800000, values - 0x1000000, values)).astype(np.float32) / 8388608.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise UnsupportedAudio(f"Unsupported sample width: {width}")
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+@contextmanager
+def _decode_wav(path):
+    try:
+        w = wave.open(path, 'rb')
+    except (wave.Error, EOFError) as exc:
+        raise UnsupportedAudio(f"Unreadable WAV: {exc}")
+    with w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        if width not in (1, 2, 3, 4):
+            raise UnsupportedAudio(f"Unsupported sample width: {width}")
+
+        def blocks():
+            while True:
+                try:
+                    raw = w.readframes(DECODE_BLOCK_FRAMES)
+                except (wave.Error, EOFError) as exc:
+                    raise UnsupportedAudio(f"Unreadable WAV: {exc}")
+                if not raw:
+                    return
+                yield _pcm_to_float(raw, width, channels)
+
+        yield w.getnframes(), rate, blocks()
+
+
+@contextmanager
+def _decode_ffmpeg(path):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise UnsupportedAudio("Decoding this format needs ffmpeg")
+    os.makedirs(WAVEFORM_DIR, exist_ok=True)
+    with tempfile.TemporaryFile(dir=WAVEFORM_DIR) as pcm:
+        result = subprocess.run(
+            [ffmpeg, "-v", "error", "-i", path, "-ac", "1", "-ar", str(FFMPEG_SAMPLE_RATE), "-f", "s16le", "-"],
+            stdout=pcm, stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            raise UnsupportedAudio(result.stderr.decode('utf-8', 'replace').strip() or "ffmpeg failed")
+        count = pcm.tell() // 2
+        pcm.seek(0)
+        blocks = iter(lambda: pcm.read(DECODE_BLOCK_FRAMES * 2), b"")
+        yield count, FFMPEG_SAMPLE_RATE, (_pcm_to_float(raw, 2, 1) for raw in blocks)
+
+
+def decode(path, content_type):
+    """Context manager yielding ``(sample count, sample rate, iterator of mono float32 blocks in [-1, 1])``."""
+    if content_type in WAV_TYPES:
+        return _decode_wav(path)
+    return _decode_ffmpeg(path)
+
+
+def _quantize(levels):
+    return np.clip(np.rint(levels * 255.0), 0, 255).astype(np.uint8)
+
+
+class LevelAccumulator:
+    """Peak and RMS per bucket of a ``count``-sample signal, fed in consecutive blocks."""
+
+    def __init__(self, count, buckets):
+        buckets = max(1, min(buckets, count))
+        self.starts = np.arange(buckets, dtype=np.int64) * count // buckets
+        self.sizes = np.diff(np.append(self.starts, count))
+        self.peaks = np.zeros(buckets, dtype=np.float32)
+        self.sums = np.zeros(buckets, dtype=np.float64)
+
+    def add(self, offset, magnitudes, squares):
+        # Buckets overlapping [offset, offset + len), split where each one starts
+        first = np.searchsorted(self.starts, offset, side='right') - 1
+        last = np.searchsorted(self.starts, offset + len(magnitudes), side='left')
+        splits = np.maximum(self.starts[first:last] - offset, 0)
+        np.maximum(self.peaks[first:last], np.maximum.reduceat(magnitudes, splits), out=self.peaks[first:last])
+        self.sums[first:last] += np.add.reduceat(squares, splits)
+
+    def levels(self):
+        return _quantize(self.peaks), _quantize(np.sqrt(self.sums / self.sizes))
+
+
+def _meta_path(digest):
+    return os.path.join(WAVEFORM_DIR, f"{digest}.json")
+
+
+def level_path(digest, buckets):
+    return os.path.join(WAVEFORM_DIR, f"{digest}-{buckets}.bin")
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_waveform(path, content_type, resolutions=WAVEFORM_RESOLUTIONS):
+    """Compute (or reuse) the stored waveform of ``path``; return its metadata."""
+    digest = file_digest(path)
+    try:
+        with open(_meta_path(digest)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+
+    with decode(path, content_type) as (count, rate, blocks):
+        if not count:
+            raise UnsupportedAudio("No audio samples")
+        accumulators = [LevelAccumulator(count, buckets) for buckets in sorted(set(resolutions))]
+        decoded = 0
+        for samples in blocks:
+            samples = samples[:count - decoded]  # a header may undercount what follows it
+            if not len(samples):
+                break
+            magnitudes = np.abs(samples)
+            squares = np.square(samples, dtype=np.float64)
+            for accumulator in accumulators:
+                accumulator.add(decoded, magnitudes, squares)
+            decoded += len(samples)
+    if not decoded:
+        raise UnsupportedAudio("No audio samples")
+    os.makedirs(WAVEFORM_DIR, exist_ok=True)
+    stored = []
+    for accumulator in accumulators:
+        peaks, rms = accumulator.levels()
+        _write_atomic(level_path(digest, len(peaks)), peaks.tobytes() + rms.tobytes())
+        stored.append(len(peaks))
+    meta = {"hash": digest, "duration": round(decoded / float(rate), 3), "resolutions": sorted(set(stored))}
+    # Written last: its presence means every level file exists
+    _write_atomic(_meta_path(digest), json.dumps(meta).encode('utf-8'))
+    return meta
+
+
+def pick_resolution(available, requested):
+    """The smallest stored resolution with at least ``requested`` buckets, else the largest."""
+    for buckets in sorted(available):
+        if buckets >= requested:
+            return buckets
+    return max(available)
+
+
+def load_levels(digest, buckets):
+    """Return ``(peaks, rms)`` as bytes, or None if not stored."""
+    try:
+        with open(level_path(digest, buckets), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return data[:len(data) // 2], data[len(data) // 2:]
+
+
+class WaveformBuilder:
+    """Runs build_waveform on a dedicated thread pool."""
+
+    def __init__(self, workers=WAVEFORM_WORKERS, resolutions=WAVEFORM_RESOLUTIONS):
+        self.resolutions = resolutions
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="waveform")
+
+    async def build(self, path, content_type):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, build_waveform, path, content_type, self.resolutions)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
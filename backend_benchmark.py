@@ -0,0 +1,705 @@
+"""Latency and throughput benchmarks for the Music App API.
+
+Run against a deployment, or against a local server backed by the
+in-memory store (no Mongo needed):
+
+    python backend_benchmark.py https://host                # scenario benchmarks
+    python backend_benchmark.py --in-process --load --concurrency 32 --duration 30 \
+        --mix browse=50,search=30,playlist=15,login=5 --output bench.json
+    python backend_benchmark.py --in-process --load --compare bench.json
+    MONGO_URL=mongodb://localhost:27017/ python backend_benchmark.py --workers 1,2,4 --concurrency 64
+
+``--load`` drives a weighted mix of user sessions from concurrent clients
+and reports p50/p95/p99 latency and req/s per route as JSON; ``--compare``
+prints the change against an earlier report.  ``--workers`` starts
+backend/serve.py once per worker count and reports how req/s scales; the
+workers share one database, so it needs a real MONGO_URL.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from backend_test import MusicAppAPITester
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Summarize latency samples (seconds) as milliseconds"""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+class MusicAppBenchmark:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.tester = MusicAppAPITester(base_url)
+        self.results = {}
+
+    def _timed_get(self, session, path, **kwargs):
+        start = time.perf_counter()
+        response = session.get(f"{self.base_url}{path}", **kwargs)
+        return response, time.perf_counter() - start
+
+    def _browse_latency(self, duration, stop=None):
+        """Sample /api/tracks latency for ``duration`` seconds"""
+        session = requests.Session()
+        samples = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline and not (stop and stop.is_set()):
+            response, elapsed = self._timed_get(session, "/api/tracks")
+            if response.status_code == 200:
+                samples.append(elapsed)
+        return samples
+
+    def login_vs_browse(self, login_clients=16, duration=10.0):
+        """Measure logins/sec and track-list latency with and without a login burst"""
+        if not self.tester.register_user():
+            raise RuntimeError("could not register benchmark user")
+
+        idle = self._browse_latency(duration / 2)
+
+        stop = threading.Event()
+        counts = {"ok": 0, "rejected": 0, "failed": 0}
+        lock = threading.Lock()
+        login = {"username": self.tester.username, "password": self.tester.password}
+
+        def login_loop():
+            session = requests.Session()
+            while not stop.is_set():
+                response = session.post(f"{self.base_url}/api/auth/login", json=login)
+                key = {200: "ok", 503: "rejected"}.get(response.status_code, "failed")
+                with lock:
+                    counts[key] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=login_clients) as pool:
+            for _ in range(login_clients):
+                pool.submit(login_loop)
+            busy = self._browse_latency(duration)
+            stop.set()
+        elapsed = time.perf_counter() - start
+
+        self.results["login_vs_browse"] = {
+            "login_clients": login_clients,
+            "logins_per_sec": round(counts["ok"] / elapsed, 2),
+            "logins_rejected": counts["rejected"],
+            "logins_failed": counts["failed"],
+            "tracks_idle": summarize(idle),
+            "tracks_during_logins": summarize(busy),
+        }
+        return self.results["login_vs_browse"]
+
+    def playlist_hydration(self, sizes=(10, 100, 500, 1000), repeats=20):
+        """Measure GET /api/playlists/{id} latency as the playlist grows"""
+        if not self.tester.token and not self.tester.register_user():
+            raise RuntimeError("could not register benchmark user")
+        session = requests.Session()
+        headers = {"Authorization": f"Bearer {self.tester.token}"}
+        track_ids = [track["id"] for track in session.get(f"{self.base_url}/api/tracks").json()]
+        if not track_ids:
+            raise RuntimeError("catalog is empty")
+
+        results = {}
+        for size in sizes:
+            data = {
+                "name": f"Benchmark {size}",
+                "track_ids": [track_ids[i % len(track_ids)] for i in range(size)],
+            }
+            response = session.post(f"{self.base_url}/api/playlists", json=data, headers=headers)
+            playlist_id = response.json()["playlist_id"]
+            samples = []
+            for _ in range(repeats):
+                response, elapsed = self._timed_get(session, f"/api/playlists/{playlist_id}", headers=headers)
+                if response.status_code == 200:
+                    samples.append(elapsed)
+            results[str(size)] = summarize(samples)
+
+        response, elapsed = self._timed_get(session, "/api/playlists?include=tracks", headers=headers)
+        results["list_include_tracks_ms"] = round(elapsed * 1000, 2)
+        self.results["playlist_hydration"] = results
+        return results
+
+    def token_cache_cpu(self, iterations=20000):
+        """Measure per-request CPU of verifying a bearer token with and without the cache"""
+        import jwt
+        from auth_cache import AuthCache
+
+        secret = "benchmark-secret"
+        exp = int(time.time()) + 3600
+        token = jwt.encode({"sub": "benchmark", "exp": exp}, secret, algorithm="HS256")
+
+        start = time.process_time()
+        for _ in range(iterations):
+            jwt.decode(token, secret, algorithms=["HS256"])
+        decode_us = (time.process_time() - start) / iterations * 1e6
+
+        cache = AuthCache()
+        cache.put_token(token, "benchmark", exp)
+        start = time.process_time()
+        for _ in range(iterations):
+            cache.get_token(token)
+        cached_us = (time.process_time() - start) / iterations * 1e6
+
+        self.results["token_cache_cpu"] = {
+            "jwt_decode_us": round(decode_us, 2),
+            "cache_hit_us": round(cached_us, 2),
+            "saved_us_per_request": round(decode_us - cached_us, 2),
+        }
+        return self.results["token_cache_cpu"]
+
+    def ingest_rows_per_sec(self, rows=100000, batch_size=1000):
+        """Measure NDJSON parse + validate throughput of the catalog importer"""
+        from ingest import TrackImporter
+        from server import Track
+
+        def lines():
+            for i in range(rows):
+                yield json.dumps({
+                    "id": f"bench-{i}",
+                    "title": f"Track {i}",
+                    "artist": f"Artist {i % 500}",
+                    "album": f"Album {i % 2000}",
+                    "duration": 120 + i % 240,
+                    "genre": ["Jazz", "Synthwave", "Indie Folk", "Electronic"][i % 4],
+                })
+
+        importer = TrackImporter(Track, "ndjson", batch_size)
+        for line in lines():
+            importer.feed(line)
+        importer.finish()
+        report = importer.report()
+        self.results["ingest"] = {key: report[key] for key in ("accepted", "rejected", "batches", "rows_per_second")}
+        return self.results["ingest"]
+
+    def list_payload_cost(self, rows=10000, repeats=5, fields=("id", "title", "artist", "duration")):
+        """Measure serialization time and bytes on the wire for a ``rows``-track listing"""
+        import orjson
+        from fastapi.encoders import jsonable_encoder
+        from compression import compress
+
+        tracks = [{
+            "id": f"bench-{i:06d}",
+            "title": f"Track {i}",
+            "artist": f"Artist {i % 500}",
+            "album": f"Album {i % 2000}",
+            "duration": 120 + i % 240,
+            "genre": ["Jazz", "Synthwave", "Indie Folk", "Electronic"][i % 4],
+            "image": f"https://images.unsplash.com/photo-{1493225457124 + i}-a3eb161ffa5f?w=300&h=300&fit=crop",
+            "audio_url": f"https://cdn.example.com/audio/{i:06d}/bell-ringing-05.wav",
+        } for i in range(rows)]
+        sparse = [{field: track[field] for field in fields} for track in tracks]
+
+        def best_ms(fn):
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            return round(min(timings) * 1000, 2)
+
+        results = {
+            "rows": rows,
+            # FastAPI's default path for a returned list vs a pre-serialized orjson body
+            "jsonable_encoder_json_ms": best_ms(lambda: json.dumps(jsonable_encoder(tracks)).encode("utf-8")),
+            "orjson_ms": best_ms(lambda: orjson.dumps(tracks)),
+        }
+        for name, payload in (("full", tracks), ("fields", sparse)):
+            body = orjson.dumps(payload)
+            results[f"{name}_bytes"] = len(body)
+            for encoding in ("gzip", "br"):
+                start = time.perf_counter()
+                compressed = compress(body, encoding)
+                results[f"{name}_{encoding}_bytes"] = len(compressed)
+                results[f"{name}_{encoding}_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        results["fields"] = list(fields)
+        self.results["list_payload"] = results
+        return results
+
+    def run_all(self):
+        print("🎵 Starting Music App API Benchmarks 🎵")
+        print(f"Base URL: {self.base_url}")
+        self.login_vs_browse()
+        self.playlist_hydration()
+        self.token_cache_cpu()
+        self.ingest_rows_per_sec()
+        self.list_payload_cost()
+        print(json.dumps(self.results, indent=2))
+        return self.results
+
+
+class LocalServer:
+    """Serve the FastAPI app on an ephemeral local port, backed by the in-memory store."""
+
+    def __init__(self, host="127.0.0.1"):
+        self.host = host
+        self.base_url = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        # Must be set before server/database are first imported
+        os.environ.setdefault("MONGO_URL", "memory://")
+        import uvicorn
+        from server import app
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Accepted connections inherit this; avoids Nagle + delayed-ACK stalls
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.bind((self.host, 0))
+        self.base_url = f"http://{self.host}:{sock.getsockname()[1]}"
+        config = uvicorn.Config(app, log_level="warning", access_log=False, lifespan="on")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [sock]}, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 30
+        while not self._server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("local server failed to start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.should_exit = True
+        self._thread.join(timeout=30)
+
+
+class ServerProcess:
+    """Run backend/serve.py with ``workers`` processes on a free local port."""
+
+    def __init__(self, workers, host="127.0.0.1"):
+        self.workers = workers
+        self.host = host
+        self.base_url = None
+        self._process = None
+
+    def __enter__(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind((self.host, 0))
+            port = sock.getsockname()[1]
+        self.base_url = f"http://{self.host}:{port}"
+        env = dict(os.environ, WEB_CONCURRENCY=str(self.workers), HOST=self.host, PORT=str(port), LOG_LEVEL="warning")
+        serve = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "serve.py")
+        self._process = subprocess.Popen([sys.executable, serve], env=env)
+        deadline = time.monotonic() + 60
+        while True:
+            if self._process.poll() is not None or time.monotonic() > deadline:
+                self.__exit__(None, None, None)
+                raise RuntimeError(f"serve.py with {self.workers} workers failed to start")
+            try:
+                if requests.get(f"{self.base_url}/api/health", timeout=1).ok:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        # Health answers once the first worker is up; give the rest time to finish startup
+        time.sleep(1 + 0.5 * self.workers)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+
+
+class RouteStats:
+    """Thread-safe latency samples and status counts keyed by route template.
+
+    Rate-limited (429) responses are counted as ``rejected`` and kept out of
+    the latency samples, which would otherwise mostly time the rejections.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, status_code, elapsed):
+        with self.lock:
+            self.statuses[route][str(status_code)] += 1
+            if status_code == 429:
+                self.rejected[route] += 1
+                return
+            self.samples[route].append(elapsed)
+            if status_code >= 500 or status_code == 0:
+                self.errors[route] += 1
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.errors.clear()
+            self.rejected.clear()
+            self.statuses.clear()
+
+    def report(self, wall_seconds):
+        routes = {}
+        for route in sorted(self.statuses):
+            samples = self.samples[route]
+            routes[route] = dict(
+                summarize(samples),
+                req_per_sec=round(len(samples) / wall_seconds, 2),
+                errors=self.errors[route],
+                rejected=self.rejected[route],
+                statuses=dict(self.statuses[route]),
+            )
+        everything = [elapsed for samples in self.samples.values() for elapsed in samples]
+        total = dict(
+            summarize(everything),
+            req_per_sec=round(len(everything) / wall_seconds, 2),
+            errors=sum(self.errors.values()),
+            rejected=sum(self.rejected.values()),
+        )
+        return routes, total
+
+
+DEFAULT_MIX = {"browse": 50, "search": 30, "playlist": 15, "login": 5}
+# Typing speed of a simulated user, within the server's per-user search rate
+KEYSTROKE_SECONDS = 0.1
+SEARCH_TERMS = ["jazz", "synthwave", "electronic", "artist 12", "album 3", "track 42", "folk", "chill"]
+
+
+def parse_mix(spec):
+    """Parse ``browse=50,search=30`` into scenario weights."""
+    mix = {}
+    for part in filter(None, spec.split(",")):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown scenario: {name}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("Mix needs at least one positive weight")
+    return mix
+
+
+class LoadClient:
+    """One simulated user: its own session, account, playlist and random stream."""
+
+    def __init__(self, base_url, stats, seed, track_ids):
+        self.base_url = base_url
+        self.stats = stats
+        self.random = random.Random(seed)
+        self.track_ids = track_ids
+        self.session = requests.Session()
+        self.username = f"load_{seed}_{uuid.uuid4().hex[:8]}"
+        self.password = "Test123!"
+        self.headers = {}
+        self.playlist_id = None
+        self.etag = None
+
+    def call(self, method, route, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=60, **kwargs)
+            status_code = response.status_code
+        except requests.RequestException:
+            response, status_code = None, 0
+        self.stats.record(f"{method} {route}", status_code, time.perf_counter() - start)
+        return response
+
+    def setup(self):
+        """Register the user and create its playlist; not counted in the results."""
+        data = {"username": self.username, "email": f"{self.username}@test.com", "password": self.password}
+        response = self.session.post(f"{self.base_url}/api/auth/register", json=data)
+        while response.status_code == 503:
+            # The bcrypt pool sheds registration bursts; back off as told
+            time.sleep(float(response.headers.get("Retry-After", 1)))
+            response = self.session.post(f"{self.base_url}/api/auth/register", json=data)
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = self.session.post(
+            f"{self.base_url}/api/playlists",
+            json={"name": "Load test", "track_ids": self.random.sample(self.track_ids, min(20, len(self.track_ids)))},
+            headers=self.headers,
+        )
+        response.raise_for_status()
+        self.playlist_id = response.json()["playlist_id"]
+
+    def browse(self):
+        headers = {"If-None-Match": self.etag} if self.etag and self.random.random() < 0.5 else {}
+        response = self.call("GET", "/api/tracks", "/api/tracks?limit=50", headers=headers)
+        if response is not None and response.status_code == 200:
+            self.etag = response.headers.get("ETag")
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if next_cursor:
+                self.call("GET", "/api/tracks", f"/api/tracks?limit=50&cursor={next_cursor}")
+        track_id = self.random.choice(self.track_ids)
+        self.call("GET", "/api/tracks/{track_id}", f"/api/tracks/{track_id}")
+
+    def search(self):
+        # Search-as-you-type: one request per keystroke
+        term = self.random.choice(SEARCH_TERMS)
+        for end in range(1, len(term) + 1):
+            if end > 1:
+                time.sleep(KEYSTROKE_SECONDS)
+            prefix = requests.utils.quote(term[:end])
+            # Signed in, so each simulated user has its own rate-limit bucket
+            self.call("GET", "/api/tracks/search/{query}", f"/api/tracks/search/{prefix}?limit=20", headers=self.headers)
+
+    def playlist(self):
+        path = f"/api/playlists/{self.playlist_id}"
+        self.call("GET", "/api/playlists", "/api/playlists", headers=self.headers)
+        response = self.call("GET", "/api/playlists/{playlist_id}", path, headers=self.headers)
+        size = len(response.json().get("track_ids", [])) if response is not None and response.status_code == 200 else 0
+        track_id = self.random.choice(self.track_ids)
+        self.call("POST", "/api/playlists/{playlist_id}/tracks", f"{path}/tracks",
+                  json={"track_ids": [track_id]}, headers=self.headers)
+        if size > 1:
+            move = {"from_position": self.random.randrange(size), "to_position": self.random.randrange(size)}
+            self.call("POST", "/api/playlists/{playlist_id}/tracks/move", f"{path}/tracks/move",
+                      json=move, headers=self.headers)
+        if size > 30:
+            self.call("DELETE", "/api/playlists/{playlist_id}/tracks/{track_id}", f"{path}/tracks/{track_id}",
+                      headers=self.headers)
+
+    def login(self):
+        data = {"username": self.username, "password": self.password}
+        response = self.call("POST", "/api/auth/login", "/api/auth/login", json=data)
+        if response is not None and response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        self.call("GET", "/api/auth/me", "/api/auth/me", headers=self.headers)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed_catalog(base_url, size):
+    """Import ``size`` synthetic tracks through /api/tracks/import."""
+    session = requests.Session()
+    user = f"seed_{uuid.uuid4().hex[:8]}"
+    response = session.post(f"{base_url}/api/auth/register",
+                            json={"username": user, "email": f"{user}@test.com", "password": "Test123!"})
+    response.raise_for_status()
+    body = "".join(json.dumps({
+        "id": f"load-{i:06d}",
+        "title": f"Track {i}",
+        "artist": f"Artist {i % 200}",
+        "album": f"Album {i % 800}",
+        "duration": 120 + i % 240,
+        "genre": ["Jazz", "Synthwave", "Indie Folk", "Electronic", "Lofi Hip Hop"][i % 5],
+    }) + "\n" for i in range(size))
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = session.post(f"{base_url}/api/tracks/import", data=body.encode("utf-8"), headers=headers)
+    response.raise_for_status()
+    # Imports run as a background job; wait for it before driving load
+    job = response.json()
+    job_url = f"{base_url}/api/jobs/{job['id']}"
+    while job["status"] in ("queued", "running"):
+        time.sleep(0.2)
+        response = session.get(job_url, headers=headers)
+        response.raise_for_status()
+        job = response.json()
+    if job["status"] != "succeeded":
+        raise RuntimeError(f"catalog import {job['status']}: {job.get('error')}")
+    return job["result"]["accepted"]
+
+
+def run_load(base_url, concurrency=16, duration=20.0, mix=None, seed=0, warmup=2.0):
+    """Drive ``concurrency`` clients through a weighted scenario mix; return the JSON report."""
+    mix = mix or DEFAULT_MIX
+    with requests.get(f"{base_url}/api/tracks?format=ndjson", stream=True) as response:
+        response.raise_for_status()
+        track_ids = [json.loads(line)["id"] for line in response.iter_lines() if line]
+    if not track_ids:
+        raise RuntimeError("catalog is empty")
+
+    stats = RouteStats()
+    clients = [LoadClient(base_url, stats, seed + index, track_ids) for index in range(concurrency)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(LoadClient.setup, clients))
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    stop = threading.Event()
+
+    def drive(client):
+        while not stop.is_set():
+            getattr(client, client.random.choices(names, weights)[0])()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for client in clients:
+            pool.submit(drive, client)
+        time.sleep(warmup)
+        # Discard warm-up samples (cold caches, connection setup)
+        stats.reset()
+        start = time.perf_counter()
+        time.sleep(duration)
+        stop.set()
+    wall = time.perf_counter() - start
+
+    routes, total = stats.report(wall)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "base_url": base_url,
+            "concurrency": concurrency,
+            "duration_seconds": round(wall, 2),
+            "warmup_seconds": warmup,
+            "mix": mix,
+            "seed": seed,
+            "catalog_size": len(track_ids),
+        },
+        "total": total,
+        "routes": routes,
+    }
+
+
+def worker_scaling(counts, concurrency=64, duration=20.0, mix=None, seed=0, warmup=2.0, catalog_size=0):
+    """Run the load mix against serve.py at each worker count; return req/s and speedup per count."""
+    runs = []
+    for index, workers in enumerate(counts):
+        with ServerProcess(workers) as server:
+            if index == 0 and catalog_size:
+                seed_catalog(server.base_url, catalog_size)
+            report = run_load(server.base_url, concurrency, duration, mix, seed + index * concurrency, warmup)
+        total = report["total"]
+        runs.append({
+            "workers": workers,
+            "req_per_sec": total["req_per_sec"],
+            "p50_ms": total["p50_ms"],
+            "p99_ms": total["p99_ms"],
+            "errors": total["errors"],
+            "rejected": total["rejected"],
+        })
+        print(f"{workers} workers: {total['req_per_sec']} req/s, p99 {total['p99_ms']} ms", file=sys.stderr)
+    baseline = runs[0]["req_per_sec"] or None
+    for run in runs:
+        run["speedup"] = round(run["req_per_sec"] / baseline, 2) if baseline else None
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {"concurrency": concurrency, "duration_seconds": duration, "mix": mix or DEFAULT_MIX,
+                   "cpus": os.cpu_count()},
+        "runs": runs,
+    }
+
+
+def compare(previous, current):
+    """Per-route change in p50/p95/p99 latency and req/s between two load reports."""
+    keys = ("p50_ms", "p95_ms", "p99_ms", "req_per_sec")
+    changes = {}
+    for route in sorted(set(previous["routes"]) | set(current["routes"])):
+        before = previous["routes"].get(route)
+        after = current["routes"].get(route)
+        if before is None or after is None:
+            changes[route] = "added" if before is None else "removed"
+            continue
+        changes[route] = {
+            key: {
+                "before": before[key],
+                "after": after[key],
+                "change_pct": round((after[key] - before[key]) / before[key] * 100, 1) if before[key] else None,
+            }
+            for key in keys
+        }
+    return {"from": previous.get("commit"), "to": current.get("commit"), "routes": changes}
+
+
+def default_backend_url():
+    # Use the public endpoint from frontend/.env
+    with open('/app/frontend/.env', 'r') as f:
+        for line in f:
+            if line.startswith('REACT_APP_BACKEND_URL='):
+                return line.strip().split('=')[1]
+    raise RuntimeError("REACT_APP_BACKEND_URL not found")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base_url", nargs="?", help="deployment to benchmark (default: frontend/.env)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="start a local server on the in-memory store instead of using base_url")
+    parser.add_argument("--load", action="store_true", help="run the concurrent load mix")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds, after warm-up")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="scenario weights, e.g. browse=50,search=30,playlist=15,login=5")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--catalog-size", type=int, default=2000,
+                        help="synthetic tracks imported into the in-process server")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier --load report to diff against")
+    parser.add_argument("--workers", type=lambda spec: [int(count) for count in spec.split(",")],
+                        help="comma-separated worker counts to run the load mix against, e.g. 1,2,4")
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        if os.environ.get("MONGO_URL", "").startswith("memory://") and max(args.workers) > 1:
+            parser.error("--workers needs MONGO_URL pointing at a shared Mongo")
+        results = worker_scaling(args.workers, args.concurrency, args.duration, args.mix, args.seed, args.warmup,
+                                 args.catalog_size)
+        print(json.dumps(results, indent=2))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        return results
+
+    if args.in_process:
+        server = LocalServer()
+        base_url = server.__enter__().base_url
+        if args.catalog_size:
+            seed_catalog(base_url, args.catalog_size)
+    else:
+        server = None
+        base_url = args.base_url or default_backend_url()
+
+    try:
+        if args.load:
+            results = run_load(base_url, args.concurrency, args.duration, args.mix, args.seed, args.warmup)
+            if args.compare:
+                with open(args.compare) as f:
+                    results["compare"] = compare(json.load(f), results)
+            print(json.dumps(results, indent=2))
+        else:
+            results = MusicAppBenchmark(base_url).run_all()
+    finally:
+        if server is not None:
+            server.__exit__(None, None, None)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
+import json
 import requests
 import unittest
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 class MusicAppAPITester:
@@ -262,6 +264,273 @@ class MusicAppAPITester:
             print(f"  Response: {response.text}")
             return False
 
+    def search_prefix_ranking(self):
+        """Test that search matches word prefixes and ranks title hits first"""
+        url = f"{self.base_url}/api/tracks/search"
+        
+        # "synth" is only a prefix of "Synthwave"
+        response = requests.get(f"{url}/synth")
+        if response.status_code != 200:
+            print(f"  Prefix search failed: {response.status_code}")
+            print(f"  Response: {response.text}")
+            return False
+        prefix_ids = [track["id"] for track in response.json()]
+        print(f"  Search for 'synth' returned {prefix_ids}")
+        
+        # "Dreams" is the title of track 5 and part of the artist of track 2
+        response = requests.get(f"{url}/dreams")
+        if response.status_code != 200:
+            print(f"  Ranked search failed: {response.status_code}")
+            print(f"  Response: {response.text}")
+            return False
+        ranked_ids = [track["id"] for track in response.json()]
+        print(f"  Search for 'dreams' returned {ranked_ids}")
+        
+        # Every term has to match
+        response = requests.get(f"{url}/neon retro")
+        all_terms_ids = [track["id"] for track in response.json()] if response.status_code == 200 else None
+        print(f"  Search for 'neon retro' returned {all_terms_ids}")
+        
+        ranked = {"2", "5"} <= set(ranked_ids) and ranked_ids.index("5") < ranked_ids.index("2")
+        return "3" in prefix_ids and ranked and all_terms_ids == ["3"]
+
+    def playlist_track_ids(self, playlist_id):
+        """Current track ids and version of a playlist, or None"""
+        url = f"{self.base_url}/api/playlists/{playlist_id}"
+        headers = {"Authorization": f"Bearer {self.token}"}
+        
+        response = requests.get(url, headers=headers)
+        if response.status_code != 200:
+            print(f"  Failed to get playlist: {response.status_code}")
+            return None
+        playlist = response.json()
+        return playlist.get("track_ids", []), playlist.get("version")
+
+    def edit_playlist_tracks(self, playlist_id):
+        """Test appending, inserting, moving and removing tracks by position"""
+        if not self.token:
+            print("  No token available")
+            return False
+            
+        url = f"{self.base_url}/api/playlists/{playlist_id}/tracks"
+        headers = {"Authorization": f"Bearer {self.token}"}
+        start = self.playlist_track_ids(playlist_id)
+        if start is None:
+            return False
+        track_ids, _ = start
+        
+        steps = [
+            ("append", lambda: requests.post(url, json={"track_ids": ["2", "3"]}, headers=headers),
+             track_ids + ["2", "3"]),
+            ("insert at 0", lambda: requests.post(url, json={"track_ids": ["4"], "position": 0}, headers=headers),
+             ["4"] + track_ids + ["2", "3"]),
+            ("move 0 -> last", lambda: requests.post(
+                f"{url}/move", json={"from_position": 0, "to_position": len(track_ids) + 2}, headers=headers),
+             track_ids + ["2", "3", "4"]),
+            ("remove at position", lambda: requests.delete(
+                f"{url}/2", params={"position": len(track_ids)}, headers=headers),
+             track_ids + ["3", "4"]),
+        ]
+        for name, request, expected in steps:
+            response = request()
+            if response.status_code != 200:
+                print(f"  {name} failed: {response.status_code}")
+                print(f"  Response: {response.text}")
+                return False
+            current = self.playlist_track_ids(playlist_id)
+            print(f"  {name}: {current[0] if current else None}")
+            if current is None or current[0] != expected:
+                print(f"  Expected: {expected}")
+                return False
+        
+        # The track at position 0 is not "3", so nothing is removed
+        response = requests.delete(f"{url}/3", params={"position": 0}, headers=headers)
+        print(f"  Remove at a wrong position: {response.status_code}")
+        return response.status_code == 409
+
+    def playlist_version_conflict(self, playlist_id):
+        """Test that an edit made against a stale version is rejected with 409"""
+        if not self.token:
+            print("  No token available")
+            return False
+            
+        url = f"{self.base_url}/api/playlists/{playlist_id}/tracks"
+        headers = {"Authorization": f"Bearer {self.token}"}
+        current = self.playlist_track_ids(playlist_id)
+        if current is None:
+            return False
+        _, version = current
+        
+        response = requests.post(url, json={"track_ids": ["5"], "version": version}, headers=headers)
+        if response.status_code != 200:
+            print(f"  Edit at the current version failed: {response.status_code}")
+            print(f"  Response: {response.text}")
+            return False
+        print(f"  Version {version} -> {response.json().get('version')}")
+        
+        # Same version again: somebody else's edit came first
+        stale = requests.post(url, json={"track_ids": ["5"], "version": version}, headers=headers)
+        stale_move = requests.post(
+            f"{url}/move", json={"from_position": 0, "to_position": 0, "version": version}, headers=headers
+        )
+        print(f"  Stale add: {stale.status_code}, stale move: {stale_move.status_code}")
+        return stale.status_code == 409 and stale_move.status_code == 409
+
+    def import_track(self, track, timeout=30):
+        """Import one track through a background import job and wait for it"""
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = requests.post(
+            f"{self.base_url}/api/tracks/import", data=json.dumps(track) + "\n", headers=headers
+        )
+        if response.status_code != 202:
+            print(f"  Track import failed: {response.status_code}")
+            print(f"  Response: {response.text}")
+            return False
+        
+        job_url = f"{self.base_url}{response.headers['Location']}"
+        deadline = time.time() + timeout
+        job = response.json()
+        while job["status"] in ("queued", "running") and time.time() < deadline:
+            time.sleep(0.1)
+            job = requests.get(job_url, headers=headers).json()
+        if job["status"] != "succeeded" or job["result"]["accepted"] != 1:
+            print(f"  Import job {job['id']}: {job['status']}, result {job.get('result')}, error {job.get('error')}")
+            return False
+        return True
+
+    def audio_range_requests(self):
+        """Test byte ranges on uploaded audio: 206, suffix ranges, 416 and If-Range"""
+        if not self.token:
+            print("  No token available")
+            return False
+            
+        headers = {"Authorization": f"Bearer {self.token}"}
+        track_id = f"range-test-{int(time.time())}"
+        track = {"id": track_id, "title": "Range Test", "artist": "Test", "album": "Test", "duration": 1,
+                 "genre": "Test"}
+        if not self.import_track(track):
+            return False
+        
+        body = bytes(range(256)) * 4
+        url = f"{self.base_url}/api/tracks/{track_id}/audio"
+        response = requests.put(url, data=body, headers={**headers, "Content-Type": "audio/mpeg"})
+        if response.status_code != 200:
+            print(f"  Audio upload failed: {response.status_code}")
+            print(f"  Response: {response.text}")
+            return False
+        
+        full = requests.get(url)
+        etag = full.headers.get("ETag")
+        head = requests.get(url, headers={"Range": "bytes=0-99"})
+        suffix = requests.get(url, headers={"Range": "bytes=-100"})
+        beyond = requests.get(url, headers={"Range": f"bytes={len(body)}-"})
+        if_range = requests.get(url, headers={"Range": "bytes=0-99", "If-Range": etag or ""})
+        stale_if_range = requests.get(url, headers={"Range": "bytes=0-99", "If-Range": '"stale"'})
+        print(f"  Full: {full.status_code}, {len(full.content)} bytes, ETag {etag}")
+        print(f"  bytes=0-99: {head.status_code} {head.headers.get('Content-Range')}")
+        print(f"  bytes=-100: {suffix.status_code} {suffix.headers.get('Content-Range')}")
+        print(f"  bytes={len(body)}-: {beyond.status_code} {beyond.headers.get('Content-Range')}")
+        print(f"  If-Range current: {if_range.status_code}, stale: {stale_if_range.status_code}")
+        
+        return (
+            full.status_code == 200 and full.content == body
+            and head.status_code == 206 and head.content == body[:100]
+            and head.headers.get("Content-Range") == f"bytes 0-99/{len(body)}"
+            and suffix.status_code == 206 and suffix.content == body[-100:]
+            and suffix.headers.get("Content-Range") == f"bytes {len(body) - 100}-{len(body) - 1}/{len(body)}"
+            and beyond.status_code == 416 and beyond.headers.get("Content-Range") == f"bytes */{len(body)}"
+            and if_range.status_code == 206
+            and stale_if_range.status_code == 200 and stale_if_range.content == body
+        )
+
+    def reimport_keeps_audio(self):
+        """Test that re-importing a track keeps the audio uploaded for it"""
+        if not self.token:
+            print("  No token available")
+            return False
+            
+        headers = {"Authorization": f"Bearer {self.token}"}
+        track_id = f"reimport-test-{int(time.time())}"
+        track = {"id": track_id, "title": "Reimport Test", "artist": "Test", "album": "Test", "duration": 1,
+                 "genre": "Test"}
+        if not self.import_track(track):
+            return False
+        
+        audio_url = f"{self.base_url}/api/tracks/{track_id}/audio"
+        response = requests.put(audio_url, data=bytes(1024), headers={**headers, "Content-Type": "audio/mpeg"})
+        if response.status_code != 200:
+            print(f"  Audio upload failed: {response.status_code}")
+            print(f"  Response: {response.text}")
+            return False
+        
+        renamed = dict(track, title="Reimport Test (renamed)")
+        if not self.import_track(renamed):
+            return False
+        
+        response = requests.get(f"{self.base_url}/api/tracks/{track_id}")
+        if response.status_code != 200:
+            print(f"  Get track failed: {response.status_code}")
+            return False
+        stored = response.json()
+        print(f"  Title: {stored.get('title')}, audio: {stored.get('audio')}, audio_url: {stored.get('audio_url')}")
+        audio = requests.get(audio_url)
+        print(f"  Audio download: {audio.status_code}, {len(audio.content)} bytes")
+        return (
+            stored.get("title") == renamed["title"]
+            and (stored.get("audio") or {}).get("size") == 1024
+            and stored.get("audio_url") == f"/api/tracks/{track_id}/audio"
+            and "waveform" in stored
+            and audio.status_code == 200 and len(audio.content) == 1024
+        )
+
+    def concurrent_throughput(self, playlist_id, concurrency=8, requests_per_client=20, min_overlap=2):
+        """Test that database-bound reads of concurrent clients overlap on the server"""
+        url = f"{self.base_url}/api/playlists/{playlist_id}"
+        headers = {"Authorization": f"Bearer {self.token}"}
+        metrics_url = f"{self.base_url}/api/metrics"
+        in_flight_prefix = 'http_requests_in_flight{method="GET"} '
+        running = True
+
+        def client_run(count):
+            session = requests.Session()
+            for _ in range(count):
+                response = session.get(url, headers=headers)
+                if response.status_code != 200:
+                    raise RuntimeError(f"GET {url} returned {response.status_code}")
+
+        def watch_in_flight():
+            # A handler blocking the event loop on the database never lets a second one in
+            session = requests.Session()
+            peak = 0
+            while running:
+                response = session.get(metrics_url)
+                if response.status_code != 200:
+                    raise RuntimeError(f"GET {metrics_url} returned {response.status_code}")
+                for line in response.text.splitlines():
+                    if line.startswith(in_flight_prefix):
+                        # Less the scrape itself
+                        peak = max(peak, int(float(line[len(in_flight_prefix):])) - 1)
+            return peak
+
+        start = time.perf_counter()
+        client_run(requests_per_client)
+        serial_rps = requests_per_client / (time.perf_counter() - start)
+
+        with ThreadPoolExecutor(max_workers=concurrency + 1) as pool:
+            watcher = pool.submit(watch_in_flight)
+            start = time.perf_counter()
+            try:
+                list(pool.map(client_run, [requests_per_client] * concurrency))
+            finally:
+                running = False
+            concurrent_rps = concurrency * requests_per_client / (time.perf_counter() - start)
+            peak = watcher.result()
+
+        print(f"  1 client: {serial_rps:.1f} req/s")
+        print(f"  {concurrency} clients: {concurrent_rps:.1f} req/s ({concurrent_rps / serial_rps:.1f}x)")
+        print(f"  Most playlist reads in flight at once: {peak}")
+        return peak >= min_overlap
+
     def run_all_tests(self):
         """Run all API tests in sequence"""
         print("🎵 Starting Music App API Tests 🎵")
@@ -276,6 +545,7 @@ class MusicAppAPITester:
         # Track tests
         self.run_test("Get All Tracks", self.get_tracks)
         self.run_test("Search Tracks", self.search_tracks)
+        self.run_test("Search Prefixes and Ranking", self.search_prefix_ranking)
         
         # Playlist tests
         playlist_id = None
@@ -283,10 +553,15 @@ class MusicAppAPITester:
             playlist_id = self.create_playlist()
             
         self.run_test("Get User Playlists", self.get_playlists)
+        self.run_test("Audio Range Requests", self.audio_range_requests)
+        self.run_test("Re-import Keeps Uploaded Audio", self.reimport_keeps_audio)
         
         if playlist_id:
             self.run_test("Add Track to Playlist", lambda: self.add_track_to_playlist(playlist_id))
+            self.run_test("Edit Playlist Tracks by Position", lambda: self.edit_playlist_tracks(playlist_id))
+            self.run_test("Playlist Version Conflict", lambda: self.playlist_version_conflict(playlist_id))
             self.run_test("Get Specific Playlist", lambda: self.get_playlist(playlist_id))
+            self.run_test("Concurrent Throughput", lambda: self.concurrent_throughput(playlist_id))
             self.run_test("Delete Playlist", lambda: self.delete_playlist(playlist_id))
         
         # Print summary
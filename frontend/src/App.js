@@ -15,6 +15,7 @@ const App = () => {
   const [duration, setDuration] = useState(0);
   const [volume, setVolume] = useState(1);
   const [isLoading, setIsLoading] = useState(false);
+  const [waveform, setWaveform] = useState(null);
   
   // Playlist state
   const [playlists, setPlaylists] = useState([]);
@@ -29,10 +30,15 @@ const App = () => {
   
   // Refs
   const audioRef = useRef(null);
+  const playlistsVersion = useRef(null);
+  const tracksLoad = useRef(0);
   
   // API base URL
   const API_BASE = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
   
+  // Uploaded audio is served by the backend under a relative path
+  const resolveAudioUrl = (url) => (url && url.startsWith('/') ? `${API_BASE}${url}` : url);
+  
   // Auth token management
   const getAuthToken = () => localStorage.getItem('authToken');
   const setAuthToken = (token) => localStorage.setItem('authToken', token);
@@ -96,15 +102,31 @@ const App = () => {
     setCurrentTrack(null);
     setIsPlaying(false);
     setPlaylists([]);
+    playlistsVersion.current = null;
     setCurrentPlaylist(null);
     setActiveTab('home');
   };
   
   // Data loading functions
+  // The catalog is paged; follow X-Next-Cursor until the last page, showing each page as it arrives
   const loadTracks = async () => {
+    const load = ++tracksLoad.current;
+    let cursor = null;
+    let loaded = [];
     try {
-      const data = await apiCall('/api/tracks');
-      setTracks(data);
+      do {
+        const query = cursor ? `?limit=1000&cursor=${encodeURIComponent(cursor)}` : '?limit=1000';
+        const response = await fetch(`${API_BASE}/api/tracks${query}`);
+        if (!response.ok) {
+          throw new Error(`API Error: ${response.status}`);
+        }
+        const page = await response.json();
+        // A newer load has started; leave the list to it
+        if (load !== tracksLoad.current) return;
+        loaded = loaded.concat(page);
+        setTracks(loaded);
+        cursor = response.headers.get('X-Next-Cursor');
+      } while (cursor);
     } catch (error) {
       console.error('Failed to load tracks:', error);
     }
@@ -112,13 +134,54 @@ const App = () => {
   
   const loadPlaylists = async () => {
     try {
-      const data = await apiCall('/api/playlists');
-      setPlaylists(data);
+      const token = getAuthToken();
+      const response = await fetch(`${API_BASE}/api/playlists`, {
+        headers: token ? { Authorization: `Bearer ${token}` } : {}
+      });
+      if (!response.ok) {
+        throw new Error(`API Error: ${response.status}`);
+      }
+      playlistsVersion.current = Number(response.headers.get('X-Playlists-Version')) || 0;
+      setPlaylists(await response.json());
     } catch (error) {
       console.error('Failed to load playlists:', error);
     }
   };
   
+  // Merge changed playlists and drop deleted ones; a delta may arrive twice or out of order
+  const applyPlaylistDelta = (delta) => {
+    if (delta.reset) {
+      // Our version predates the deletions the server still remembers
+      loadPlaylists();
+      return;
+    }
+    setPlaylists(prev => {
+      const deleted = new Set(delta.deleted);
+      const changed = new Map(delta.playlists.map(p => [p.id, p]));
+      const merged = prev
+        .filter(p => !deleted.has(p.id))
+        .map(p => {
+          const next = changed.get(p.id);
+          changed.delete(p.id);
+          return next && (next.version || 0) >= (p.version || 0) ? next : p;
+        });
+      return [...merged, ...changed.values()];
+    });
+    playlistsVersion.current = Math.max(playlistsVersion.current || 0, delta.version);
+  };
+  
+  const syncPlaylists = async () => {
+    if (playlistsVersion.current === null) {
+      await loadPlaylists();
+      return;
+    }
+    try {
+      applyPlaylistDelta(await apiCall(`/api/playlists?since=${playlistsVersion.current}`));
+    } catch (error) {
+      console.error('Failed to sync playlists:', error);
+    }
+  };
+  
   // Music player functions
   const playTrack = (track) => {
     if (currentTrack?.id === track.id) {
@@ -193,8 +256,8 @@ const App = () => {
       
       setNewPlaylistName('');
       setShowCreatePlaylist(false);
-      // Force reload playlists to show the new one
-      await loadPlaylists();
+      // Fetch only what changed since our version
+      await syncPlaylists();
     } catch (error) {
       alert('Failed to create playlist');
     }
@@ -202,17 +265,19 @@ const App = () => {
   
   const addToPlaylist = async (playlistId, trackId) => {
     try {
-      const playlist = playlists.find(p => p.id === playlistId);
-      const updatedTrackIds = [...playlist.track_ids, trackId];
-      
-      await apiCall(`/api/playlists/${playlistId}`, {
-        method: 'PUT',
+      const result = await apiCall(`/api/playlists/${playlistId}/tracks`, {
+        method: 'POST',
         body: JSON.stringify({
-          track_ids: updatedTrackIds
+          track_ids: [trackId]
         })
       });
       
-      await loadPlaylists();
+      // Apply the append locally instead of reloading every playlist
+      setPlaylists(prev => prev.map(p => (
+        p.id === playlistId
+          ? { ...p, track_ids: [...p.track_ids, trackId], version: result.version }
+          : p
+      )));
     } catch (error) {
       alert('Failed to add track to playlist');
     }
@@ -252,6 +317,18 @@ const App = () => {
     }
   }, []);
   
+  useEffect(() => {
+    // Changes made in other tabs and devices arrive as deltas; EventSource reconnects by itself
+    if (!user) return undefined;
+    const params = new URLSearchParams({ token: getAuthToken() });
+    if (playlistsVersion.current !== null) {
+      params.set('since', playlistsVersion.current);
+    }
+    const source = new EventSource(`${API_BASE}/api/playlists/events?${params}`);
+    source.addEventListener('playlists', (event) => applyPlaylistDelta(JSON.parse(event.data)));
+    return () => source.close();
+  }, [user]);
+  
   useEffect(() => {
     if (audioRef.current) {
       if (isPlaying) {
@@ -262,6 +339,23 @@ const App = () => {
     }
   }, [isPlaying, currentTrack]);
   
+  useEffect(() => {
+    // Peaks are precomputed server-side; the hashed URL is cached by the browser
+    setWaveform(null);
+    const url = currentTrack?.waveform?.status === 'ready' && currentTrack.waveform.url;
+    if (!url) return;
+    let cancelled = false;
+    fetch(`${API_BASE}${url}&buckets=256&format=base64`)
+      .then(response => (response.ok ? response.json() : null))
+      .then(data => {
+        if (!cancelled && data) {
+          setWaveform(Array.from(atob(data.peaks), ch => ch.charCodeAt(0) / 255));
+        }
+      })
+      .catch(() => {});
+    return () => { cancelled = true; };
+  }, [currentTrack]);
+  
   // Render components
   const renderAuth = () => (
     <div className="auth-container">
@@ -335,7 +429,7 @@ const App = () => {
         <>
           <audio
             ref={audioRef}
-            src={currentTrack.audio_url}
+            src={resolveAudioUrl(currentTrack.audio_url)}
             onTimeUpdate={handleTimeUpdate}
             onLoadedMetadata={handleLoadedMetadata}
             onEnded={() => skipTrack('next')}
@@ -356,14 +450,23 @@ const App = () => {
           </div>
           <div className="player-progress">
             <span>{formatTime(currentTime)}</span>
-            <input
-              type="range"
-              min="0"
-              max="100"
-              value={duration ? (currentTime / duration) * 100 : 0}
-              onChange={handleSeek}
-              className="progress-bar"
-            />
+            <div className="progress-track">
+              {waveform && (
+                <div className="waveform">
+                  {waveform.map((peak, i) => (
+                    <span key={i} style={{ height: `${Math.max(peak * 100, 4)}%` }} />
+                  ))}
+                </div>
+              )}
+              <input
+                type="range"
+                min="0"
+                max="100"
+                value={duration ? (currentTime / duration) * 100 : 0}
+                onChange={handleSeek}
+                className="progress-bar"
+              />
+            </div>
             <span>{formatTime(duration)}</span>
           </div>
           <div className="player-volume">